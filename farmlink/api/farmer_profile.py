@@ -0,0 +1,161 @@
+# Copyright (c) 2026, vulerotech and contributors
+# For license information, please see license.txt
+"""
+Farmer 360 endpoint for the collection point.
+
+At the weighing scale the collector needs the farmer, their farms, recent purchases,
+what is still owed and the last payment. Fetching that piece by piece meant a
+request per piece, and ``get_payment_summary`` alone loads a whole Purchases
+doc and sums its payments. ``get_farmer_profile`` answers with one payload:
+
+* the farmer row, read through ``frappe.get_list`` on every call so the
+  Farmers permission query decides who may see it;
+* farms, recent purchases, the balance and the last payment, four indexed
+  queries on ``farmer``. The balance sums the Purchases rollup columns
+  (``paid_amount`` / ``outstanding_amount``) kept by ``payment_rollup``.
+
+The second part is cached per farmer for ``PROFILE_TTL`` seconds. The
+Purchases, Payment and Farms hooks call ``invalidate`` for the farmers they
+touch, so a new purchase or payment shows on the next call, not after the TTL.
+"""
+
+from __future__ import annotations
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt
+
+PROFILE_TTL = 300
+RECENT_PURCHASES = 10
+MAX_RECENT_PURCHASES = 50
+
+_CACHE_PREFIX = "farmlink:farmer_profile"
+
+FARMER_FIELDS = (
+	"name",
+	"full_name",
+	"phone_number",
+	"secondary_phone",
+	"territory",
+	"kebele",
+	"site_name",
+	"preferred_payment_method",
+	"telebirr_phone_number",
+	"bank_name",
+	"bank_account_number",
+	"farmers_photo",
+)
+
+
+def _cache_key(farmer: str) -> str:
+	return f"{_CACHE_PREFIX}:{farmer}"
+
+
+@frappe.whitelist()
+def get_farmer_profile(farmer: str, purchases: int | None = None) -> dict:
+	"""Farmer, farms, recent purchases, balance and last payment in one payload."""
+	limit = min(cint(purchases) or RECENT_PURCHASES, MAX_RECENT_PURCHASES)
+	rows = frappe.get_list("Farmers", filters={"name": farmer}, fields=list(FARMER_FIELDS), limit=1)
+	if not rows:
+		frappe.throw(_("Farmer {0} not found").format(farmer), frappe.DoesNotExistError)
+
+	# Only the default page size is cached; the collection point never asks for more.
+	if limit != RECENT_PURCHASES:
+		return {"farmer": rows[0], **_activity(farmer, limit)}
+	cache = frappe.cache()
+	activity = cache.get_value(_cache_key(farmer))
+	if activity is None:
+		activity = _activity(farmer, limit)
+		cache.set_value(_cache_key(farmer), activity, expires_in_sec=PROFILE_TTL)
+	return {"farmer": rows[0], **activity}
+
+
+def _activity(farmer: str, limit: int) -> dict:
+	farms = frappe.db.sql(
+		"""
+		SELECT name, territory, kebele, altitude, polygon_area_ha, date_recorded
+		FROM `tabFarms`
+		WHERE farmer = %s
+		ORDER BY creation
+		""",
+		(farmer,),
+		as_dict=True,
+	)
+	recent = frappe.db.sql(
+		"""
+		SELECT name, purchase_date, collection_center, maturity, coffee_type,
+			weight_in_kg, price_rate_of_the_day, total_price,
+			paid_amount, outstanding_amount, status
+		FROM `tabPurchases`
+		WHERE farmer = %s AND docstatus < 2
+		ORDER BY purchase_date DESC, creation DESC
+		LIMIT %s
+		""",
+		(farmer, limit),
+		as_dict=True,
+	)
+	totals = frappe.db.sql(
+		"""
+		SELECT COUNT(*) AS purchase_count,
+			SUM(weight_in_kg) AS weight_kg,
+			SUM(total_price) AS total_price,
+			SUM(paid_amount) AS paid_amount,
+			SUM(outstanding_amount) AS outstanding_amount,
+			SUM(outstanding_amount > 0) AS open_purchases,
+			MAX(purchase_date) AS last_purchase_date
+		FROM `tabPurchases`
+		WHERE farmer = %s AND docstatus < 2
+		""",
+		(farmer,),
+		as_dict=True,
+	)[0]
+	last_payment = frappe.db.sql(
+		"""
+		SELECT name, purchase_invoice, payment_date, payment_amount,
+			mode_of_payment, transaction_number
+		FROM `tabPayment`
+		WHERE farmer = %s AND docstatus != 2
+		ORDER BY payment_date DESC, creation DESC
+		LIMIT 1
+		""",
+		(farmer,),
+		as_dict=True,
+	)
+	return {
+		"farms": farms,
+		"recent_purchases": recent,
+		"balance": {
+			"purchase_count": cint(totals.purchase_count),
+			"weight_kg": flt(totals.weight_kg, 3),
+			"total_price": flt(totals.total_price, 2),
+			"paid_amount": flt(totals.paid_amount, 2),
+			"outstanding_amount": flt(totals.outstanding_amount, 2),
+			"open_purchases": cint(totals.open_purchases),
+			"last_purchase_date": totals.last_purchase_date,
+		},
+		"last_payment": last_payment[0] if last_payment else None,
+	}
+
+
+def invalidate(farmers) -> None:
+	"""Drop cached profiles now and again once the writing transaction ends.
+
+	Same two passes as ``stock_balance.invalidate_positions``: the second
+	covers a reader that cached the pre-commit state in between.
+	"""
+	farmers = {farmer for farmer in farmers if farmer}
+	if not farmers:
+		return
+
+	def drop():
+		frappe.cache().delete_value([_cache_key(farmer) for farmer in farmers])
+
+	drop()
+	frappe.db.after_commit.add(drop)
+	frappe.db.after_rollback.add(drop)
+
+
+def invalidate_for(doc, method=None) -> None:
+	"""Purchases / Payment / Farms hooks: invalidate the old and new farmer."""
+	before = None if method == "on_trash" or doc.flags.in_insert else doc.get_doc_before_save()
+	invalidate({doc.get("farmer"), before.get("farmer") if before else None})
@@ -0,0 +1,305 @@
+# Copyright (c) 2026, vulerotech and contributors
+# For license information, please see license.txt
+"""
+Farmer search for the collection point.
+
+Looking a farmer up used to be ``LIKE '%...%'`` on ``full_name`` and
+``phone_number``, a full scan of Farmers that also misses the usual
+transliteration variants of Ethiopian names (Tesfaye / Tesfay / Tesfaie,
+Mohammed / Muhammad). Farmer Search Key is an inverted index with one row per
+(farmer, key) and the farmer's territory:
+
+* **Phone** — every phone on the farmer with the country code or trunk ``0``
+  stripped (``+251 911 22 33 44`` and ``0911223344`` both become
+  ``911223344``), so any typed form prefix-matches;
+* **Name** — each casefolded, accent-free name part, for prefix matching;
+* **Phonetic** — a consonant skeleton of each Latin name part (first letter,
+  then consonants with digraphs folded, repeats collapsed), so vowel and
+  doubling variants meet on one key;
+* **Trigram** — padded character trigrams of each name part, for the fuzzy
+  fallback when nothing matches by prefix or sound.
+
+Every lookup is a range or equality scan on the ``(key_type, search_key,
+territory)`` index, grouped by farmer. Farmers.validate calls
+``index_farmer`` after ``set_full_name``, and rewrites the keys only when they
+changed. Bulk paths that skip the controller call ``index_rows`` for the
+farmers they insert, and ``rebuild`` reindexes everything in keyset chunks.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import re
+import unicodedata
+
+import frappe
+from frappe import _
+from frappe.desk.reportview import build_match_conditions
+from frappe.utils import cint, now_datetime
+
+KEY = "Farmer Search Key"
+
+PAGE_LENGTH = 20
+MAX_PAGE_LENGTH = 100
+MIN_PREFIX = 2
+MIN_PHONE_PREFIX = 3
+# Share of the query's trigrams a farmer must have to count as a fuzzy match.
+TRIGRAM_MATCH = 0.5
+
+_REBUILD_CHUNK = 1000
+_PHONE_FIELDS = ("phone_number", "secondary_phone", "telebirr_phone_number")
+_NAME_FIELDS = ("first_name", "middle_name", "last_name")
+_KEY_FIELDS = (
+	"name",
+	"creation",
+	"modified",
+	"owner",
+	"modified_by",
+	"farmer",
+	"key_type",
+	"search_key",
+	"territory",
+)
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+_DIGRAPHS = (("ph", "f"), ("sh", "s"), ("ch", "c"), ("kh", "k"), ("ts", "s"), ("tz", "s"), ("ck", "k"))
+_LETTER_MAP = str.maketrans({"q": "k", "v": "b", "z": "s"})
+_SILENT = set("aeiouywh")
+
+
+# ---------- keys ----------
+
+
+def normalize_phone(value) -> str:
+	digits = re.sub(r"\D", "", value or "")
+	if digits.startswith("251"):
+		digits = digits[3:]
+	return digits.lstrip("0")
+
+
+def name_tokens(value) -> list[str]:
+	text = unicodedata.normalize("NFKD", value or "")
+	text = "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+	return _TOKEN_RE.findall(text)
+
+
+def phonetic(token: str) -> str:
+	"""Consonant skeleton of a Latin name part; "" for other scripts or too short a skeleton."""
+	if len(token) < 2 or not token.isascii() or not token.isalpha():
+		return ""
+	for digraph, letter in _DIGRAPHS:
+		token = token.replace(digraph, letter)
+	token = token.translate(_LETTER_MAP)
+	code = token[0]
+	for letter in token[1:]:
+		if letter not in _SILENT and letter != code[-1]:
+			code += letter
+	return code if len(code) > 1 else ""
+
+
+def trigrams(token: str) -> set[str]:
+	padded = f" {token} "
+	return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def farmer_keys(farmer) -> set[tuple[str, str]]:
+	"""``{(key_type, search_key)}`` for a Farmers doc or row."""
+	keys = set()
+	for field in _PHONE_FIELDS:
+		phone = normalize_phone(farmer.get(field))
+		if len(phone) >= MIN_PHONE_PREFIX:
+			keys.add(("Phone", phone[:140]))
+	for field in _NAME_FIELDS:
+		for token in name_tokens(farmer.get(field)):
+			keys.add(("Name", token[:140]))
+			code = phonetic(token)
+			if code:
+				keys.add(("Phonetic", code[:140]))
+			keys.update(("Trigram", gram) for gram in trigrams(token))
+	return keys
+
+
+def _key_name(farmer: str, key_type: str, search_key: str) -> str:
+	return hashlib.md5(f"{farmer}\x1f{key_type}\x1f{search_key}".encode()).hexdigest()
+
+
+def _key_rows(farmer: str, territory, keys, now, user) -> list[tuple]:
+	return [
+		(_key_name(farmer, key_type, key), now, now, user, user, farmer, key_type, key, territory)
+		for key_type, key in sorted(keys)
+	]
+
+
+# ---------- maintenance ----------
+
+
+def index_farmer(doc) -> None:
+	"""Farmers.validate: rewrite the farmer's keys if they or the territory changed."""
+	keys = farmer_keys(doc)
+	territory = doc.get("territory") or None
+	current = frappe.db.sql(
+		f"SELECT key_type, search_key, territory FROM `tab{KEY}` WHERE farmer = %s",
+		(doc.name,),
+	)
+	if {(key_type, key) for key_type, key, _territory in current} == keys and all(
+		row[2] == territory for row in current
+	):
+		return
+	frappe.db.delete(KEY, {"farmer": doc.name})
+	if keys:
+		frappe.db.bulk_insert(
+			KEY,
+			fields=list(_KEY_FIELDS),
+			values=_key_rows(doc.name, territory, keys, now_datetime(), frappe.session.user),
+		)
+
+
+def remove_farmer(doc) -> None:
+	frappe.db.delete(KEY, {"farmer": doc.name})
+
+
+def index_rows(farmers) -> None:
+	"""Insert keys for new farmers given as dicts (name, territory, phones, name parts)."""
+	now = now_datetime()
+	user = frappe.session.user
+	values = []
+	for farmer in farmers:
+		values.extend(_key_rows(farmer["name"], farmer.get("territory"), farmer_keys(farmer), now, user))
+	if values:
+		frappe.db.bulk_insert(KEY, fields=list(_KEY_FIELDS), values=values, chunk_size=5000)
+
+
+def rebuild(chunk_size: int = _REBUILD_CHUNK) -> int:
+	"""Reindex every farmer in keyset chunks; returns the number indexed."""
+	frappe.db.sql(f"DELETE FROM `tab{KEY}`")
+	fields = ", ".join(("name", "territory", *_PHONE_FIELDS, *_NAME_FIELDS))
+	last = ""
+	indexed = 0
+	while True:
+		farmers = frappe.db.sql(
+			f"SELECT {fields} FROM `tabFarmers` WHERE name > %s ORDER BY name LIMIT %s",
+			(last, chunk_size),
+			as_dict=True,
+		)
+		index_rows(farmers)
+		indexed += len(farmers)
+		if len(farmers) < chunk_size:
+			break
+		last = farmers[-1].name
+	return indexed
+
+
+# ---------- search ----------
+
+
+@frappe.whitelist()
+def search_farmers(
+	query: str,
+	territory: str | None = None,
+	page: int = 1,
+	page_length: int = PAGE_LENGTH,
+	mode: str | None = None,
+) -> dict:
+	"""Prefix search by phone or name parts, falling back to fuzzy name matching.
+
+	A query with digits searches phones; otherwise every word must prefix-match
+	or sound like one of the farmer's name parts. When that finds nothing, the
+	farmers sharing most of the query's trigrams are returned instead. The
+	response's ``mode`` says which; pass it back when asking for the next page.
+	``territory`` includes its whole subtree.
+	"""
+	page = max(cint(page), 1)
+	page_length = min(max(cint(page_length) or PAGE_LENGTH, 1), MAX_PAGE_LENGTH)
+	scope_sql, params = _scope(territory)
+	params.update(limit=page_length + 1, offset=(page - 1) * page_length)
+
+	digits = normalize_phone(query) if re.search(r"\d", query or "") else ""
+	tokens = [] if digits else [token for token in name_tokens(query) if len(token) >= MIN_PREFIX]
+	if digits:
+		if len(digits) < MIN_PHONE_PREFIX:
+			return _page([], "phone", page, page_length)
+		params["phone"] = f"{digits}%"
+		rows = _search("k.key_type = 'Phone' AND k.search_key LIKE %(phone)s", "1", "1", scope_sql, params)
+		return _page(rows, "phone", page, page_length)
+	if not tokens:
+		return _page([], "prefix", page, page_length)
+
+	if mode != "fuzzy":
+		rows = _search(*_token_match(tokens, params), scope_sql, params)
+		if rows or page > 1:
+			return _page(rows, "prefix", page, page_length)
+
+	grams = sorted(set().union(*(trigrams(token) for token in tokens)))
+	params.update(grams=tuple(grams), min_grams=max(2, math.ceil(len(grams) * TRIGRAM_MATCH)))
+	rows = _search(
+		"k.key_type = 'Trigram' AND k.search_key IN %(grams)s",
+		"COUNT(*)",
+		"COUNT(*) >= %(min_grams)s",
+		scope_sql,
+		params,
+	)
+	return _page(rows, "fuzzy", page, page_length)
+
+
+def _scope(territory) -> tuple[str, dict]:
+	if not territory:
+		return "", {}
+	bounds = frappe.db.get_value("Territory", territory, ["lft", "rgt"])
+	if not bounds:
+		frappe.throw(_("Territory {0} not found").format(territory))
+	return (
+		" AND k.territory IN (SELECT name FROM `tabTerritory` WHERE lft >= %(lft)s AND rgt <= %(rgt)s)",
+		{"lft": bounds[0], "rgt": bounds[1]},
+	)
+
+
+def _token_match(tokens, params) -> tuple[str, str, str]:
+	"""WHERE, score and HAVING for "every token matches some key" by prefix or sound."""
+	clauses = []
+	for i, token in enumerate(tokens):
+		params[f"prefix{i}"] = f"{token}%"
+		clause = f"(k.key_type = 'Name' AND k.search_key LIKE %(prefix{i})s)"
+		code = phonetic(token)
+		if code:
+			params[f"sound{i}"] = code
+			clause = f"({clause} OR (k.key_type = 'Phonetic' AND k.search_key = %(sound{i})s))"
+		clauses.append(clause)
+	# One condition per token: a single name part may satisfy several tokens
+	# ("te tesfaye" against "Tesfaye Tekle").
+	return (
+		"(" + " OR ".join(clauses) + ")",
+		"SUM(k.key_type = 'Name')",
+		" AND ".join(f"SUM({clause}) > 0" for clause in clauses),
+	)
+
+
+def _search(where: str, score: str, having: str, scope_sql: str, params: dict) -> list[dict]:
+	match = build_match_conditions("Farmers")
+	return frappe.db.sql(
+		f"""
+		SELECT k.farmer AS name, {score} AS score,
+			MIN(`tabFarmers`.full_name) AS full_name,
+			MIN(`tabFarmers`.phone_number) AS phone_number,
+			MIN(`tabFarmers`.territory) AS territory,
+			MIN(`tabFarmers`.site_name) AS site_name
+		FROM `tab{KEY}` k
+		INNER JOIN `tabFarmers` ON `tabFarmers`.name = k.farmer
+		WHERE {where}{scope_sql}{f" AND ({match})" if match else ""}
+		GROUP BY k.farmer
+		HAVING {having}
+		ORDER BY score DESC, full_name, k.farmer
+		LIMIT %(limit)s OFFSET %(offset)s
+		""",
+		params,
+		as_dict=True,
+	)
+
+
+def _page(rows, mode: str, page: int, page_length: int) -> dict:
+	return {
+		"results": rows[:page_length],
+		"mode": mode,
+		"page": page,
+		"has_more": len(rows) > page_length,
+	}
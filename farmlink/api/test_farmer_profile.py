@@ -0,0 +1,83 @@
+import time
+from contextlib import contextmanager
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, today
+
+from farmlink.api.farmer_profile import _cache_key, get_farmer_profile
+from farmlink.tests.utils import make_center, make_farmer, make_payment, make_purchase, make_territory
+
+# Query budgets for one profile on a farmer with a season of purchases. Cold
+# is the farmer gate plus the four activity queries; warm is the gate alone.
+# Wall-clock time depends on the machine, so it is logged, not asserted.
+MAX_COLD_QUERIES = 8
+MAX_WARM_QUERIES = 4
+
+
+@contextmanager
+def _count_queries():
+	counter = frappe._dict(count=0)
+	original = frappe.db.sql
+
+	def counting_sql(*args, **kwargs):
+		counter.count += 1
+		return original(*args, **kwargs)
+
+	frappe.db.sql = counting_sql
+	try:
+		yield counter
+	finally:
+		frappe.db.sql = original
+
+
+class TestFarmerProfile(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.territory = make_territory("_Test Profile Territory")
+		cls.center = make_center("_Test Profile Center", cls.territory)
+
+	def setUp(self):
+		self.farmer = make_farmer(self.territory, first_name="Profile", phone_number="0911000111").name
+		frappe.get_doc({"doctype": "Farms", "farmer": self.farmer, "territory": self.territory}).insert()
+		self.purchases = [
+			make_purchase(self.farmer, self.center, purchase_date=add_days(today(), -day)).name
+			for day in range(60)
+		]
+		frappe.cache().delete_value(_cache_key(self.farmer))
+
+	def test_profile_within_query_budget(self):
+		with _count_queries() as cold_queries:
+			started = time.perf_counter()
+			profile = get_farmer_profile(self.farmer)
+			cold_ms = (time.perf_counter() - started) * 1000
+		with _count_queries() as warm_queries:
+			started = time.perf_counter()
+			get_farmer_profile(self.farmer)
+			warm_ms = (time.perf_counter() - started) * 1000
+
+		self.assertEqual(profile["farmer"]["name"], self.farmer)
+		self.assertEqual(len(profile["farms"]), 1)
+		self.assertEqual(len(profile["recent_purchases"]), 10)
+		self.assertEqual(profile["recent_purchases"][0]["name"], self.purchases[0])
+		self.assertEqual(profile["balance"]["purchase_count"], 60)
+		self.assertAlmostEqual(profile["balance"]["outstanding_amount"], 60000)
+		self.assertIsNone(profile["last_payment"])
+
+		self.assertLessEqual(cold_queries.count, MAX_COLD_QUERIES)
+		self.assertLessEqual(warm_queries.count, MAX_WARM_QUERIES)
+		frappe.logger("farmlink.farmer_profile").info(
+			f"farmer profile: cold {cold_ms:.1f} ms / {cold_queries.count} queries, "
+			f"warm {warm_ms:.1f} ms / {warm_queries.count} queries"
+		)
+
+	def test_payment_invalidates_cached_profile(self):
+		get_farmer_profile(self.farmer)
+		payment = make_payment(self.purchases[0], 400)
+
+		profile = get_farmer_profile(self.farmer)
+
+		self.assertEqual(profile["last_payment"]["name"], payment.name)
+		self.assertAlmostEqual(profile["balance"]["paid_amount"], 400)
+		self.assertAlmostEqual(profile["balance"]["outstanding_amount"], 59600)
@@ -0,0 +1,60 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from farmlink.api.farmer_search import KEY, search_farmers
+from farmlink.tests.utils import make_farmer, make_territory
+
+
+class TestFarmerSearch(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.territory = make_territory("_Test Search Territory")
+
+	def _farmer(self, first, middle, last=None, phone=None):
+		return make_farmer(
+			self.territory, first_name=first, middle_name=middle, last_name=last, phone_number=phone
+		)
+
+	def _names(self, result):
+		return [row["name"] for row in result["results"]]
+
+	def test_phone_prefix_matches_any_typed_form(self):
+		farmer = self._farmer("Abebe", "Zqphone", phone="+251 911 55 44 33")
+
+		for query in ("0911554", "911554433", "+251911"):
+			result = search_farmers(query, territory=self.territory)
+			self.assertEqual(result["mode"], "phone")
+			self.assertIn(farmer.name, self._names(result))
+
+	def test_name_prefix_and_transliteration_variants(self):
+		farmer = self._farmer("Tesfaye", "Zqmohammed")
+
+		self.assertIn(farmer.name, self._names(search_farmers("tesf zqmoh", territory=self.territory)))
+		# Two query words may both match the same name part.
+		self.assertIn(farmer.name, self._names(search_farmers("tesf tesfaye", territory=self.territory)))
+		variant = search_farmers("Tesfay Zqmuhammad", territory=self.territory)
+		self.assertEqual(variant["mode"], "prefix")
+		self.assertIn(farmer.name, self._names(variant))
+
+	def test_fuzzy_fallback_and_reindex_on_save(self):
+		farmer = self._farmer("Zqgebremedhin", "Zqwoldegiorgis")
+
+		result = search_farmers("Zqgebrenedhin Zqwoldegiorgis", territory=self.territory)
+		self.assertEqual(result["mode"], "fuzzy")
+		self.assertIn(farmer.name, self._names(result))
+
+		farmer.first_name = "Zqrenamed"
+		farmer.save()
+		self.assertFalse(frappe.db.exists(KEY, {"farmer": farmer.name, "search_key": "zqgebremedhin"}))
+		self.assertIn(farmer.name, self._names(search_farmers("zqren", territory=self.territory)))
+
+	def test_pagination(self):
+		names = {self._farmer("Zqpage", f"Member{i}").name for i in range(5)}
+
+		first = search_farmers("zqpage", territory=self.territory, page_length=3)
+		second = search_farmers("zqpage", territory=self.territory, page=2, page_length=3)
+
+		self.assertTrue(first["has_more"])
+		self.assertFalse(second["has_more"])
+		self.assertEqual(set(self._names(first)) | set(self._names(second)), names)
@@ -0,0 +1,102 @@
+"""
+Bench CLI commands for FarmLink.
+
+Frappe picks up the ``commands`` list below, so each entry is available as
+``bench --site <site> <command>``.
+"""
+
+import json
+
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("farmlink-reconcile-stock-balance")
+@click.option("--repair", is_flag=True, default=False, help="Rebuild the balance table if it has drifted.")
+@pass_context
+def reconcile_stock_balance(context, repair=False):
+	"""Prove Coffee Stock Balance matches a full Coffee Stock Ledger scan."""
+	import frappe
+
+	from farmlink.supply_chain.stock_balance import reconcile
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		result = reconcile(repair=repair)
+		if result["repaired"]:
+			frappe.db.commit()
+	finally:
+		frappe.destroy()
+
+	click.echo(json.dumps(result, indent=1, default=str))
+	if result["mismatches"] and not result["repaired"]:
+		raise SystemExit(1)
+
+
+@click.command("farmlink-repost-stock-ledger")
+@click.option(
+	"--doctype", "doctypes", multiple=True, help="Source doctype to repost (repeatable; default all)."
+)
+@click.option("--from-date", help="Only documents whose event date is on or after this date.")
+@click.option("--to-date", help="Only documents whose event date is on or before this date.")
+@click.option("--workers", type=int, default=1, show_default=True, help="Processes, partitioned by center.")
+@click.option("--chunk-size", type=int, default=200, show_default=True, help="Documents per transaction.")
+@click.option("--dry-run", is_flag=True, default=False, help="Report the diff without keeping any change.")
+@click.option("--run-id", help="Resume this run from its checkpoints.")
+@pass_context
+def repost_stock_ledger(
+	context, doctypes=(), from_date=None, to_date=None, workers=1, chunk_size=200, dry_run=False, run_id=None
+):
+	"""Recompute Coffee Stock Ledger entries from their source documents."""
+	import frappe
+
+	from farmlink.supply_chain.stock_repost import repost
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		frappe.set_user("Administrator")
+		result = repost(
+			doctypes=list(doctypes) or None,
+			from_date=from_date,
+			to_date=to_date,
+			workers=workers,
+			chunk_size=chunk_size,
+			dry_run=dry_run,
+			run_id=run_id,
+		)
+	finally:
+		frappe.destroy()
+
+	click.echo(json.dumps(result, indent=1, default=str))
+	if result["errors"]:
+		raise SystemExit(1)
+
+
+@click.command("farmlink-repair-payment-rollup")
+@click.option("--repair", is_flag=True, default=False, help="Rewrite drifted purchases from their payments.")
+@click.option("--chunk-size", type=int, default=500, show_default=True, help="Purchases per chunk.")
+@pass_context
+def repair_payment_rollup(context, repair=False, chunk_size=500):
+	"""Check Purchases paid/outstanding/status against their Payments."""
+	import frappe
+
+	from farmlink.supply_chain.payment_rollup import repair as repair_rollups
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		result = repair_rollups(repair=repair, chunk_size=chunk_size)
+	finally:
+		frappe.destroy()
+
+	click.echo(json.dumps(result, indent=1, default=str))
+	if result["drift"] and not result["repaired"]:
+		raise SystemExit(1)
+
+
+commands = [reconcile_stock_balance, repost_stock_ledger, repair_payment_rollup]
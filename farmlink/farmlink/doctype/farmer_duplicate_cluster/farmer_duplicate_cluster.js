@@ -0,0 +1,29 @@
+// Copyright (c) 2026, vulerotech and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("Farmer Duplicate Cluster", {
+	refresh(frm) {
+		if (frm.is_new() || frm.doc.status !== "Open") return;
+
+		frm.add_custom_button(__("Merge"), () => {
+			const others = frm.doc.members.filter((row) => row.farmer !== frm.doc.primary_farmer);
+			frappe.confirm(
+				__("Move every farm, purchase and payment of {0} to {1} and delete them?", [
+					others.map((row) => row.farmer).join(", "),
+					frm.doc.primary_farmer,
+				]),
+				() =>
+					frm.save().then(() =>
+						frm.call("merge").then(() => {
+							frappe.show_alert({ message: __("Farmers merged"), indicator: "green" });
+							frm.reload_doc();
+						})
+					)
+			);
+		}).addClass("btn-primary");
+
+		frm.add_custom_button(__("Not Duplicates"), () =>
+			frm.call("dismiss").then(() => frm.reload_doc())
+		);
+	},
+});
@@ -0,0 +1,23 @@
+import frappe
+from frappe import _
+from frappe.model.document import Document
+
+
+class FarmerDuplicateCluster(Document):
+	def validate(self):
+		members = {row.farmer for row in self.members}
+		if self.primary_farmer and self.primary_farmer not in members:
+			frappe.throw(_("Keep Farmer must be one of the cluster's members"))
+
+	@frappe.whitelist()
+	def merge(self):
+		from farmlink.utils.farmer_dedup import merge_cluster
+
+		return merge_cluster(self)
+
+	@frappe.whitelist()
+	def dismiss(self):
+		self.check_permission("write")
+		if self.status != "Open":
+			frappe.throw(_("Cluster {0} is already {1}").format(self.name, self.status))
+		self.db_set("status", "Dismissed")
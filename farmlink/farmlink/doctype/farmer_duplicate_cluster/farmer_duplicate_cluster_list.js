@@ -0,0 +1,25 @@
+// Copyright (c) 2026, vulerotech and contributors
+// For license information, please see license.txt
+
+frappe.listview_settings["Farmer Duplicate Cluster"] = {
+	onload(listview) {
+		listview.page.add_inner_button(__("Scan for Duplicates"), () => {
+			frappe.prompt(
+				{
+					fieldname: "territory",
+					fieldtype: "Link",
+					options: "Territory",
+					label: __("Territory"),
+					description: __("Leave empty to scan every farmer."),
+				},
+				(values) =>
+					frappe
+						.call("farmlink.utils.farmer_dedup.enqueue_scan", { territory: values.territory })
+						.then(() =>
+							frappe.show_alert({ message: __("Duplicate scan queued"), indicator: "blue" })
+						),
+				__("Scan for Duplicates")
+			);
+		});
+	},
+};
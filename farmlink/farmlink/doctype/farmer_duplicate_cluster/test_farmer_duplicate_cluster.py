@@ -0,0 +1,57 @@
+# Copyright (c) 2026, vulerotech and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import today
+
+from farmlink.tests.utils import make_center, make_farmer, make_payment, make_purchase, make_territory
+from farmlink.utils.farmer_dedup import clusters_from_pairs, merge_cluster, scan
+
+
+class TestFarmerDuplicateCluster(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.territory = make_territory("_Test Dedup Territory")
+		cls.center = make_center("_Test Dedup Center", cls.territory)
+
+	def _farmer(self, first, middle, phone=None):
+		return make_farmer(self.territory, first_name=first, middle_name=middle, phone_number=phone).name
+
+	def test_clusters_are_connected_components(self):
+		clusters = clusters_from_pairs({("a", "b"): 0.9, ("b", "c"): 0.9, ("x", "y"): 0.95})
+		self.assertEqual(clusters, [{"a", "b", "c"}, {"x", "y"}])
+
+	def test_scan_and_merge_repoints_links(self):
+		keep = self._farmer("Tesfaye", "Woldemariam", "0911778899")
+		duplicate = self._farmer("Tesfay", "Woldemaryam", "+251911778899")
+		unrelated = self._farmer("Almaz", "Bekele", "0922334455")
+		frappe.get_doc({"doctype": "Farms", "farmer": duplicate, "territory": self.territory}).insert()
+		purchase = make_purchase(duplicate, self.center, purchase_date=today())
+		payment = make_payment(purchase.name, 1000)
+		inspection = frappe.get_doc({"doctype": "Internal Inspection", "farmer": duplicate}).insert()
+
+		result = scan(self.territory, workers=1)
+
+		self.assertEqual(result["clusters"], 1)
+		cluster = frappe.get_doc("Farmer Duplicate Cluster", {"territory": self.territory, "status": "Open"})
+		self.assertEqual({row.farmer for row in cluster.members}, {keep, duplicate})
+		self.assertNotIn(unrelated, {row.farmer for row in cluster.members})
+		self.assertEqual(cluster.primary_farmer, keep)
+
+		merge_cluster(cluster)
+
+		self.assertFalse(frappe.db.exists("Farmers", duplicate))
+		self.assertEqual(frappe.db.get_value("Purchases", purchase.name, "farmer"), keep)
+		self.assertEqual(
+			frappe.db.get_value("Purchases", purchase.name, "phone"),
+			frappe.db.get_value("Farmers", keep, "phone_number"),
+		)
+		self.assertEqual(frappe.db.get_value("Payment", payment.name, "farmer"), keep)
+		self.assertEqual(frappe.db.get_value("Internal Inspection", inspection.name, "farmer"), keep)
+		self.assertEqual(frappe.db.count("Farms", {"farmer": keep}), 1)
+		self.assertEqual(frappe.db.get_value("Farmer Duplicate Cluster", cluster.name, "status"), "Merged")
+
+		# A merged member set is not raised again.
+		self.assertEqual(scan(self.territory, workers=1)["clusters"], 0)
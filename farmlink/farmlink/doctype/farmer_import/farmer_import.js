@@ -0,0 +1,30 @@
+// Copyright (c) 2026, vulerotech and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("Farmer Import", {
+	refresh(frm) {
+		if (frm.is_new()) return;
+
+		if (["Draft", "Failed"].includes(frm.doc.status)) {
+			const label = frm.doc.processed_rows ? __("Resume Import") : __("Start Import");
+			frm.add_custom_button(label, () =>
+				frm.call("start_import").then(() => {
+					frappe.show_alert({ message: __("Farmer import queued"), indicator: "blue" });
+					frm.reload_doc();
+				})
+			).addClass("btn-primary");
+		}
+
+		if (frm.doc.status === "Queued") {
+			frm.dashboard.set_headline(
+				__("Importing in the background: {0} rows so far.", [frm.doc.processed_rows || 0])
+			);
+		}
+
+		if (frm.doc.error_rows) {
+			frm.add_custom_button(__("Row Errors"), () =>
+				frappe.set_route("List", "Farmer Import Error", { farmer_import: frm.doc.name })
+			);
+		}
+	},
+});
@@ -0,0 +1,16 @@
+import frappe
+from frappe import _
+from frappe.model.document import Document
+
+
+class FarmerImport(Document):
+	def on_trash(self):
+		if self.status == "Queued":
+			frappe.throw(_("Cannot delete a farmer import while it is running"))
+		frappe.db.delete("Farmer Import Error", {"farmer_import": self.name})
+
+	@frappe.whitelist()
+	def start_import(self):
+		from farmlink.utils.farmer_importer import enqueue_import
+
+		return enqueue_import(self)
@@ -0,0 +1,94 @@
+# Copyright (c) 2026, vulerotech and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from farmlink.tests.utils import make_territory
+from farmlink.utils.farmer_importer import import_register
+
+
+class TestFarmerImport(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.territory = make_territory("_Test Import Territory")
+
+	def _import(self, lines):
+		content = "\n".join(",".join(line) for line in lines)
+		file = frappe.get_doc(
+			{
+				"doctype": "File",
+				"file_name": f"register-{frappe.generate_hash(length=6)}.csv",
+				"content": content,
+			}
+		).insert()
+		return frappe.get_doc({"doctype": "Farmer Import", "import_file": file.file_url}).insert()
+
+	def test_register_rows_create_farmers_farms_and_errors(self):
+		ref = f"REG-{frappe.generate_hash(length=6)}"
+		doc = self._import(
+			[
+				(
+					"Register ID",
+					"First Name",
+					"Middle Name",
+					"Phone Number",
+					"Territory",
+					"Gender",
+					"Harvest 2016 (kg)",
+					"Farm Kebele",
+					"Farm Latitude",
+					"Farm Longitude",
+				),
+				(
+					ref,
+					"Abebe",
+					"Kebede",
+					"0911000222",
+					self.territory.lower(),
+					"male",
+					"1200",
+					"Gedeb 01",
+					"6.1",
+					"38.2",
+				),
+				(ref, "", "", "", "", "", "", "Gedeb 02", "", ""),
+				("", "Almaz", "Tadesse", "", "No Such Territory", "", "", "", "", ""),
+				("", "Hana", "", "", self.territory, "", "", "", "", ""),
+				("", "Kebede", "Alemu", "", self.territory, "", "lots", "", "", ""),
+				("", "", "", "", "", "", "", "", "", ""),
+			]
+		)
+
+		# The test case rolls back; the job's per-chunk commits would defeat it.
+		counts = import_register(doc, commit=lambda: None)
+
+		self.assertEqual(
+			counts,
+			{"processed_rows": 7, "imported_farmers": 1, "imported_farms": 2, "error_rows": 3},
+		)
+		farmer = frappe.get_doc("Farmers", {"register_id": ref})
+		self.assertEqual(farmer.full_name, "Abebe Kebede")
+		self.assertEqual(farmer.territory, self.territory)
+		self.assertEqual(farmer.gender, "Male")
+		self.assertEqual(
+			[(row.year_in_ec, row.harvested_coffee_in_kilograms) for row in farmer.harvest_data],
+			[("2016", 1200)],
+		)
+		self.assertEqual(
+			sorted(frappe.get_all("Farms", filters={"farmer": farmer.name}, pluck="kebele")),
+			["Gedeb 01", "Gedeb 02"],
+		)
+		self.assertTrue(frappe.db.exists("Farmer Search Key", {"farmer": farmer.name, "key_type": "Phone"}))
+		self.assertEqual(
+			frappe.get_all(
+				"Farmer Import Error", filters={"farmer_import": doc.name}, pluck="row_no", order_by="row_no"
+			),
+			[4, 5, 6],
+		)
+
+		# A restart continues after the committed rows instead of importing them again.
+		doc.reload()
+		self.assertEqual(import_register(doc, commit=lambda: None), counts)
+		self.assertEqual(frappe.db.count("Farmers", {"register_id": ref}), 1)
@@ -0,0 +1,10 @@
+import frappe
+from frappe.model.document import Document
+
+
+class FarmerImportError(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Farmer Import Error", ["farmer_import", "row_no"])
@@ -0,0 +1,13 @@
+import frappe
+from frappe.model.document import Document
+
+
+class FarmerSearchKey(Document):
+	pass
+
+
+def on_doctype_update():
+	# Prefix and exact lookups: key_type + search_key range scans, narrowed by territory.
+	frappe.db.add_index("Farmer Search Key", ["key_type", "search_key", "territory"])
+	# Reindexing a farmer replaces all of its keys.
+	frappe.db.add_index("Farmer Search Key", ["farmer"])
@@ -2,10 +2,14 @@
 # For license information, please see license.txt
 
 # import frappe
-from frappe.model.document import Document
 import re
 
-def _join_name_parts(*parts: str) -> str | None:
+from frappe.model.document import Document
+
+from farmlink.api import farmer_search
+
+
+def join_name_parts(*parts: str) -> str | None:
     """Join non-empty parts with single spaces, return None if all empty."""
     cleaned = []
     for p in parts:
@@ -22,6 +26,11 @@ class Farmers(Document):
     def validate(self):
         # Called on save (insert/update). You can also use before_save().
         self.set_full_name()
+        # Keep the search index in step with the names and phones just saved.
+        farmer_search.index_farmer(self)
+
+    def on_trash(self):
+        farmer_search.remove_farmer(self)
 
     # If you prefer before_save over validate, define before_save and call set_full_name there.
     # def before_save(self):
@@ -33,4 +42,4 @@ class Farmers(Document):
         middle = getattr(self, "middle_name", None)
         last = getattr(self, "last_name", None)
 
-        self.full_name = _join_name_parts(first, middle, last)
+        self.full_name = join_name_parts(first, middle, last)
@@ -0,0 +1,18 @@
+import frappe
+from frappe.model.document import Document
+
+
+class SyncIDMap(Document):
+	pass
+
+
+def on_doctype_update():
+	# One mapping per WatermelonDB row per user and device; also the lookup
+	# path used by the push preload (user + device_id + client_id IN (...)).
+	frappe.db.add_unique(
+		"Sync ID Map",
+		["mapped_by", "device_id", "mobile_table", "client_id"],
+		constraint_name="unique_user_device_table_client",
+	)
+	# Daily prune by age.
+	frappe.db.add_index("Sync ID Map", ["creation"])
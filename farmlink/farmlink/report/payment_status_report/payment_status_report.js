@@ -0,0 +1,80 @@
+// Copyright (c) 2025, vulerotech and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Payment Status Report"] = {
+	filters: [
+		{
+			fieldname: "group_by",
+			label: __("Group By"),
+			fieldtype: "Select",
+			options: "Purchase\nFarmer\nCenter\nTerritory",
+			default: "Purchase",
+			reqd: 1,
+		},
+		{
+			fieldname: "territory",
+			label: __("Territory"),
+			fieldtype: "Link",
+			options: "Territory",
+		},
+		{
+			fieldname: "center",
+			label: __("Center"),
+			fieldtype: "Link",
+			options: "Centers",
+		},
+		{
+			fieldname: "farmer",
+			label: __("Farmer"),
+			fieldtype: "Link",
+			options: "Farmers",
+		},
+		{
+			fieldname: "payment_status",
+			label: __("Payment Status"),
+			fieldtype: "Select",
+			options: "\nUnpaid\nPartially Paid\nPaid",
+		},
+		{
+			fieldname: "from_date",
+			label: __("From Date"),
+			fieldtype: "Date",
+		},
+		{
+			fieldname: "to_date",
+			label: __("To Date"),
+			fieldtype: "Date",
+		},
+		{
+			fieldname: "as_on",
+			label: __("As On"),
+			fieldtype: "Date",
+			default: frappe.datetime.get_today(),
+			reqd: 1,
+		},
+		{
+			fieldname: "page",
+			label: __("Page"),
+			fieldtype: "Int",
+			default: 1,
+		},
+		{
+			fieldname: "page_length",
+			label: __("Rows per Page"),
+			fieldtype: "Select",
+			options: "100\n500\n1000\n5000",
+			default: "500",
+		},
+	],
+
+	onload(report) {
+		report.page.add_inner_button(__("Export CSV"), () => {
+			const filters = report.get_filter_values();
+			const url =
+				"/api/method/farmlink.farmlink.report.payment_status_report.payment_status_report.export_csv" +
+				"?filters=" +
+				encodeURIComponent(JSON.stringify(filters));
+			window.open(url);
+		});
+	},
+};
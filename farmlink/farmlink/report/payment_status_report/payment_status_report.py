@@ -0,0 +1,363 @@
+# Copyright (c) 2025, vulerotech and contributors
+# For license information, please see license.txt
+
+"""
+Paid, outstanding and aging per purchase, farmer, center or territory.
+
+The report is as of the "As On" date: purchases dated after it are left out,
+and paid / outstanding / status come from the Payments dated on or before it,
+summed in one grouped subquery joined to Purchases. A page is one grouped
+query and the report summary is one more, whatever the season's size. Aging
+buckets split each purchase's outstanding amount by days since its purchase
+date.
+
+The territory filter covers the whole subtree under the chosen territory via
+the centers' territories (Purchases carry no territory of their own). Rows are
+scoped by the same permission query as the Purchases list.
+
+``export_csv`` streams every row for the same filters as CSV, one page of the
+grouped query at a time, so a full season never sits in memory at once.
+"""
+
+import csv
+import io
+
+import frappe
+from frappe import _
+from frappe.desk.reportview import build_match_conditions
+from frappe.utils import add_days, cint, flt, getdate, today
+from werkzeug.wrappers import Response
+
+AGING_BUCKETS = ((0, 30), (31, 60), (61, 90), (91, None))
+
+PAGE_LENGTH = 500
+_EXPORT_CHUNK = 5000
+
+# Paid, outstanding and status of a purchase as of %(as_on)s (see _FROM).
+_PAID = "IFNULL(paid_as_on.amount, 0)"
+_OUTSTANDING = f"GREATEST(IFNULL(`tabPurchases`.total_price, 0) - {_PAID}, 0)"
+_STATUS = f"""CASE
+	WHEN {_PAID} <= 0 THEN 'Unpaid'
+	WHEN {_OUTSTANDING} > 0 THEN 'Partially Paid'
+	ELSE 'Paid'
+END"""
+
+# group_by -> (key expression, extra selected columns, leading columns).
+# Labels are translated in get_columns, not at import.
+_GROUPS = {
+	"Purchase": (
+		"`tabPurchases`.name",
+		[
+			"MIN(`tabPurchases`.purchase_date) AS purchase_date",
+			"MIN(`tabPurchases`.farmer) AS farmer",
+			"MIN(farmer.full_name) AS farmer_name",
+			"MIN(`tabPurchases`.collection_center) AS center",
+			f"MIN({_STATUS}) AS payment_status",
+			"MIN(DATEDIFF(%(as_on)s, `tabPurchases`.purchase_date)) AS age_days",
+		],
+		[
+			{
+				"fieldname": "purchase",
+				"label": "Purchase",
+				"fieldtype": "Link",
+				"options": "Purchases",
+				"width": 150,
+			},
+			{"fieldname": "purchase_date", "label": "Date", "fieldtype": "Date", "width": 100},
+			{
+				"fieldname": "farmer",
+				"label": "Farmer",
+				"fieldtype": "Link",
+				"options": "Farmers",
+				"width": 120,
+			},
+			{"fieldname": "farmer_name", "label": "Farmer Name", "fieldtype": "Data", "width": 160},
+			{
+				"fieldname": "center",
+				"label": "Center",
+				"fieldtype": "Link",
+				"options": "Centers",
+				"width": 140,
+			},
+			{"fieldname": "payment_status", "label": "Status", "fieldtype": "Data", "width": 110},
+			{"fieldname": "age_days", "label": "Age (Days)", "fieldtype": "Int", "width": 90},
+		],
+	),
+	"Farmer": (
+		"`tabPurchases`.farmer",
+		["MIN(farmer.full_name) AS farmer_name", "MIN(farmer.territory) AS farmer_territory"],
+		[
+			{
+				"fieldname": "farmer",
+				"label": "Farmer",
+				"fieldtype": "Link",
+				"options": "Farmers",
+				"width": 120,
+			},
+			{"fieldname": "farmer_name", "label": "Farmer Name", "fieldtype": "Data", "width": 180},
+			{
+				"fieldname": "farmer_territory",
+				"label": "Territory",
+				"fieldtype": "Link",
+				"options": "Territory",
+				"width": 140,
+			},
+		],
+	),
+	"Center": (
+		"`tabPurchases`.collection_center",
+		["MIN(center.territory) AS territory"],
+		[
+			{
+				"fieldname": "center",
+				"label": "Center",
+				"fieldtype": "Link",
+				"options": "Centers",
+				"width": 160,
+			},
+			{
+				"fieldname": "territory",
+				"label": "Territory",
+				"fieldtype": "Link",
+				"options": "Territory",
+				"width": 140,
+			},
+		],
+	),
+	"Territory": (
+		"center.territory",
+		[],
+		[
+			{
+				"fieldname": "territory",
+				"label": "Territory",
+				"fieldtype": "Link",
+				"options": "Territory",
+				"width": 180,
+			},
+		],
+	),
+}
+
+_MEASURE_COLUMNS = [
+	{"fieldname": "purchases", "label": "Purchases", "fieldtype": "Int", "width": 90},
+	{"fieldname": "total_price", "label": "Total Price", "fieldtype": "Currency", "width": 130},
+	{"fieldname": "paid_amount", "label": "Paid", "fieldtype": "Currency", "width": 130},
+	{"fieldname": "outstanding_amount", "label": "Outstanding", "fieldtype": "Currency", "width": 130},
+]
+
+
+def _bucket_field(low, high) -> str:
+	return f"age_{low}_{high}" if high is not None else f"age_{low}_plus"
+
+
+def _bucket_label(low, high) -> str:
+	return _("{0}-{1} Days").format(low, high) if high is not None else _("{0}+ Days").format(low)
+
+
+def execute(filters=None):
+	filters = frappe._dict(filters or {})
+	group_by = _group_by(filters)
+	page = max(cint(filters.get("page")) or 1, 1)
+	page_length = cint(filters.get("page_length")) or PAGE_LENGTH
+
+	conditions = _conditions(filters)
+	data = _grouped_rows(conditions, group_by, limit=page_length, offset=(page - 1) * page_length)
+	totals = _totals(conditions)
+	message = _("Page {0} ({1} rows per page). Export CSV downloads every row.").format(page, page_length)
+	return get_columns(group_by), data, message, None, _summary(totals)
+
+
+def _group_by(filters) -> str:
+	group_by = filters.get("group_by") or "Purchase"
+	if group_by not in _GROUPS:
+		frappe.throw(_("Cannot group by {0}").format(group_by))
+	return group_by
+
+
+def get_columns(group_by: str) -> list[dict]:
+	columns = [
+		{**column, "label": _(column["label"])} for column in (*_GROUPS[group_by][2], *_MEASURE_COLUMNS)
+	]
+	for low, high in AGING_BUCKETS:
+		columns.append(
+			{
+				"fieldname": _bucket_field(low, high),
+				"label": _bucket_label(low, high),
+				"fieldtype": "Currency",
+				"width": 110,
+			}
+		)
+	return columns
+
+
+def _conditions(filters) -> tuple[str, dict]:
+	as_on = getdate(filters.get("as_on") or today())
+	# payment_date is a Datetime: everything before the day after As On.
+	params = {"as_on": as_on, "paid_before": add_days(as_on, 1)}
+	clauses = ["`tabPurchases`.docstatus < 2", "`tabPurchases`.purchase_date <= %(as_on)s"]
+
+	if filters.get("from_date"):
+		clauses.append("`tabPurchases`.purchase_date >= %(from_date)s")
+		params["from_date"] = getdate(filters.from_date)
+	if filters.get("to_date"):
+		clauses.append("`tabPurchases`.purchase_date <= %(to_date)s")
+		params["to_date"] = getdate(filters.to_date)
+	if filters.get("center"):
+		clauses.append("`tabPurchases`.collection_center = %(center)s")
+		params["center"] = filters.center
+	if filters.get("farmer"):
+		clauses.append("`tabPurchases`.farmer = %(farmer)s")
+		params["farmer"] = filters.farmer
+	if filters.get("payment_status"):
+		clauses.append(f"{_STATUS} = %(payment_status)s")
+		params["payment_status"] = filters.payment_status
+	if filters.get("territory"):
+		bounds = frappe.db.get_value("Territory", filters.territory, ["lft", "rgt"])
+		if not bounds:
+			frappe.throw(_("Territory {0} not found").format(filters.territory))
+		clauses.append("territory.lft >= %(lft)s AND territory.rgt <= %(rgt)s")
+		params["lft"], params["rgt"] = bounds
+
+	match = build_match_conditions("Purchases")
+	if match:
+		clauses.append(f"({match})")
+	return " AND ".join(clauses), params
+
+
+def _aging_selects() -> list[str]:
+	age = "DATEDIFF(%(as_on)s, `tabPurchases`.purchase_date)"
+	selects = []
+	for low, high in AGING_BUCKETS:
+		bounds = f"{age} >= {low}" + (f" AND {age} <= {high}" if high is not None else "")
+		selects.append(
+			f"SUM(CASE WHEN {bounds} THEN {_OUTSTANDING} ELSE 0 END)" f" AS {_bucket_field(low, high)}"
+		)
+	return selects
+
+
+_FROM = """
+	FROM `tabPurchases`
+	LEFT JOIN `tabCenters` center ON center.name = `tabPurchases`.collection_center
+	LEFT JOIN `tabTerritory` territory ON territory.name = center.territory
+	LEFT JOIN `tabFarmers` farmer ON farmer.name = `tabPurchases`.farmer
+	LEFT JOIN (
+		SELECT purchase_invoice, SUM(payment_amount) AS amount
+		FROM `tabPayment`
+		WHERE docstatus != 2 AND payment_date < %(paid_before)s
+		GROUP BY purchase_invoice
+	) paid_as_on ON paid_as_on.purchase_invoice = `tabPurchases`.name
+"""
+
+
+def _measure_selects() -> list[str]:
+	return [
+		"COUNT(*) AS purchases",
+		"SUM(IFNULL(`tabPurchases`.total_price, 0)) AS total_price",
+		f"SUM({_PAID}) AS paid_amount",
+		f"SUM({_OUTSTANDING}) AS outstanding_amount",
+		*_aging_selects(),
+	]
+
+
+def _grouped_rows(conditions, group_by: str, limit: int, offset: int = 0) -> list[dict]:
+	key, extra, columns = _GROUPS[group_by]
+	where, params = conditions
+	order = (
+		"MIN(`tabPurchases`.purchase_date) DESC, group_key DESC" if group_by == "Purchase" else "group_key"
+	)
+	rows = frappe.db.sql(
+		f"""
+		SELECT {key} AS group_key, {", ".join([*extra, *_measure_selects()])}
+		{_FROM}
+		WHERE {where}
+		GROUP BY {key}
+		ORDER BY {order}
+		LIMIT %(limit)s OFFSET %(offset)s
+		""",
+		{**params, "limit": limit, "offset": offset},
+		as_dict=True,
+	)
+	key_field = columns[0]["fieldname"]
+	for row in rows:
+		row[key_field] = row.pop("group_key")
+	return rows
+
+
+def _totals(conditions) -> frappe._dict:
+	where, params = conditions
+	rows = frappe.db.sql(
+		f"""
+		SELECT {", ".join(_measure_selects())}
+		{_FROM}
+		WHERE {where}
+		""",
+		params,
+		as_dict=True,
+	)
+	return rows[0] if rows else frappe._dict()
+
+
+def _summary(totals) -> list[dict]:
+	summary = [
+		{"value": cint(totals.get("purchases")), "label": _("Purchases"), "datatype": "Int"},
+		{"value": flt(totals.get("total_price")), "label": _("Total Price"), "datatype": "Currency"},
+		{
+			"value": flt(totals.get("paid_amount")),
+			"label": _("Paid"),
+			"datatype": "Currency",
+			"indicator": "Green",
+		},
+		{
+			"value": flt(totals.get("outstanding_amount")),
+			"label": _("Outstanding"),
+			"datatype": "Currency",
+			"indicator": "Red" if flt(totals.get("outstanding_amount")) > 0 else "Green",
+		},
+	]
+	for low, high in AGING_BUCKETS:
+		summary.append(
+			{
+				"value": flt(totals.get(_bucket_field(low, high))),
+				"label": _bucket_label(low, high),
+				"datatype": "Currency",
+				"indicator": "Orange",
+			}
+		)
+	return summary
+
+
+@frappe.whitelist()
+def export_csv(filters=None):
+	"""Stream the full report (every page) as CSV for the given filters."""
+	frappe.has_permission("Purchases", "report", throw=True)
+	filters = frappe._dict(frappe.parse_json(filters) if filters else {})
+	group_by = _group_by(filters)
+	columns = get_columns(group_by)
+	fieldnames = [column["fieldname"] for column in columns]
+	# Resolved while the request is live; the generator runs as the response is
+	# sent, after Frappe has closed the request's connection (sql reconnects).
+	conditions = _conditions(filters)
+
+	def generate():
+		buffer = io.StringIO()
+		writer = csv.writer(buffer)
+		writer.writerow([column["label"] for column in columns])
+		offset = 0
+		while True:
+			rows = _grouped_rows(conditions, group_by, limit=_EXPORT_CHUNK, offset=offset)
+			for row in rows:
+				writer.writerow([row.get(field) for field in fieldnames])
+			yield buffer.getvalue()
+			buffer.seek(0)
+			buffer.truncate(0)
+			if len(rows) < _EXPORT_CHUNK:
+				break
+			offset += _EXPORT_CHUNK
+
+	filename = f"payment-status-{group_by.lower()}-{today()}.csv"
+	return Response(
+		generate(),
+		mimetype="text/csv",
+		headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+	)
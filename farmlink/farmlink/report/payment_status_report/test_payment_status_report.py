@@ -0,0 +1,72 @@
+# Copyright (c) 2026, vulerotech and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+
+from farmlink.farmlink.report.payment_status_report.payment_status_report import execute
+from farmlink.tests.utils import make_center, make_farmer, make_payment, make_purchase, make_territory
+
+AS_ON = "2026-03-31"
+
+
+class TestPaymentStatusReport(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.territory = make_territory("_Test Report Territory")
+		cls.center = make_center("_Test Report Center", cls.territory)
+		farmer = make_farmer(cls.territory, first_name="Report").name
+
+		# 10, 45 and 120 days old on AS_ON, each with a total of 1000.
+		cls.recent = make_purchase(farmer, cls.center, purchase_date="2026-03-21").name
+		make_payment(cls.recent, 400, payment_date="2026-03-25 10:00:00")
+		cls.paid_later = make_purchase(farmer, cls.center, purchase_date="2026-02-14").name
+		make_payment(cls.paid_later, 1000, payment_date="2026-04-05 10:00:00")
+		cls.old = make_purchase(farmer, cls.center, purchase_date="2025-12-01").name
+		# Bought after AS_ON: not in the report at all.
+		make_purchase(farmer, cls.center, purchase_date="2026-04-10")
+
+	def _run(self, group_by, **filters):
+		columns, data, _message, _chart, summary = execute(
+			{"as_on": AS_ON, "center": self.center, "group_by": group_by, **filters}
+		)
+		return columns, data, summary
+
+	def test_purchase_rows_are_as_of_the_as_on_date(self):
+		_columns, data, _summary = self._run("Purchase")
+		rows = {row.purchase: row for row in data}
+
+		self.assertEqual(set(rows), {self.recent, self.paid_later, self.old})
+		self.assertEqual(rows[self.recent].payment_status, "Partially Paid")
+		self.assertEqual(rows[self.recent].age_days, 10)
+		# Its payment is dated after AS_ON.
+		self.assertEqual(rows[self.paid_later].payment_status, "Unpaid")
+		self.assertEqual(rows[self.paid_later].paid_amount, 0)
+
+	def test_center_group_splits_outstanding_into_aging_buckets(self):
+		columns, data, summary = self._run("Center")
+
+		self.assertEqual(columns[0]["fieldname"], "center")
+		(row,) = data
+		self.assertEqual(row.center, self.center)
+		self.assertEqual(row.territory, self.territory)
+		self.assertEqual(row.purchases, 3)
+		self.assertEqual(
+			{field: row[field] for field in ("total_price", "paid_amount", "outstanding_amount")},
+			{"total_price": 3000, "paid_amount": 400, "outstanding_amount": 2600},
+		)
+		self.assertEqual(
+			{field: row[field] for field in ("age_0_30", "age_31_60", "age_61_90", "age_91_plus")},
+			{"age_0_30": 600, "age_31_60": 1000, "age_61_90": 0, "age_91_plus": 1000},
+		)
+
+		values = {entry["label"]: entry["value"] for entry in summary}
+		self.assertEqual(values["Outstanding"], 2600)
+		self.assertEqual(values["91+ Days"], 1000)
+
+	def test_territory_filter_covers_its_centers(self):
+		_columns, data, _summary = self._run("Territory", territory=self.territory)
+
+		(row,) = data
+		self.assertEqual(row.territory, self.territory)
+		self.assertEqual(row.outstanding_amount, 2600)
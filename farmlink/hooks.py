@@ -194,6 +194,8 @@ permission_query_conditions = {
 	"Supplier": "farmlink.sync.permissions.get_for_supplier",
 	"Personnel": "farmlink.sync.permissions.get_for_personnel",
 	"Receipt String": "farmlink.sync.permissions.get_for_receipt_string",
+	"Purchase Daily Rollup": "farmlink.sync.permissions.get_for_purchase_daily_rollup",
+	"Purchase Anomaly": "farmlink.sync.permissions.get_for_purchase_anomaly",
 }
 
 # DocType Class
@@ -209,8 +211,11 @@ permission_query_conditions = {
 # Hook on document methods and events
 
 doc_events = {
+	"*": {
+		"before_validate": "farmlink.sync.link_cache.restore_link_check",
+	},
 	"Payment": {
-		"after_insert": "farmlink.hook_handlers.on_payment_change",
+		# on_update also runs on insert; after_insert would apply the delta twice.
 		"on_update": "farmlink.hook_handlers.on_payment_change",
 		"on_trash": [
 			"farmlink.hook_handlers.on_payment_change",
@@ -277,10 +282,19 @@ doc_events = {
 		"on_trash": "farmlink.sync.tombstones.record_tombstone",
 	},
 	"Farms": {
-		"on_trash": "farmlink.sync.tombstones.record_tombstone",
+		"on_update": "farmlink.hook_handlers.on_farm_change",
+		"on_trash": [
+			"farmlink.hook_handlers.on_farm_change",
+			"farmlink.sync.tombstones.record_tombstone",
+		],
 	},
 	"Purchases": {
-		"on_trash": "farmlink.sync.tombstones.record_tombstone",
+		"before_save": "farmlink.supply_chain.payment_rollup.on_purchase_save",
+		"on_update": "farmlink.hook_handlers.on_purchase_change",
+		"on_trash": [
+			"farmlink.hook_handlers.on_purchase_change",
+			"farmlink.sync.tombstones.record_tombstone",
+		],
 	},
 	"Territory": {
 		"on_trash": "farmlink.sync.tombstones.record_tombstone",
@@ -303,23 +317,14 @@ doc_events = {
 # Scheduled Tasks
 # ----------
 
-# scheduler_events = {
-# 	"all": [
-# 		"farmlink.tasks.all"
-# 	],
-# 	"daily": [
-# 		"farmlink.tasks.daily"
-# 	],
-# 	"hourly": [
-# 		"farmlink.tasks.hourly"
-# 	],
-# 	"weekly": [
-# 		"farmlink.tasks.weekly"
-# 	],
-# 	"monthly": [
-# 		"farmlink.tasks.monthly"
-# 	],
-# }
+scheduler_events = {
+	"daily": [
+		"farmlink.supply_chain.stock_snapshot.take_daily_snapshots",
+		"farmlink.supply_chain.stock_archive.compact_cancelled_entries",
+		"farmlink.supply_chain.purchase_anomalies.run_daily",
+		"farmlink.sync.id_map.prune",
+	],
+}
 
 # Testing
 # -------
@@ -348,6 +353,9 @@ doc_events = {
 # -----------------------------------------------------------
 
 # ignore_links_on_delete = ["Communication", "ToDo"]
+# A merged-away farmer stays listed on its duplicate cluster, and its search
+# keys go in Farmers.on_trash.
+ignore_links_on_delete = ["Farmer Duplicate Cluster", "Farmer Duplicate Member", "Farmer Search Key"]
 
 # Request Events
 # ----------------
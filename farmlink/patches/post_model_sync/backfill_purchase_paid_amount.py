@@ -0,0 +1,10 @@
+import frappe
+
+from farmlink.supply_chain import payment_rollup
+
+
+def execute():
+	"""Seed Purchases.paid_amount (and re-derive outstanding/status) from existing payments."""
+	frappe.reload_doc("supply_chain", "doctype", "purchases")
+	payment_rollup.reset_columns()
+	payment_rollup.repair(repair=True)
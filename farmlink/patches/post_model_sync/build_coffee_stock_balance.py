@@ -0,0 +1,9 @@
+import frappe
+
+from farmlink.supply_chain.stock_balance import rebuild
+
+
+def execute():
+	"""Seed Coffee Stock Balance from the existing ledger (one grouped scan)."""
+	frappe.reload_doc("supply_chain", "doctype", "coffee_stock_balance")
+	rebuild()
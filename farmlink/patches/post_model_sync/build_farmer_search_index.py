@@ -0,0 +1,5 @@
+from farmlink.api.farmer_search import rebuild
+
+
+def execute():
+	rebuild()
@@ -0,0 +1,9 @@
+import frappe
+
+from farmlink.supply_chain.purchase_rollup import rebuild
+
+
+def execute():
+	"""Seed Purchase Daily Rollup from existing Purchases and Payments (one grouped scan each)."""
+	frappe.reload_doc("supply_chain", "doctype", "purchase_daily_rollup")
+	rebuild()
@@ -0,0 +1,10 @@
+import frappe
+
+from farmlink.farmlink.doctype.sync_id_map.sync_id_map import on_doctype_update
+
+
+def execute():
+	"""Replace the (device, table, client id) key with one that includes the user."""
+	if frappe.db.has_index("tabSync ID Map", "unique_device_table_client"):
+		frappe.db.sql_ddl("ALTER TABLE `tabSync ID Map` DROP INDEX `unique_device_table_client`")
+	on_doctype_update()
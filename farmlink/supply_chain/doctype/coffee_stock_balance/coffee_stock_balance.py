@@ -0,0 +1,11 @@
+import frappe
+from frappe.model.document import Document
+
+
+class CoffeeStockBalance(Document):
+	pass
+
+
+def on_doctype_update():
+	# Partial-key lookups (center + form, optionally grade) from center_balance.
+	frappe.db.add_index("Coffee Stock Balance", ["center", "coffee_form", "coffee_grade"])
@@ -1,9 +1,115 @@
 # Copyright (c) 2025, vulerotech and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, getdate
+
+from farmlink.supply_chain import stock_balance, stock_snapshot
+from farmlink.utils.csl import center_balance, post_entries, record_transfer, reverse_entries
+
+TEST_CENTER = "_Test CSL Center"
+
+
+def _ensure_center(name=TEST_CENTER):
+	if not frappe.db.exists("Centers", name):
+		frappe.get_doc({"doctype": "Centers", "name1": name}).insert()
+	return name
 
 
 class TestCoffeeStockLedger(FrappeTestCase):
-	pass
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.center = _ensure_center()
+
+	def _post(self, entry_ref, entry_type, qty, **kwargs):
+		return record_transfer(
+			center=self.center,
+			status=kwargs.pop("status", "Primary Arrival"),
+			form=kwargs.pop("form", "Cherry"),
+			qty=qty,
+			ref_dt="Centers",
+			ref_dn=self.center,
+			entry_type=entry_type,
+			entry_ref=entry_ref,
+			**kwargs,
+		)
+
+	def test_balance_follows_postings(self):
+		self._post("test_in", "IN", 100)
+		self.assertEqual(center_balance(center=self.center, form="Cherry"), 100)
+
+		# Re-posting the same entry_ref replaces the quantity rather than adding to it.
+		self._post("test_in", "IN", 80)
+		self.assertEqual(center_balance(center=self.center, form="Cherry"), 80)
+
+		self._post("test_out", "OUT", 30, status="In Processing")
+		self.assertEqual(center_balance(center=self.center, form="Cherry"), 50)
+		self.assertEqual(center_balance(center=self.center, form="Cherry", status="In Processing"), -30)
+
+		reverse_entries("Centers", self.center, entry_ref="test_out")
+		self.assertEqual(center_balance(center=self.center, form="Cherry"), 80)
+
+	def test_out_beyond_balance_is_rejected(self):
+		self._post("test_in", "IN", 10)
+		self.assertRaises(frappe.ValidationError, self._post, "test_out", "OUT", 11)
+
+	def test_post_entries_diffs_against_live_rows(self):
+		source = _ensure_center("_Test CSL Source")
+		sink = _ensure_center("_Test CSL Sink")
+
+		def entry(entry_ref, entry_type, qty):
+			return dict(
+				center=self.center,
+				status="Main Arrival" if entry_type == "IN" else "Export Dispatched",
+				form="Green Bean",
+				qty=qty,
+				entry_type=entry_type,
+				entry_ref=entry_ref,
+			)
+
+		post_entries("Centers", source, [entry("in", "IN", 50)])
+		out = post_entries("Centers", sink, [entry("out", "OUT", 40)])
+		self.assertEqual(len(out["inserted"]), 1)
+
+		# Raising the doc's own OUT from 40 to 45 only needs 5 more kg, not 45.
+		result = post_entries("Centers", sink, [entry("out", "OUT", 45)])
+		self.assertEqual(result["updated"], out["inserted"])
+		self.assertEqual(center_balance(center=self.center, form="Green Bean"), 5)
+
+		unchanged = post_entries("Centers", sink, [entry("out", "OUT", 45)])
+		self.assertEqual(unchanged, {"inserted": [], "updated": [], "cancelled": [], "changes": []})
+
+		cancelled = post_entries("Centers", sink, [])
+		self.assertEqual(cancelled["cancelled"], out["inserted"])
+		self.assertEqual(center_balance(center=self.center, form="Green Bean"), 50)
+		self.assertEqual(stock_balance.reconcile()["mismatches"], [])
+
+	def test_snapshots_answer_as_of_and_statements(self):
+		self._post("test_in", "IN", 60, form="Dried Cherry")
+		today = getdate()
+		stock_snapshot.take_daily_snapshots(upto=today)
+		self.assertTrue(
+			frappe.db.exists(
+				"Coffee Stock Snapshot",
+				{"snapshot_date": today, "center": self.center, "coffee_form": "Dried Cherry"},
+			)
+		)
+
+		def dried_cherry(rows, column):
+			return sum(row[column] for row in rows if row["coffee_form"] == "Dried Cherry")
+
+		self.assertEqual(dried_cherry(stock_snapshot.stock_as_of(today, center=self.center), "qty_kg"), 60)
+		yesterday = stock_snapshot.stock_as_of(add_days(today, -1), center=self.center)
+		self.assertEqual(dried_cherry(yesterday, "qty_kg"), 0)
+
+		statement = stock_snapshot.stock_statement(today, today, center=self.center)
+		self.assertEqual(dried_cherry(statement, "opening"), 0)
+		self.assertEqual(dried_cherry(statement, "in_qty"), 60)
+		self.assertEqual(dried_cherry(statement, "out_qty"), 0)
+		self.assertEqual(dried_cherry(statement, "closing"), 60)
+
+	def test_reconcile_matches_ledger(self):
+		self._post("test_in", "IN", 42, coffee_grade="G1")
+		self.assertEqual(stock_balance.reconcile()["mismatches"], [])
@@ -0,0 +1,11 @@
+import frappe
+from frappe.model.document import Document
+
+
+class CoffeeStockLedgerArchive(Document):
+	pass
+
+
+def on_doctype_update():
+	# Audit lookups always come in by source document.
+	frappe.db.add_index("Coffee Stock Ledger Archive", ["reference_doctype", "reference_name"])
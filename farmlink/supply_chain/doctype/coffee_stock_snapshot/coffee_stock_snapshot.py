@@ -0,0 +1,16 @@
+import frappe
+from frappe.model.document import Document
+
+
+class CoffeeStockSnapshot(Document):
+	pass
+
+
+def on_doctype_update():
+	# One row per bucket per day; as-of and statement reads filter by center first.
+	frappe.db.add_unique(
+		"Coffee Stock Snapshot",
+		["snapshot_date", "center", "coffee_form", "coffee_grade", "status"],
+		constraint_name="unique_snapshot_bucket",
+	)
+	frappe.db.add_index("Coffee Stock Snapshot", ["center", "snapshot_date"])
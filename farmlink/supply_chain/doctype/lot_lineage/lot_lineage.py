@@ -0,0 +1,12 @@
+import frappe
+from frappe.model.document import Document
+
+
+class LotLineage(Document):
+	pass
+
+
+def on_doctype_update():
+	# Backward traces read by descendant, forward traces by ancestor.
+	frappe.db.add_index("Lot Lineage", ["descendant_doctype", "descendant_name"])
+	frappe.db.add_index("Lot Lineage", ["ancestor_doctype", "ancestor_name"])
@@ -0,0 +1,89 @@
+# Copyright (c) 2026, vulerotech and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+
+from farmlink.supply_chain import lineage
+
+# Raw closure rows only: the nodes never have to exist as documents.
+P1 = ("Purchases", "_Test Lineage P1")
+P2 = ("Purchases", "_Test Lineage P2")
+P3 = ("Purchases", "_Test Lineage P3")
+A = ("Primary Processing", "_Test Lineage A")
+B = ("Primary Dispatch", "_Test Lineage B")
+C = ("Secondary Processing", "_Test Lineage C")
+
+
+def _stream(*rows):
+	return " UNION ALL ".join(
+		f"SELECT 'Purchases' AS doctype, '{name}' AS name, {qty} AS qty, '{creation}' AS creation"
+		for name, qty, creation in rows
+	)
+
+
+class TestLotLineage(FrappeTestCase):
+	def assertAncestors(self, node, expected):
+		ancestors = lineage._ancestors_of([node])[node]
+		self.assertEqual(set(ancestors), set(expected))
+		for ancestor, proportion in expected.items():
+			self.assertAlmostEqual(ancestors[ancestor], proportion, places=9)
+
+	def test_fifo_slice_takes_the_overlap_of_each_stream_row(self):
+		stream = _stream(
+			("_Test P2", 20, "2026-01-02"),
+			("_Test P1", 40, "2026-01-01"),
+			("_Test P3", 50, "2026-01-03"),
+		)
+		# Stacked by creation: P1 [0, 40), P2 [40, 60), P3 [60, 110).
+		self.assertEqual(
+			lineage._fifo_slice(stream, {}, 30, 70),
+			{
+				("Purchases", "_Test P1"): 10,
+				("Purchases", "_Test P2"): 20,
+				("Purchases", "_Test P3"): 10,
+			},
+		)
+		self.assertEqual(lineage._fifo_slice(stream, {}, 40, 60), {("Purchases", "_Test P2"): 20})
+		# Past the end of the stream there is nothing left to draw.
+		self.assertEqual(lineage._fifo_slice(stream, {}, 100, 130), {("Purchases", "_Test P3"): 10})
+		self.assertEqual(lineage._fifo_slice(stream, {}, 110, 130), {})
+		self.assertEqual(lineage._fifo_slice(stream, {}, 50, 50), {})
+
+	def test_closure_multiplies_shares_along_every_path(self):
+		self.assertTrue(lineage.set_parents(A, {P1: 30, P2: 70}))
+		self.assertTrue(lineage.set_parents(B, {A: 1, P3: 1}))
+		self.assertAncestors(B, {A: 0.5, P3: 0.5, P1: 0.15, P2: 0.35})
+
+		# The same inputs again write nothing.
+		self.assertFalse(lineage.set_parents(B, {A: 2, P3: 2}))
+
+		# A diamond sums both paths: C draws from A directly and through B.
+		lineage.set_parents(C, {A: 1, B: 1})
+		self.assertAncestors(C, {A: 0.75, B: 0.5, P3: 0.25, P1: 0.225, P2: 0.525})
+
+	def test_changed_inputs_move_to_every_descendant(self):
+		lineage.set_parents(A, {P1: 1, P2: 1})
+		lineage.set_parents(B, {A: 1})
+
+		lineage.set_parents(A, {P1: 1})
+
+		self.assertAncestors(A, {P1: 1})
+		self.assertAncestors(B, {A: 1, P1: 1})
+		self.assertEqual(lineage._descendants(P2), {})
+
+	def test_cycle_is_skipped(self):
+		lineage.set_parents(A, {P1: 1})
+		lineage.set_parents(B, {A: 1})
+
+		self.assertFalse(lineage.set_parents(A, {B: 1}))
+		self.assertFalse(lineage.set_parents(A, {A: 1}))
+		self.assertAncestors(A, {P1: 1})
+
+	def test_rebuild_detaches_a_deleted_document(self):
+		lineage.set_parents(A, {P1: 1})
+		lineage.set_parents(B, {A: 1, P3: 1})
+
+		self.assertTrue(lineage.rebuild(*A))
+
+		self.assertAncestors(B, {P3: 0.5})
+		self.assertEqual(lineage._descendants(A), {})
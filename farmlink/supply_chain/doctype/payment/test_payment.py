@@ -1,9 +1,132 @@
 # Copyright (c) 2025, vulerotech and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from farmlink.supply_chain import purchase_rollup
+from farmlink.supply_chain.payment_rollup import repair
+from farmlink.tests.utils import make_center, make_farmer, make_payment, make_purchase, make_territory
+
 
 class TestPayment(FrappeTestCase):
-	pass
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.territory = make_territory("_Test Payment Territory")
+		cls.center = make_center("_Test Payment Center", cls.territory)
+		cls.farmer = make_farmer(
+			cls.territory, first_name="Payment", middle_name="Rollup", phone_number="0911000001"
+		).name
+
+	def _purchase(self, total=1000):
+		return make_purchase(self.farmer, self.center, rate=total / 10)
+
+	def _pay(self, purchase, amount):
+		return make_payment(purchase, amount)
+
+	def _rollup(self, purchase):
+		return frappe.db.get_value(
+			"Purchases", purchase, ["paid_amount", "outstanding_amount", "status"], as_dict=True
+		)
+
+	def assertRollup(self, purchase, paid, outstanding, status):
+		rollup = self._rollup(purchase)
+		self.assertAlmostEqual(rollup.paid_amount, paid)
+		self.assertAlmostEqual(rollup.outstanding_amount, outstanding)
+		self.assertEqual(rollup.status, status)
+
+	def test_rollup_follows_payment_deltas(self):
+		first = self._purchase().name
+		second = self._purchase().name
+		self.assertRollup(first, 0, 1000, "Unpaid")
+
+		payment = self._pay(first, 400)
+		self.assertRollup(first, 400, 600, "Partially Paid")
+
+		self._pay(first, 600)
+		self.assertRollup(first, 1000, 0, "Paid")
+
+		payment.reload()
+		payment.payment_amount = 250
+		payment.save()
+		self.assertRollup(first, 850, 150, "Partially Paid")
+
+		payment.reload()
+		payment.purchase_invoice = second
+		payment.save()
+		self.assertRollup(first, 600, 400, "Partially Paid")
+		self.assertRollup(second, 250, 750, "Partially Paid")
+
+		payment.delete()
+		self.assertRollup(second, 0, 1000, "Unpaid")
+
+	def test_total_price_change_rederives_outstanding(self):
+		purchase = self._purchase()
+		self._pay(purchase.name, 500)
+		purchase.reload()
+		purchase.total_price = 500
+		purchase.save()
+		self.assertRollup(purchase.name, 500, 0, "Paid")
+
+	def test_stale_purchase_save_cannot_undo_payment(self):
+		purchase = self._purchase()
+		modified = frappe.db.get_value("Purchases", purchase.name, "modified")
+		self._pay(purchase.name, 1000)
+		self.assertGreater(frappe.db.get_value("Purchases", purchase.name, "modified"), modified)
+
+		# A copy saved without the version check still ends up with the payment's values.
+		purchase.flags.ignore_version = True
+		purchase.maturity = "Semi-Matured"
+		purchase.save()
+		self.assertRollup(purchase.name, 1000, 0, "Paid")
+
+		# The values are set on the document itself, so it still matches the row.
+		self.assertEqual(purchase.status, "Paid")
+		self.assertEqual(purchase.modified, frappe.db.get_value("Purchases", purchase.name, "modified"))
+		purchase.flags.ignore_version = False
+		purchase.save()
+
+	def test_repair_reports_and_fixes_drift(self):
+		purchase = self._purchase().name
+		self._pay(purchase, 300)
+		frappe.db.set_value(
+			"Purchases", purchase, {"paid_amount": 0, "status": "Paid"}, update_modified=False
+		)
+
+		report = repair(chunk_size=2)
+		drifted = {row["purchase"]: row for row in report["drift"]}
+		self.assertIn(purchase, drifted)
+		self.assertAlmostEqual(drifted[purchase]["expected"]["paid_amount"], 300)
+		self.assertFalse(report["repaired"])
+
+		repair(repair=True, chunk_size=2, commit=lambda: None)
+		self.assertRollup(purchase, 300, 700, "Partially Paid")
+		self.assertNotIn(purchase, {row["purchase"] for row in repair()["drift"]})
+
+	def test_daily_rollup_matches_rebuild(self):
+		first = self._purchase()
+		second = self._purchase(total=500)
+		payment = self._pay(first.name, 400)
+		self._pay(second.name, 500)
+		payment.reload()
+		payment.purchase_invoice = second.name
+		payment.save()
+		second.reload()
+		second.maturity = "Semi-Matured"
+		second.save()
+		first.delete()
+
+		def table():
+			rows = frappe.get_all(
+				purchase_rollup.ROLLUP, fields=["name", *purchase_rollup.MEASURES], ignore_permissions=True
+			)
+			return {
+				row.name: {m: round(row[m], 6) for m in purchase_rollup.MEASURES}
+				for row in rows
+				if any(row[m] for m in purchase_rollup.MEASURES)
+			}
+
+		incremental = table()
+		purchase_rollup.rebuild()
+		self.assertEqual(incremental, table())
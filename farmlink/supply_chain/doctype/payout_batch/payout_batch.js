@@ -0,0 +1,48 @@
+// Copyright (c) 2026, vulerotech and contributors
+// For license information, please see license.txt
+
+const PAYOUT_FILE_METHOD = "farmlink.supply_chain.payout.download_payout_file";
+
+frappe.ui.form.on("Payout Batch", {
+	refresh(frm) {
+		if (frm.is_new()) return;
+
+		if (["Draft", "Failed"].includes(frm.doc.status)) {
+			frm.add_custom_button(__("Create Payments"), () => {
+				frappe.confirm(
+					__("Create Payments for every outstanding purchase of {0} between {1} and {2}?", [
+						frm.doc.center,
+						frappe.datetime.str_to_user(frm.doc.from_date),
+						frappe.datetime.str_to_user(frm.doc.to_date),
+					]),
+					() =>
+						frm.call("create_payments").then(() => {
+							frappe.show_alert({ message: __("Payout queued"), indicator: "blue" });
+							frm.reload_doc();
+						})
+				);
+			}).addClass("btn-primary");
+		}
+
+		if (frm.doc.status === "Completed") {
+			["", "Telebirr", "Bank", "Cash"].forEach((method) => {
+				frm.add_custom_button(
+					method ? __(method) : __("All Methods"),
+					() => {
+						const args = { batch: frm.doc.name };
+						if (method) args.method = method;
+						window.open(`/api/method/${PAYOUT_FILE_METHOD}?${new URLSearchParams(args)}`);
+					},
+					__("Payout File")
+				);
+			});
+			frm.add_custom_button(__("Payments"), () =>
+				frappe.set_route("List", "Payment", { payout_batch: frm.doc.name })
+			);
+		}
+
+		if (frm.doc.status === "Queued") {
+			frm.dashboard.set_headline(__("Payments are being created in the background."));
+		}
+	},
+});
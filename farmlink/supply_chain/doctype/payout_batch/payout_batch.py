@@ -0,0 +1,20 @@
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import getdate
+
+
+class PayoutBatch(Document):
+	def validate(self):
+		if getdate(self.from_date) > getdate(self.to_date):
+			frappe.throw(_("From Date cannot be after To Date"))
+
+	def on_trash(self):
+		if self.status in ("Queued", "Completed"):
+			frappe.throw(_("Cannot delete a payout batch that has created payments"))
+
+	@frappe.whitelist()
+	def create_payments(self):
+		from farmlink.supply_chain.payout import enqueue_batch
+
+		return enqueue_batch(self)
@@ -0,0 +1,70 @@
+# Copyright (c) 2026, vulerotech and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, get_datetime, today
+
+from farmlink.supply_chain.payout import create_payments
+from farmlink.tests.utils import make_center, make_farmer, make_payment, make_purchase, make_territory
+
+
+class TestPayoutBatch(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.territory = make_territory("_Test Payout Territory")
+		cls.center = make_center("_Test Payout Center", cls.territory)
+
+	def _farmer(self, **fields):
+		return make_farmer(self.territory, first_name="Payout", **fields).name
+
+	def _purchase(self, farmer, total, days_ago=0):
+		return make_purchase(
+			farmer, self.center, rate=total / 10, purchase_date=add_days(today(), -days_ago)
+		).name
+
+	def test_batch_pays_outstanding_purchases_by_method(self):
+		telebirr = self._farmer(preferred_payment_method="Telebirr", telebirr_phone_number="0911222333")
+		no_account = self._farmer(preferred_payment_method="Bank")
+		first = self._purchase(telebirr, 1000)
+		second = self._purchase(telebirr, 500, days_ago=1)
+		skipped = self._purchase(no_account, 700)
+		outside = self._purchase(telebirr, 300, days_ago=30)
+		make_payment(second, 200)
+
+		batch = frappe.get_doc(
+			{
+				"doctype": "Payout Batch",
+				"center": self.center,
+				"from_date": add_days(today(), -7),
+				"to_date": today(),
+			}
+		).insert()
+		result = create_payments(batch)
+
+		self.assertEqual(result["purchase_count"], 2)
+		self.assertEqual(result["farmer_count"], 1)
+		self.assertAlmostEqual(result["total_amount"], 1300)
+		self.assertEqual(result["skipped_count"], 1)
+		self.assertIn(skipped, result["log"])
+
+		payments = frappe.get_all(
+			"Payment",
+			filters={"payout_batch": batch.name},
+			fields=["purchase_invoice", "payment_amount", "mode_of_payment"],
+		)
+		self.assertEqual({p.purchase_invoice: p.payment_amount for p in payments}, {first: 1000, second: 300})
+		self.assertEqual({p.mode_of_payment for p in payments}, {"Telebirr"})
+
+		for purchase, paid in ((first, 1000), (second, 500)):
+			row = frappe.db.get_value(
+				"Purchases", purchase, ["paid_amount", "outstanding_amount", "status"], as_dict=True
+			)
+			self.assertAlmostEqual(row.paid_amount, paid)
+			self.assertAlmostEqual(row.outstanding_amount, 0)
+			self.assertEqual(row.status, "Paid")
+			self.assertGreater(
+				frappe.db.get_value("Purchases", purchase, "modified"), get_datetime(batch.creation)
+			)
+		self.assertEqual(frappe.db.get_value("Purchases", outside, "status"), "Unpaid")
@@ -0,0 +1,11 @@
+import frappe
+from frappe.model.document import Document
+
+
+class ProcessingYield(Document):
+	pass
+
+
+def on_doctype_update():
+	# Percentile reads slice by center and season.
+	frappe.db.add_index("Processing Yield", ["center", "season", "stage"])
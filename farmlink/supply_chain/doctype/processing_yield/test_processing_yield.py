@@ -0,0 +1,71 @@
+# Copyright (c) 2026, vulerotech and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from farmlink.supply_chain import processing_yield
+
+CENTER = "_Test Yield Center"
+
+
+def _processing(name, input_kg, outputs, status="Completed", processing_type="Washed"):
+	# Only the fields the fact reads; the yield table never loads the document.
+	return frappe._dict(
+		doctype="Primary Processing",
+		name=name,
+		status=status,
+		processing_center=CENTER,
+		processing_type=processing_type,
+		weight_in_kg=input_kg,
+		processing_output=[frappe._dict(weightkg=kg) for kg in outputs],
+		logged_time="2025-11-03 09:00:00",
+	)
+
+
+class TestProcessingYield(FrappeTestCase):
+	def test_season_runs_from_october(self):
+		self.assertEqual(processing_yield.season_of("2025-09-30"), "2024/25")
+		self.assertEqual(processing_yield.season_of("2025-10-01"), "2025/26")
+		self.assertEqual(processing_yield.season_of("2099-12-31"), "2099/00")
+
+	def test_fact_divides_output_by_input_and_flags_out_of_range(self):
+		fact = processing_yield._fact(_processing("_Test PP 1", 1000, [120, 80]))
+		self.assertEqual(fact["output_form"], "Parchment")
+		self.assertEqual(fact["season"], "2025/26")
+		self.assertAlmostEqual(fact["yield_ratio"], 0.2)
+		self.assertEqual(fact["out_of_range"], 0)
+
+		natural = processing_yield._fact(_processing("_Test PP 2", 1000, [200], processing_type="Natural"))
+		self.assertEqual(natural["output_form"], "Dried Cherry")
+		self.assertEqual(natural["out_of_range"], 1)
+
+		self.assertIsNone(processing_yield._fact(_processing("_Test PP 3", 1000, [200], status="Draft")))
+		self.assertIsNone(processing_yield._fact(_processing("_Test PP 4", 0, [200])))
+
+	def test_percentile_interpolates_between_ranks(self):
+		values = [0.1, 0.2, 0.3, 0.4, 0.5]
+		self.assertAlmostEqual(processing_yield._percentile(values, 50), 0.3)
+		self.assertAlmostEqual(processing_yield._percentile(values, 25), 0.2)
+		self.assertAlmostEqual(processing_yield._percentile(values, 90), 0.46)
+		self.assertAlmostEqual(processing_yield._percentile(values, 0), 0.1)
+		self.assertAlmostEqual(processing_yield._percentile(values, 100), 0.5)
+		self.assertEqual(processing_yield._percentile([0.7], 5), 0.7)
+
+	def test_yield_percentiles_summarize_the_fact_table(self):
+		for i, (input_kg, output_kg) in enumerate([(1000, 150), (1000, 200), (2000, 500)]):
+			processing_yield.refresh(_processing(f"_Test PP Summary {i}", input_kg, [output_kg]))
+		# A processing that is no longer Completed leaves the table.
+		processing_yield.refresh(_processing("_Test PP Summary 0", 1000, [150], status="Draft"))
+		processing_yield.refresh(_processing("_Test PP Summary 3", 1000, [180]))
+
+		(group,) = processing_yield.yield_percentiles(center=CENTER, percentiles="0,50,100")
+
+		self.assertEqual(
+			(group["season"], group["stage"], group["processing_type"]), ("2025/26", "Primary", "Washed")
+		)
+		self.assertEqual(group["batches"], 3)
+		self.assertEqual(group["out_of_range"], 1)
+		# Mass-weighted: (200 + 500 + 180) / (1000 + 2000 + 1000).
+		self.assertEqual(group["weighted_yield"], 0.22)
+		self.assertEqual(group["percentiles"], {"p0": 0.18, "p50": 0.2, "p100": 0.25})
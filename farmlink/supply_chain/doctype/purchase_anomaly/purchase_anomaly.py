@@ -0,0 +1,17 @@
+import frappe
+from frappe.model.document import Document
+from frappe.utils import now_datetime
+
+
+class PurchaseAnomaly(Document):
+	def validate(self):
+		if self.has_value_changed("review_status"):
+			reviewed = self.review_status != "Open"
+			self.reviewed_by = frappe.session.user if reviewed else None
+			self.reviewed_on = now_datetime() if reviewed else None
+
+
+def on_doctype_update():
+	# The scan replaces a (center, date) group's open anomalies in one pass.
+	frappe.db.add_index("Purchase Anomaly", ["center", "purchase_date"])
+	frappe.db.add_index("Purchase Anomaly", ["review_status"])
@@ -0,0 +1,91 @@
+# Copyright (c) 2026, vulerotech and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, today
+
+from farmlink.supply_chain.purchase_anomalies import anomaly_name, scan
+from farmlink.tests.utils import make_center, make_farmer, make_purchase, make_territory
+
+
+class TestPurchaseAnomaly(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.territory = make_territory("_Test Anomaly Territory")
+		cls.center = make_center("_Test Anomaly Center", cls.territory)
+
+	def _farmer(self):
+		return make_farmer(self.territory, first_name="Anomaly").name
+
+	def _purchase(self, day, farmer, weight, rate, total=None):
+		return make_purchase(farmer, self.center, weight, rate, total, purchase_date=day).name
+
+	def _types(self, purchase):
+		return set(frappe.get_all("Purchase Anomaly", filters={"purchase": purchase}, pluck="anomaly_type"))
+
+	def test_scan_flags_outliers_mismatches_and_duplicates(self):
+		day = add_days(today(), -3)
+		normal = [self._purchase(day, self._farmer(), 20 + i, 80 + i % 2) for i in range(8)]
+		outlier = self._purchase(day, self._farmer(), 15, 400)
+		mismatch = self._purchase(day, self._farmer(), 10, 80, total=1200)
+		repeat_farmer = self._farmer()
+		first = self._purchase(day, repeat_farmer, 12.5, 81)
+		second = self._purchase(day, repeat_farmer, 12.5, 81)
+
+		result = scan(day, day, centers=[self.center])
+
+		self.assertEqual(result["groups"], 1)
+		self.assertEqual(self._types(outlier), {"Price Outlier"})
+		self.assertEqual(self._types(mismatch), {"Total Mismatch"})
+		self.assertEqual(self._types(second), {"Near Duplicate"})
+		self.assertEqual(
+			frappe.db.get_value(
+				"Purchase Anomaly", anomaly_name(second, "Near Duplicate"), "related_purchase"
+			),
+			first,
+		)
+		for name in [*normal, first]:
+			self.assertFalse(self._types(name))
+
+	def test_rescan_keeps_reviews_and_drops_resolved_findings(self):
+		day = add_days(today(), -4)
+		for i in range(6):
+			self._purchase(day, self._farmer(), 20 + i, 80)
+		mismatch = self._purchase(day, self._farmer(), 10, 80, total=1200)
+		outlier = self._purchase(day, self._farmer(), 15, 400)
+		scan(day, day, centers=[self.center])
+
+		review = frappe.get_doc("Purchase Anomaly", anomaly_name(outlier, "Price Outlier"))
+		review.review_status = "Confirmed"
+		review.save()
+		frappe.db.set_value("Purchases", mismatch, "total_price", 800)
+		frappe.db.set_value("Purchases", outlier, "price_rate_of_the_day", 80)
+
+		scan(day, day, centers=[self.center])
+
+		self.assertFalse(self._types(mismatch))
+		self.assertEqual(
+			frappe.db.get_value("Purchase Anomaly", review.name, "review_status"),
+			"Confirmed",
+		)
+
+	def test_deleting_either_half_of_a_near_duplicate(self):
+		day = add_days(today(), -5)
+		for i in range(6):
+			self._purchase(day, self._farmer(), 20 + i, 80)
+		farmer = self._farmer()
+		first = self._purchase(day, farmer, 12.5, 81)
+		second = self._purchase(day, farmer, 12.5, 81)
+		third = self._purchase(day, farmer, 12.5, 81)
+		scan(day, day, centers=[self.center])
+		self.assertEqual(self._types(third), {"Near Duplicate"})
+
+		frappe.delete_doc("Purchases", third)
+		self.assertFalse(self._types(third))
+
+		frappe.delete_doc("Purchases", first)
+		finding = anomaly_name(second, "Near Duplicate")
+		self.assertTrue(frappe.db.exists("Purchase Anomaly", finding))
+		self.assertIsNone(frappe.db.get_value("Purchase Anomaly", finding, "related_purchase"))
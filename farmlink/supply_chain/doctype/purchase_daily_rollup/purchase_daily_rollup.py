@@ -0,0 +1,11 @@
+import frappe
+from frappe.model.document import Document
+
+
+class PurchaseDailyRollup(Document):
+	pass
+
+
+def on_doctype_update():
+	# Cards and charts read a date window, optionally narrowed to the user's center.
+	frappe.db.add_index("Purchase Daily Rollup", ["rollup_date", "center"])
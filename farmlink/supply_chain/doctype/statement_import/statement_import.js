@@ -0,0 +1,33 @@
+// Copyright (c) 2026, vulerotech and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("Statement Import", {
+	refresh(frm) {
+		if (frm.is_new()) return;
+
+		if (["Draft", "Failed"].includes(frm.doc.status)) {
+			frm.add_custom_button(__("Start Import"), () =>
+				frm.call("start_import").then(() => {
+					frappe.show_alert({ message: __("Statement import queued"), indicator: "blue" });
+					frm.reload_doc();
+				})
+			).addClass("btn-primary");
+		}
+
+		if (frm.doc.status === "Queued") {
+			frm.dashboard.set_headline(
+				__("Reconciling in the background: {0} lines so far.", [frm.doc.total_lines || 0])
+			);
+		}
+
+		if (frm.doc.total_lines) {
+			["Matched", "Unmatched", "Duplicate"].forEach((status) => {
+				frm.add_custom_button(
+					__(status),
+					() => frappe.set_route("List", "Statement Line", { statement_import: frm.doc.name, status }),
+					__("Lines")
+				);
+			});
+		}
+	},
+});
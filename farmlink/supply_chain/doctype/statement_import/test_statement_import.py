@@ -0,0 +1,77 @@
+# Copyright (c) 2026, vulerotech and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, today
+
+from farmlink.tests.utils import make_farmer, make_payment, make_purchase, make_territory
+from farmlink.utils.statement_importer import reconcile_statement
+
+
+class TestStatementImport(FrappeTestCase):
+	def _payment(self, txn, amount, days_ago=0):
+		farmer = make_farmer(make_territory("_Test Statement Territory"), first_name="Statement")
+		purchase = make_purchase(farmer.name, weight=2, rate=amount)
+		return make_payment(
+			purchase.name,
+			amount,
+			payment_date=add_days(today(), -days_ago),
+			mode_of_payment="Telebirr",
+			transaction_number=txn,
+		)
+
+	def _statement(self, lines):
+		content = "Transaction Number,Amount,Date\n" + "\n".join(",".join(map(str, line)) for line in lines)
+		file = frappe.get_doc(
+			{
+				"doctype": "File",
+				"file_name": f"statement-{frappe.generate_hash(length=6)}.csv",
+				"content": content,
+			}
+		).insert()
+		return frappe.get_doc(
+			{"doctype": "Statement Import", "statement_file": file.file_url, "source": "Telebirr"}
+		).insert()
+
+	def test_lines_are_matched_unmatched_and_duplicate(self):
+		paid = self._payment("TB-AAA1", 400)
+		self._payment("TB-BBB2", 250, days_ago=20)
+		corrected = self._payment("TB-EEE5", 150)
+		doc = self._statement(
+			[
+				("tb-aaa1", "400.00", today()),
+				("TB-AAA1", "400.00", today()),
+				("TB-BBB2", "250", today()),
+				("TB-CCC3", "100", today()),
+				("TB-DDD4", "not a number", today()),
+				("TB-EEE5", "15", today()),
+				("TB-EEE5", "150", today()),
+			]
+		)
+
+		# The test case rolls back; the job's per-chunk commits would defeat it.
+		counts = reconcile_statement(doc, commit=lambda: None)
+
+		self.assertEqual(
+			counts,
+			{"total_lines": 7, "matched_lines": 2, "unmatched_lines": 4, "duplicate_lines": 1},
+		)
+		lines = frappe.get_all(
+			"Statement Line",
+			filters={"statement_import": doc.name},
+			fields=["line_no", "status", "payment"],
+			order_by="line_no",
+		)
+		self.assertEqual(
+			[(line.status, line.payment) for line in lines],
+			[
+				("Matched", paid.name),
+				("Duplicate", paid.name),
+				("Unmatched", None),
+				("Unmatched", None),
+				("Unmatched", None),
+				("Unmatched", None),
+				("Matched", corrected.name),
+			],
+		)
@@ -0,0 +1,12 @@
+import frappe
+from frappe.model.document import Document
+
+
+class StatementLine(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Statement Line", ["statement_import", "status"])
+	# Earlier matches of a payment are what make a later line a duplicate.
+	frappe.db.add_index("Statement Line", ["payment", "status"])
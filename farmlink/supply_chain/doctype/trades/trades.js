@@ -7,18 +7,15 @@ frappe.ui.form.on("Trades", {
 			};
 		});
 
-		// Show green bean balance when warehouse is selected
+		// Show green bean balance (total and per allocated grade) when warehouse is selected
 		if (frm.doc.export_warehouse) {
 			frappe.call({
-				method: "farmlink.utils.csl.center_balance",
-				args: { center: frm.doc.export_warehouse, form: "Green Bean" },
+				method: "farmlink.utils.csl.get_stock_position",
+				args: { centers: [frm.doc.export_warehouse] },
 				callback: function (r) {
-					if (r.message !== undefined) {
-						frm.dashboard.add_indicator(
-							__("Green Bean Available: {0} kg", [flt(r.message).toFixed(2)]),
-							r.message > 0 ? "green" : "orange"
-						);
-					}
+					const position = (r.message || {})[frm.doc.export_warehouse];
+					if (!position) return;
+					_show_green_bean_indicators(frm, position["Green Bean"] || {});
 				},
 			});
 		}
@@ -63,6 +60,27 @@ frappe.ui.form.on("Cert No Details", {
 	},
 });
 
+function _show_green_bean_indicators(frm, grades) {
+	const available = (grade) =>
+		Object.values(grades[grade] || {}).reduce((sum, qty) => sum + flt(qty), 0);
+	const total = Object.keys(grades).reduce((sum, grade) => sum + available(grade), 0);
+	frm.dashboard.add_indicator(
+		__("Green Bean Available: {0} kg", [total.toFixed(2)]),
+		total > 0 ? "green" : "orange"
+	);
+
+	const allocated = new Set(
+		(frm.doc.table_ovaz || []).map((row) => row.coffee_grade).filter(Boolean)
+	);
+	allocated.forEach((grade) => {
+		const qty = available(grade);
+		frm.dashboard.add_indicator(
+			__("{0}: {1} kg", [grade, qty.toFixed(2)]),
+			qty > 0 ? "green" : "orange"
+		);
+	});
+}
+
 function _compute_row_weight(frm, cdt, cdn) {
 	const row = locals[cdt][cdn];
 	const weight = flt(row.quantity) * flt(row.bag_size);
@@ -0,0 +1,490 @@
+"""
+Lot lineage closure index for purchase-to-export traceability.
+
+"Which purchases and farms fed this Export Dispatch" used to mean walking
+Trades -> Cert No Details.secondary_processing_ref -> Secondary Processing ->
+(center) -> Secondary Arrival Log.dispatch_log -> Primary Dispatch -> (center)
+-> Primary Processing -> (center) -> Primary Arrival Log / Purchases by hand.
+
+The Lot Lineage DocType stores the transitive closure of that graph: one row
+per (ancestor, descendant) pair with ``proportion``, the share of the
+descendant's mass that originates from the ancestor summed over every path
+(mass balance). Rows with a non-zero ``direct_proportion`` are the direct
+input edges the closure is derived from. A trace in either direction is one
+indexed lookup (``trace_backward`` / ``trace_forward``).
+
+Direct inputs per document (``_PARENT_RESOLVERS``) come only from explicit
+links or from the quantities a document actually consumed:
+
+- explicit links carry their own weight: Export Dispatch <- its Trade,
+  Trades <- each Cert No Details row's Secondary Processing (by row kg),
+  Export Arrival Log <- Secondary Processing, Secondary Arrival Log <- Primary
+  Dispatch;
+- where stock is pooled at a center (Primary Processing, Primary Dispatch,
+  Secondary Processing) each live OUT posting of the document draws its kg
+  from the IN postings of that center and form first in, first out: the OUTs
+  created before it have used up that much of the IN stream, and it takes the
+  next ``qty`` kg. Every kg posted IN feeds at most one consumer;
+- a Primary Arrival Log draws its collected weight the same way from the
+  Purchases at its center, so a purchase reaches processing only through the
+  arrival that carried its cherry.
+
+Both streams are ordered by ``creation``, so documents are never compared by
+save time on one side and event date on the other.
+
+``refresh`` and ``clear`` run from the stock-ledger save hooks and only queue
+``rebuild`` for after the commit; the save itself never touches the closure.
+Rebuild jobs are serialized on an anchor row, since each one reads closure
+rows that another may be rewriting.
+When a document's direct inputs change, the ancestor deltas are pushed to the
+document and every descendant in a handful of set-based statements: in a DAG
+every path from an ancestor through the document contributes
+p(ancestor->doc) * p(doc->descendant), so the closure never has to be
+recomputed by walking.
+An input that would close a cycle is logged and the update skipped. Inputs
+are fixed when the consumer is rebuilt; a later correction to a producer
+reaches its consumers when they are saved or reposted again.
+"""
+
+from __future__ import annotations
+
+import frappe
+from frappe.utils import flt, now_datetime
+
+from farmlink.supply_chain.stock_balance import bucket_name
+
+LINEAGE = "Lot Lineage"
+CSL = "Coffee Stock Ledger"
+
+_TOLERANCE = 1e-9
+_CHUNK = 500
+
+Node = tuple[str, str]
+
+
+# ---------- direct inputs ----------
+
+
+def _fifo_slice(stream_sql: str, params: dict, start: float, end: float) -> dict[Node, float]:
+	"""kg of the ``[start, end)`` slice of a cumulative stream, per source doc.
+
+	``stream_sql`` selects ``doctype, name, qty`` rows; they are stacked in
+	``creation, name`` order and each contributes its overlap with the slice.
+	"""
+	if end - start <= _TOLERANCE:
+		return {}
+	rows = frappe.db.sql(
+		f"""
+		SELECT doctype, name, qty, upto FROM (
+			SELECT doctype, name, qty,
+				SUM(qty) OVER (ORDER BY creation, name ROWS UNBOUNDED PRECEDING) AS upto
+			FROM ({stream_sql}) stream
+		) stacked
+		WHERE upto > %(start)s AND upto - qty < %(end)s
+		""",
+		{**params, "start": start, "end": end},
+	)
+	inputs: dict[Node, float] = {}
+	for doctype, name, qty, upto in rows:
+		kg = min(flt(upto), end) - max(flt(upto) - flt(qty), start)
+		if kg > _TOLERANCE:
+			inputs[(doctype, name)] = inputs.get((doctype, name), 0.0) + kg
+	return inputs
+
+
+def _consumed_inputs(doc) -> dict[Node, float]:
+	"""IN postings that ``doc``'s OUT postings drew from, first in, first out."""
+	inputs: dict[Node, float] = {}
+	outs = frappe.db.sql(
+		f"""
+		SELECT center, coffee_form, creation, name, qty_kg
+		FROM `tab{CSL}`
+		WHERE reference_doctype=%s AND reference_name=%s AND entry_type='OUT' AND is_cancelled=0
+		""",
+		(doc.doctype, doc.name),
+		as_dict=True,
+	)
+	for out in outs:
+		params = {
+			"center": out.center,
+			"form": out.coffee_form,
+			"creation": out.creation,
+			"name": out.name,
+			"ref_dt": doc.doctype,
+			"ref_dn": doc.name,
+		}
+		consumed_before = frappe.db.sql(
+			f"""
+			SELECT COALESCE(SUM(qty_kg), 0) FROM `tab{CSL}`
+			WHERE is_cancelled=0 AND entry_type='OUT' AND center=%(center)s AND coffee_form=%(form)s
+				AND (creation < %(creation)s OR (creation = %(creation)s AND name < %(name)s))
+			""",
+			params,
+		)[0][0]
+		start = flt(consumed_before)
+		for node, kg in _fifo_slice(
+			f"""
+			SELECT reference_doctype AS doctype, reference_name AS name, qty_kg AS qty, creation
+			FROM `tab{CSL}`
+			WHERE is_cancelled=0 AND entry_type='IN' AND center=%(center)s AND coffee_form=%(form)s
+				AND NOT (reference_doctype=%(ref_dt)s AND reference_name=%(ref_dn)s)
+			""",
+			params,
+			start,
+			start + flt(out.qty_kg),
+		).items():
+			inputs[node] = inputs.get(node, 0.0) + kg
+	return inputs
+
+
+def _primary_arrival_inputs(doc) -> dict[Node, float]:
+	"""Purchases at the arrival's center whose cherry this arrival carried, first in, first out."""
+	if not doc.center or flt(doc.collected_weight) <= 0:
+		return {}
+	params = {"center": doc.center, "creation": doc.creation, "name": doc.name}
+	arrived_before = frappe.db.sql(
+		"""
+		SELECT COALESCE(SUM(collected_weight), 0) FROM `tabPrimary Arrival Log`
+		WHERE center=%(center)s
+			AND (creation < %(creation)s OR (creation = %(creation)s AND name < %(name)s))
+		""",
+		params,
+	)[0][0]
+	start = flt(arrived_before)
+	return _fifo_slice(
+		"""
+		SELECT 'Purchases' AS doctype, name, weight_in_kg AS qty, creation
+		FROM `tabPurchases`
+		WHERE collection_center=%(center)s AND weight_in_kg > 0
+		""",
+		params,
+		start,
+		start + flt(doc.collected_weight),
+	)
+
+
+def _trades_inputs(doc) -> dict[Node, float]:
+	inputs: dict[Node, float] = {}
+	for row in doc.get("table_ovaz") or []:
+		if not row.secondary_processing_ref:
+			continue
+		kg = flt(row.weight_kg) or flt(row.quantity) * flt(row.bag_size)
+		node = ("Secondary Processing", row.secondary_processing_ref)
+		inputs[node] = inputs.get(node, 0.0) + (kg or 1.0)
+	return inputs
+
+
+def _single(doctype, fieldname):
+	def resolve(doc) -> dict[Node, float]:
+		value = doc.get(fieldname)
+		return {(doctype, value): 1.0} if value else {}
+
+	return resolve
+
+
+_PARENT_RESOLVERS = {
+	"Primary Arrival Log": _primary_arrival_inputs,
+	"Primary Processing": _consumed_inputs,
+	"Primary Dispatch": _consumed_inputs,
+	"Secondary Arrival Log": _single("Primary Dispatch", "dispatch_log"),
+	"Secondary Processing": _consumed_inputs,
+	"Export Arrival Log": _single("Secondary Processing", "secondary_processing_ref"),
+	"Trades": _trades_inputs,
+	"Export Dispatch": _single("Trades", "trade"),
+}
+
+
+# ---------- closure reads ----------
+
+
+def _ancestors_of(nodes) -> dict[Node, dict[Node, float]]:
+	result: dict[Node, dict[Node, float]] = {node: {} for node in nodes}
+	by_doctype: dict[str, list[str]] = {}
+	for doctype, name in nodes:
+		by_doctype.setdefault(doctype, []).append(name)
+	for doctype, names in by_doctype.items():
+		rows = frappe.db.sql(
+			f"""
+			SELECT descendant_name, ancestor_doctype, ancestor_name, proportion
+			FROM `tab{LINEAGE}`
+			WHERE descendant_doctype=%s AND descendant_name IN %s
+			""",
+			(doctype, tuple(names)),
+		)
+		for descendant, ancestor_doctype, ancestor_name, proportion in rows:
+			result.setdefault((doctype, descendant), {})[(ancestor_doctype, ancestor_name)] = flt(proportion)
+	return result
+
+
+def _direct_parents(node: Node) -> dict[Node, float]:
+	rows = frappe.db.sql(
+		f"""
+		SELECT ancestor_doctype, ancestor_name, direct_proportion
+		FROM `tab{LINEAGE}`
+		WHERE descendant_doctype=%s AND descendant_name=%s AND direct_proportion > 0
+		""",
+		node,
+	)
+	return {(row[0], row[1]): flt(row[2]) for row in rows}
+
+
+def _descendants(node: Node) -> dict[Node, float]:
+	rows = frappe.db.sql(
+		f"""
+		SELECT descendant_doctype, descendant_name, proportion
+		FROM `tab{LINEAGE}`
+		WHERE ancestor_doctype=%s AND ancestor_name=%s
+		""",
+		node,
+	)
+	return {(row[0], row[1]): flt(row[2]) for row in rows}
+
+
+# ---------- closure writes ----------
+
+
+def _row_name(ancestor: Node, descendant: Node) -> str:
+	return bucket_name((*ancestor, *descendant))
+
+
+def _upsert(values, update_clause) -> None:
+	now = now_datetime()
+	user = frappe.session.user
+	for start in range(0, len(values), _CHUNK):
+		chunk = values[start : start + _CHUNK]
+		params = []
+		for ancestor, descendant, proportion, direct in chunk:
+			params.extend(
+				[
+					_row_name(ancestor, descendant),
+					now,
+					now,
+					user,
+					user,
+					*ancestor,
+					*descendant,
+					proportion,
+					direct,
+				]
+			)
+		frappe.db.sql(
+			f"""
+			INSERT INTO `tab{LINEAGE}`
+				(name, creation, modified, owner, modified_by,
+				 ancestor_doctype, ancestor_name, descendant_doctype, descendant_name,
+				 proportion, direct_proportion)
+			VALUES {", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))}
+			ON DUPLICATE KEY UPDATE {update_clause}, modified = VALUES(modified)
+			""",
+			params,
+		)
+
+
+def _lock_closure() -> None:
+	"""Hold the closure's anchor row until the transaction ends.
+
+	A rebuild reads the closure rows of its parents and descendants, which a
+	rebuild of any of those nodes may be rewriting. Every rebuild upserts the
+	same anchor row (empty ancestor and descendant, which no trace matches) as
+	its first statement, so the record lock runs them one at a time and each
+	reads what the previous one committed.
+	"""
+	now = now_datetime()
+	user = frappe.session.user
+	frappe.db.sql(
+		f"""
+		INSERT INTO `tab{LINEAGE}`
+			(name, creation, modified, owner, modified_by,
+			 ancestor_doctype, ancestor_name, descendant_doctype, descendant_name,
+			 proportion, direct_proportion)
+		VALUES (%s, %s, %s, %s, %s, '', '', '', '', 0, 0)
+		ON DUPLICATE KEY UPDATE proportion = proportion
+		""",
+		(_row_name(("", ""), ("", "")), now, now, user, user),
+	)
+
+
+def set_parents(node: Node, parents: dict[Node, float]) -> bool:
+	"""Make ``parents`` (weights, normalized here) the direct inputs of ``node``.
+
+	Returns False when the direct inputs were already exactly these, or when
+	they would make ``node`` its own ancestor (logged, nothing written).
+	"""
+	parents = {parent: flt(weight) for parent, weight in parents.items() if flt(weight) > 0}
+	total = sum(parents.values())
+	parents = {parent: weight / total for parent, weight in parents.items()} if total else {}
+
+	old_parents = _direct_parents(node)
+	if set(old_parents) == set(parents) and all(
+		abs(old_parents[parent] - weight) <= _TOLERANCE for parent, weight in parents.items()
+	):
+		return False
+
+	old_ancestors = _ancestors_of([node])[node]
+	parent_ancestors = _ancestors_of(list(parents)) if parents else {}
+	new_ancestors: dict[Node, float] = {}
+	for parent, weight in parents.items():
+		new_ancestors[parent] = new_ancestors.get(parent, 0.0) + weight
+		for ancestor, share in parent_ancestors.get(parent, {}).items():
+			new_ancestors[ancestor] = new_ancestors.get(ancestor, 0.0) + weight * share
+
+	descendants = _descendants(node)
+	cycle = {node} & set(new_ancestors) | set(new_ancestors) & set(descendants)
+	if cycle:
+		frappe.log_error(
+			title=f"Lot lineage cycle skipped for {node[0]} {node[1]}",
+			message="\n".join(f"{doctype} {name}" for doctype, name in sorted(cycle)),
+			reference_doctype=node[0],
+			reference_name=node[1],
+		)
+		return False
+
+	deltas = {
+		ancestor: new_ancestors.get(ancestor, 0.0) - old_ancestors.get(ancestor, 0.0)
+		for ancestor in set(new_ancestors) | set(old_ancestors)
+	}
+	deltas = {ancestor: delta for ancestor, delta in deltas.items() if abs(delta) > _TOLERANCE}
+
+	# Every path from an ancestor to a descendant of ``node`` through ``node``
+	# carries p(ancestor -> node) * p(node -> descendant).
+	targets = [(node, 1.0), *descendants.items()]
+	_upsert(
+		[
+			(ancestor, target, delta * share, 0.0)
+			for target, share in targets
+			for ancestor, delta in sorted(deltas.items())
+		],
+		"proportion = proportion + VALUES(proportion)",
+	)
+
+	frappe.db.sql(
+		f"""
+		UPDATE `tab{LINEAGE}` SET direct_proportion = 0
+		WHERE descendant_doctype=%s AND descendant_name=%s AND direct_proportion > 0
+		""",
+		node,
+	)
+	_upsert(
+		[(parent, node, 0.0, weight) for parent, weight in sorted(parents.items())],
+		"direct_proportion = VALUES(direct_proportion)",
+	)
+
+	# Pairs whose every path went through a dropped input disappear.
+	for doctype in {target[0] for target, _share in targets}:
+		names = [target[1] for target, _share in targets if target[0] == doctype]
+		for start in range(0, len(names), _CHUNK):
+			frappe.db.sql(
+				f"""
+				DELETE FROM `tab{LINEAGE}`
+				WHERE descendant_doctype=%s AND descendant_name IN %s
+					AND ABS(proportion) <= %s AND direct_proportion <= 0
+				""",
+				(doctype, tuple(names[start : start + _CHUNK]), _TOLERANCE),
+			)
+	return True
+
+
+def refresh(doc) -> None:
+	"""Save hook: queue a rebuild of ``doc``'s direct inputs once the save commits."""
+	if doc.doctype in _PARENT_RESOLVERS:
+		_enqueue_rebuild(doc)
+
+
+def clear(doc) -> None:
+	"""Trash hook: queue detaching the deleted document once the delete commits."""
+	_enqueue_rebuild(doc)
+
+
+def _enqueue_rebuild(doc) -> None:
+	frappe.enqueue(
+		"farmlink.supply_chain.lineage.rebuild",
+		queue="short",
+		enqueue_after_commit=True,
+		doctype=doc.doctype,
+		name=doc.name,
+	)
+
+
+def rebuild(doctype, name) -> bool:
+	"""Background job: re-derive a document's direct inputs, or detach it if it is gone.
+
+	A deleted document's descendants lose whatever came through it. Rebuilds
+	run one at a time (``_lock_closure``).
+	"""
+	_lock_closure()
+	node = (doctype, name)
+	if frappe.db.exists(doctype, name):
+		resolver = _PARENT_RESOLVERS.get(doctype)
+		return set_parents(node, resolver(frappe.get_doc(doctype, name))) if resolver else False
+	changed = set_parents(node, {})
+	frappe.db.sql(
+		f"DELETE FROM `tab{LINEAGE}` WHERE ancestor_doctype=%s AND ancestor_name=%s",
+		node,
+	)
+	return changed
+
+
+# ---------- traces ----------
+
+
+def _trace(where_prefix, select_prefix, doctype, name, other_doctype=None):
+	clauses = [f"{where_prefix}_doctype=%s", f"{where_prefix}_name=%s"]
+	params = [doctype, name]
+	if other_doctype:
+		clauses.append(f"{select_prefix}_doctype=%s")
+		params.append(other_doctype)
+	rows = frappe.db.sql(
+		f"""
+		SELECT {select_prefix}_doctype AS doctype, {select_prefix}_name AS name,
+			proportion, direct_proportion > 0 AS direct
+		FROM `tab{LINEAGE}`
+		WHERE {" AND ".join(clauses)}
+		ORDER BY proportion DESC
+		""",
+		params,
+		as_dict=True,
+	)
+	for row in rows:
+		row.proportion = flt(row.proportion, 6)
+		row.direct = bool(row.direct)
+	return rows
+
+
+@frappe.whitelist()
+def trace_backward(doctype, name, ancestor_doctype=None, include_farms=1):
+	"""Everything that fed ``doctype``/``name`` with its mass share.
+
+	With ``include_farms`` the Farms of the Purchases' farmers are listed too,
+	each with its farmer's share.
+	"""
+	frappe.has_permission(doctype, "read", doc=name, throw=True)
+	ancestors = _trace("descendant", "ancestor", doctype, name, ancestor_doctype)
+	result = {"ancestors": ancestors}
+
+	if frappe.utils.cint(include_farms):
+		purchase_share = {row.name: row.proportion for row in ancestors if row.doctype == "Purchases"}
+		farms = []
+		if purchase_share:
+			farmer_share: dict[str, float] = {}
+			for purchase, farmer in frappe.db.sql(
+				"SELECT name, farmer FROM `tabPurchases` WHERE name IN %s AND IFNULL(farmer, '') != ''",
+				(tuple(purchase_share),),
+			):
+				farmer_share[farmer] = farmer_share.get(farmer, 0.0) + purchase_share[purchase]
+			if farmer_share:
+				farms = frappe.get_all(
+					"Farms",
+					filters={"farmer": ["in", list(farmer_share)]},
+					fields=["name", "farmer", "territory", "polygon_area_ha"],
+				)
+				for farm in farms:
+					farm.farmer_share = flt(farmer_share[farm.farmer], 6)
+		result["farms"] = farms
+	return result
+
+
+@frappe.whitelist()
+def trace_forward(doctype, name, descendant_doctype=None):
+	"""Everything ``doctype``/``name`` went into, with its share of each."""
+	frappe.has_permission(doctype, "read", doc=name, throw=True)
+	return _trace("ancestor", "descendant", doctype, name, descendant_doctype)
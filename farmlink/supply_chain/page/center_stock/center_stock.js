@@ -0,0 +1,91 @@
+// Stock matrix (form × grade × status) for one or more centers, served by
+// farmlink.utils.csl.get_stock_position from the materialized balances.
+
+const STOCK_STATUSES = [
+	"Primary Arrival",
+	"In Processing",
+	"Dispatched",
+	"Secondary Arrival",
+	"Main Arrival",
+	"Allocated to Trade",
+	"Export Dispatched",
+];
+
+frappe.pages["center-stock"].on_page_load = function (wrapper) {
+	const page = frappe.ui.make_app_page({
+		parent: wrapper,
+		title: __("Center Stock"),
+		single_column: true,
+	});
+
+	const centers = page.add_field({
+		fieldname: "centers",
+		label: __("Centers"),
+		fieldtype: "MultiSelectList",
+		get_data: (txt) => frappe.db.get_link_options("Centers", txt),
+		change: () => load(),
+	});
+	page.set_primary_action(__("Refresh"), () => load(), "refresh");
+
+	const $body = $('<div class="center-stock-body"></div>').appendTo(page.main);
+
+	function load() {
+		const selected = centers.get_value() || [];
+		if (!selected.length) {
+			$body.html(`<p class="text-muted">${__("Select one or more centers.")}</p>`);
+			return;
+		}
+		frappe.call({
+			method: "farmlink.utils.csl.get_stock_position",
+			args: { centers: selected },
+			callback: (r) => render(r.message || {}),
+		});
+	}
+
+	function render(positions) {
+		$body.empty();
+		Object.keys(positions)
+			.sort()
+			.forEach((center) => $body.append(center_table(center, positions[center])));
+	}
+
+	function center_table(center, matrix) {
+		const rows = [];
+		Object.keys(matrix)
+			.sort()
+			.forEach((form) => {
+				Object.keys(matrix[form])
+					.sort()
+					.forEach((grade) => rows.push({ form, grade, statuses: matrix[form][grade] }));
+			});
+
+		const fmt = (qty) => (qty ? format_number(qty, null, 2) : "");
+		const header = STOCK_STATUSES.map((s) => `<th class="text-right">${__(s)}</th>`).join("");
+		const body = rows
+			.map(({ form, grade, statuses }) => {
+				const total = Object.values(statuses).reduce((sum, qty) => sum + flt(qty), 0);
+				const cells = STOCK_STATUSES.map(
+					(s) => `<td class="text-right">${fmt(statuses[s])}</td>`
+				).join("");
+				return `<tr><td>${__(form)}</td><td>${grade || __("Ungraded")}</td>${cells}
+					<td class="text-right"><b>${fmt(total)}</b></td></tr>`;
+			})
+			.join("");
+
+		return `
+			<div class="frappe-card mb-4 p-3">
+				<h5>${frappe.utils.escape_html(center)}</h5>
+				${
+					rows.length
+						? `<table class="table table-bordered table-sm">
+							<thead><tr><th>${__("Form")}</th><th>${__("Grade")}</th>${header}
+								<th class="text-right">${__("Net")}</th></tr></thead>
+							<tbody>${body}</tbody>
+						</table>`
+						: `<p class="text-muted">${__("No stock.")}</p>`
+				}
+			</div>`;
+	}
+
+	load();
+};
@@ -0,0 +1,287 @@
+"""
+Incremental paid / outstanding / status rollup on Purchases.
+
+Every Payment insert, update and trash used to re-read the whole purchase
+(``frappe.get_doc``), probe the schema with two ``has_column`` calls and sum
+every payment of that purchase again. ``on_payment_change`` now works from the
+payment's own before/after values: the old contribution is taken off the
+purchase it pointed at, the new one is added to the purchase it points at now,
+and each affected purchase gets one atomic ``UPDATE`` that moves
+``paid_amount`` and derives ``outstanding_amount`` and ``status`` from it in
+the same statement. Concurrent payments against one purchase serialize on its
+row lock instead of racing on a read-modify-write. Every rollup write bumps
+``modified`` so sync pulls it. Each Purchases save derives the three fields
+from Payment in ``before_save``, so a stale copy cannot write old values back
+and the save stays the purchase's only write.
+
+``repair`` walks every purchase in name-ordered chunks, recomputes the totals
+from one grouped Payment query per chunk and reports (or, with
+``repair=True``, fixes) any drift. Queue it with ``enqueue_repair`` or run it
+with:
+
+	bench --site <site> farmlink-repair-payment-rollup [--repair]
+"""
+
+from __future__ import annotations
+
+import frappe
+from frappe.utils import cint, flt, now_datetime
+
+from farmlink.supply_chain import purchase_rollup
+
+PURCHASES = "Purchases"
+PAYMENT = "Payment"
+
+ROLLUP_FIELDS = ("paid_amount", "outstanding_amount", "status")
+
+# Currency columns are decimal(21,9); anything below a cent is rounding.
+_TOLERANCE = 0.005
+_CHUNK_SIZE = 500
+
+# {site: rollup fields present on tabPurchases}; the schema only changes on
+# migrate, so each worker process checks it once per site.
+_columns: dict[str, tuple[str, ...]] = {}
+
+
+def rollup_columns() -> tuple[str, ...]:
+	site = getattr(frappe.local, "site", None) or ""
+	if site not in _columns:
+		existing = set(frappe.db.get_table_columns(PURCHASES))
+		_columns[site] = tuple(field for field in ROLLUP_FIELDS if field in existing)
+	return _columns[site]
+
+
+def reset_columns() -> None:
+	"""Forget the cached schema check, e.g. after a migrate adds the rollup fields."""
+	_columns.clear()
+
+
+def payment_status(paid: float, outstanding: float) -> str:
+	if paid <= 0:
+		return "Unpaid"
+	if outstanding > 0:
+		return "Partially Paid"
+	return "Paid"
+
+
+def _contribution(doc) -> tuple[str, float] | None:
+	"""The (purchase, amount) a payment counts towards; cancelled payments count for nothing."""
+	if not doc or not doc.get("purchase_invoice") or doc.get("docstatus") == 2:
+		return None
+	return doc.purchase_invoice, flt(doc.get("payment_amount"))
+
+
+def on_payment_change(doc, method=None):
+	"""Payment on_update / on_trash: apply this payment's delta to its purchase(s)."""
+	if method == "on_trash":
+		before, after = doc, None
+	elif doc.flags.in_insert:
+		before, after = None, doc
+	else:
+		before, after = doc.get_doc_before_save(), doc
+		if before is None:
+			# Saved without a loaded previous version: nothing to diff against.
+			if doc.get("purchase_invoice"):
+				recompute(doc.purchase_invoice)
+			return
+
+	purchase_rollup.move_payment(before, after)
+	old, new = _contribution(before), _contribution(after)
+
+	deltas: dict[str, float] = {}
+	if old:
+		deltas[old[0]] = deltas.get(old[0], 0.0) - old[1]
+	if new:
+		deltas[new[0]] = deltas.get(new[0], 0.0) + new[1]
+	if old and new and old[0] == new[0] and abs(deltas[old[0]]) <= _TOLERANCE:
+		return
+	# Sorted so two payments moving between the same purchases lock them in one order.
+	for purchase in sorted(deltas):
+		apply_delta(purchase, deltas[purchase])
+
+
+def on_purchase_save(doc, method=None):
+	"""Purchases before_save: derive paid / outstanding / status from Payment.
+
+	The values on the document come from the client, and a stale Desk form or
+	an older mobile copy carries old ones; a changed total moves outstanding
+	and status too. A purchase that is not saved yet has no payments.
+	"""
+	paid = 0.0 if doc.is_new() else _paid_totals([doc.name]).get(doc.name, 0.0)
+	expected = _expected(doc.total_price, paid)
+	for field in rollup_columns():
+		doc.set(field, expected[field])
+
+
+def apply_delta(purchase: str, delta: float) -> None:
+	"""Add ``delta`` to the purchase's paid amount and rederive outstanding and status.
+
+	MariaDB evaluates single-table ``SET`` assignments left to right, each one
+	seeing the values assigned before it, so outstanding is computed from the
+	new paid amount and status from both. The row is read ``FOR UPDATE`` first
+	so the daily purchase rollup can move it from its old bucket to its new one.
+	``modified`` is bumped so sync pulls the change and stale saves are refused.
+	"""
+	columns = rollup_columns()
+	if "paid_amount" not in columns:
+		# Pre-migrate schema: fall back to the full recompute it used to do.
+		recompute(purchase)
+		return
+
+	before = _locked_row(purchase)
+	if not before:
+		return
+
+	assignments = [
+		"modified = %(now)s",
+		"modified_by = %(user)s",
+		"paid_amount = IFNULL(paid_amount, 0) + %(delta)s",
+	]
+	if "outstanding_amount" in columns:
+		assignments.append("outstanding_amount = GREATEST(IFNULL(total_price, 0) - paid_amount, 0)")
+	if "status" in columns:
+		assignments.append(
+			"""status = CASE
+				WHEN paid_amount <= 0 THEN 'Unpaid'
+				WHEN IFNULL(total_price, 0) - paid_amount > 0 THEN 'Partially Paid'
+				ELSE 'Paid'
+			END"""
+		)
+	frappe.db.sql(
+		f"""
+		UPDATE `tab{PURCHASES}`
+		SET {", ".join(assignments)}
+		WHERE name = %(purchase)s
+		""",
+		{"delta": delta, "purchase": purchase, "now": now_datetime(), "user": frappe.session.user},
+	)
+	paid = flt(before.paid_amount) + delta
+	purchase_rollup.move_purchase(before, {**before, **_expected(before.total_price, paid)})
+
+
+def _locked_row(purchase: str):
+	fields = (*purchase_rollup.PURCHASE_FIELDS, *rollup_columns())
+	rows = frappe.db.sql(
+		f"""
+		SELECT {", ".join(dict.fromkeys(fields))}
+		FROM `tab{PURCHASES}`
+		WHERE name = %s
+		FOR UPDATE
+		""",
+		purchase,
+		as_dict=True,
+	)
+	return rows[0] if rows else None
+
+
+def _paid_totals(purchases) -> dict[str, float]:
+	rows = frappe.db.sql(
+		f"""
+		SELECT purchase_invoice, COALESCE(SUM(payment_amount), 0)
+		FROM `tab{PAYMENT}`
+		WHERE purchase_invoice IN %s AND docstatus != 2
+		GROUP BY purchase_invoice
+		""",
+		(tuple(purchases),),
+	)
+	return {purchase: flt(paid) for purchase, paid in rows}
+
+
+def _expected(total_price, paid) -> dict:
+	outstanding = max(flt(total_price) - paid, 0.0)
+	return {
+		"paid_amount": paid,
+		"outstanding_amount": outstanding,
+		"status": payment_status(paid, outstanding),
+	}
+
+
+def recompute(purchase: str) -> dict:
+	"""Rewrite one purchase's rollup from its payments if it differs."""
+	before = _locked_row(purchase)
+	if not before:
+		return {}
+	expected = _expected(before.total_price, _paid_totals([purchase]).get(purchase, 0.0))
+	if any(_differs(before.get(field), expected[field]) for field in rollup_columns()):
+		_write(before, expected)
+	return expected
+
+
+def _write(row, expected: dict) -> None:
+	updates = {field: expected[field] for field in rollup_columns()}
+	if updates:
+		# Bumps modified, so devices pull the corrected values.
+		frappe.db.set_value(PURCHASES, row.name, updates)
+		purchase_rollup.move_purchase(row, {**row, **updates})
+
+
+def repair(repair: bool = False, chunk_size: int = _CHUNK_SIZE, commit=None) -> dict:
+	"""Recompute every purchase's rollup in name-ordered chunks and report drift.
+
+	Returns ``{"purchases": n, "drift": [...], "repaired": bool}``; each drift
+	entry carries the purchase, the stored values and the recomputed ones.
+	With ``repair`` each chunk's fixes are committed (``commit``, by default
+	``frappe.db.commit``) before the next chunk.
+	"""
+	commit = commit or frappe.db.commit
+	columns = rollup_columns()
+	checked = 0
+	drift = []
+	last = ""
+	while True:
+		rows = frappe.db.sql(
+			f"""
+			SELECT {", ".join(dict.fromkeys((*purchase_rollup.PURCHASE_FIELDS, *columns)))}
+			FROM `tab{PURCHASES}`
+			WHERE name > %s
+			ORDER BY name
+			LIMIT %s
+			""",
+			(last, chunk_size),
+			as_dict=True,
+		)
+		if not rows:
+			break
+		last = rows[-1].name
+		checked += len(rows)
+
+		paid = _paid_totals([row.name for row in rows])
+		for row in rows:
+			expected = _expected(row.total_price, paid.get(row.name, 0.0))
+			stored = {field: row.get(field) for field in columns}
+			if any(_differs(stored[field], expected[field]) for field in columns):
+				drift.append({"purchase": row.name, "stored": stored, "expected": expected})
+				if repair:
+					_write(row, expected)
+		if repair:
+			commit()
+		if len(rows) < chunk_size:
+			break
+
+	if drift:
+		frappe.logger("farmlink.payment_rollup").warning(
+			f"{len(drift)} of {checked} purchases had drifted payment rollups"
+			+ (" (repaired)" if repair else "")
+		)
+	return {"purchases": checked, "drift": drift, "repaired": bool(repair and drift)}
+
+
+def _differs(stored, expected) -> bool:
+	if isinstance(expected, str):
+		return (stored or "") != expected
+	return abs(flt(stored) - expected) > _TOLERANCE
+
+
+@frappe.whitelist()
+def enqueue_repair(repair: bool = False):
+	"""Queue ``repair`` on the long worker; the result lands in the job log."""
+	frappe.only_for("System Manager")
+	job = frappe.enqueue(
+		"farmlink.supply_chain.payment_rollup.repair",
+		queue="long",
+		timeout=3600,
+		job_id="farmlink-payment-rollup-repair",
+		deduplicate=True,
+		repair=bool(cint(repair)),
+	)
+	return {"job_id": job.id if job else None}
@@ -0,0 +1,329 @@
+"""
+Bulk farmer payouts.
+
+Paying farmers used to mean one ``make_payment_from_purchase`` call per
+purchase: a ``get_payment_summary``, a full ``Payment.insert()`` and its hooks,
+each. A Payout Batch pays every outstanding purchase of one center and date
+range in a single background job:
+
+1. one ``SELECT ... FOR UPDATE`` over Purchases picks the outstanding
+   purchases and locks them, so a payment recorded meanwhile cannot be paid
+   twice;
+2. farmers are read in chunked ``IN`` queries and each purchase is routed by
+   the farmer's ``preferred_payment_method`` (Telebirr, Bank, or Cash when
+   unset); purchases whose farmer lacks the account details for that method
+   are skipped and listed in the batch log;
+3. Payment names come from one Series update and the rows go in with
+   ``frappe.db.bulk_insert``;
+4. the purchases are settled with one set-based ``UPDATE`` per chunk, the
+   daily purchase rollup gets one combined delta and the paid farmers' cached
+   profiles are dropped.
+
+The job is one transaction: a batch either pays everything it selected or
+nothing. ``download_payout_file`` then streams the payment file with one line
+per farmer and method, read back from the batch's Payments in keyset pages.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+
+import frappe
+from frappe import _
+from frappe.utils import cstr, flt, getdate, now_datetime
+from werkzeug.wrappers import Response
+
+from farmlink.api import farmer_profile
+from farmlink.supply_chain import purchase_rollup
+from farmlink.utils import background_jobs
+from farmlink.utils.naming import reserve_names
+
+BATCH = "Payout Batch"
+PAYMENT = "Payment"
+PAYMENT_SERIES = "PAY-.YY.-.MM.-.DD.-.####"
+
+METHODS = ("Telebirr", "Bank", "Cash")
+
+_CHUNK_SIZE = 1000
+_FILE_CHUNK = 5000
+_LOG_LINES = 500
+
+_PAYMENT_FIELDS = (
+	"name",
+	"creation",
+	"modified",
+	"owner",
+	"modified_by",
+	"docstatus",
+	"naming_series",
+	"purchase_invoice",
+	"farmer",
+	"purchase_amount",
+	"outstanding_amount",
+	"payment_amount",
+	"payment_date",
+	"mode_of_payment",
+	"purchase_type",
+	"supplier",
+	"payout_batch",
+)
+
+FILE_COLUMNS = (
+	("reference", "Reference"),
+	("payment_method", "Payment Method"),
+	("farmer", "Farmer"),
+	("farmer_name", "Farmer Name"),
+	("telebirr_phone", "Telebirr Phone"),
+	("bank_name", "Bank"),
+	("bank_account_number", "Account Number"),
+	("purchases", "Purchases"),
+	("amount", "Amount"),
+)
+
+
+def enqueue_batch(batch) -> dict:
+	"""Queue a Draft or Failed batch on the long worker."""
+	return background_jobs.enqueue(batch, "farmlink.supply_chain.payout.create_payments", timeout=3600)
+
+
+def create_payments(batch) -> dict:
+	"""Create one Payment per outstanding purchase of the batch and settle the purchases."""
+	purchases = _outstanding_purchases(batch)
+	farmers = _farmers({row.farmer for row in purchases if row.farmer})
+
+	lines = []
+	skipped = []
+	for row in purchases:
+		farmer = farmers.get(row.farmer)
+		method = payment_method(farmer)
+		if batch.payment_method not in (None, "", "All") and method != batch.payment_method:
+			continue
+		problem = _account_problem(row, farmer, method)
+		if problem:
+			skipped.append(f"{row.name}: {problem}")
+			continue
+		lines.append((row, method))
+
+	if lines:
+		_insert_payments(batch, lines)
+		_settle_purchases(batch, lines)
+
+	log = "\n".join(skipped[:_LOG_LINES])
+	if len(skipped) > _LOG_LINES:
+		log += "\n" + _("... and {0} more").format(len(skipped) - _LOG_LINES)
+	return {
+		"purchase_count": len(lines),
+		"farmer_count": len({row.farmer for row, _method in lines}),
+		"total_amount": sum(flt(row.outstanding_amount) for row, _method in lines),
+		"skipped_count": len(skipped),
+		"log": log or None,
+	}
+
+
+def payment_method(farmer) -> str:
+	method = (farmer or {}).get("preferred_payment_method") or "Cash"
+	return method if method in METHODS else "Cash"
+
+
+def _outstanding_purchases(batch) -> list:
+	fields = dict.fromkeys(
+		(*purchase_rollup.PURCHASE_FIELDS, "paid_amount", "farmer", "purchase_type", "supplier")
+	)
+	return frappe.db.sql(
+		f"""
+		SELECT {", ".join(f"`{field}`" for field in fields)}
+		FROM `tabPurchases`
+		WHERE collection_center = %(center)s
+			AND purchase_date BETWEEN %(from_date)s AND %(to_date)s
+			AND outstanding_amount > 0
+			AND docstatus < 2
+		ORDER BY farmer, name
+		FOR UPDATE
+		""",
+		{
+			"center": batch.center,
+			"from_date": getdate(batch.from_date),
+			"to_date": getdate(batch.to_date),
+		},
+		as_dict=True,
+	)
+
+
+def _farmers(names) -> dict:
+	farmers = {}
+	names = sorted(names)
+	for start in range(0, len(names), _CHUNK_SIZE):
+		for row in frappe.get_all(
+			"Farmers",
+			filters={"name": ["in", names[start : start + _CHUNK_SIZE]]},
+			fields=[
+				"name",
+				"full_name",
+				"phone_number",
+				"preferred_payment_method",
+				"telebirr_phone_number",
+				"bank_name",
+				"bank_account_number",
+			],
+			ignore_permissions=True,
+		):
+			farmers[row.name] = row
+	return farmers
+
+
+def _account_problem(purchase, farmer, method) -> str | None:
+	if not purchase.farmer:
+		return _("no farmer on the purchase")
+	if not farmer:
+		return _("farmer {0} not found").format(purchase.farmer)
+	if method == "Telebirr" and not (farmer.telebirr_phone_number or farmer.phone_number):
+		return _("no Telebirr phone number")
+	if method == "Bank" and not (farmer.bank_name and farmer.bank_account_number):
+		return _("no bank name or account number")
+	return None
+
+
+def _insert_payments(batch, lines) -> None:
+	now = now_datetime()
+	user = frappe.session.user
+	payment_date = batch.payment_date or now
+	names = reserve_names(len(lines), PAYMENT_SERIES)
+	values = [
+		(
+			name,
+			now,
+			now,
+			user,
+			user,
+			0,
+			PAYMENT_SERIES,
+			row.name,
+			row.farmer,
+			flt(row.total_price),
+			flt(row.outstanding_amount),
+			flt(row.outstanding_amount),
+			payment_date,
+			method,
+			row.purchase_type,
+			row.supplier,
+			batch.name,
+		)
+		for name, (row, method) in zip(names, lines, strict=True)
+	]
+	frappe.db.bulk_insert(PAYMENT, fields=list(_PAYMENT_FIELDS), values=values, chunk_size=_CHUNK_SIZE)
+
+
+def _settle_purchases(batch, lines) -> None:
+	"""Mark the purchases paid in full and move them (and the new payments) in the daily rollup.
+
+	The rows are still locked from the selecting query, so each purchase's
+	outstanding amount is exactly what was just paid. Single-table ``SET``
+	runs left to right: paid absorbs outstanding before outstanding is zeroed.
+	``modified`` is bumped so devices pull the Paid status and a stale copy
+	cannot be saved over it.
+	"""
+	names = [row.name for row, _method in lines]
+	now = now_datetime()
+	for start in range(0, len(names), _CHUNK_SIZE):
+		frappe.db.sql(
+			"""
+			UPDATE `tabPurchases`
+			SET modified = %(now)s,
+				modified_by = %(user)s,
+				paid_amount = IFNULL(paid_amount, 0) + outstanding_amount,
+				outstanding_amount = 0,
+				status = 'Paid'
+			WHERE name IN %(names)s
+			""",
+			{"now": now, "user": frappe.session.user, "names": tuple(names[start : start + _CHUNK_SIZE])},
+		)
+
+	payment = {"payment_date": batch.payment_date or now_datetime()}
+	deltas: dict = {}
+	for row, _method in lines:
+		settled = {**row, "paid_amount": flt(row.paid_amount) + flt(row.outstanding_amount)}
+		settled.update(outstanding_amount=0, status="Paid")
+		purchase_rollup.accumulate(deltas, purchase_rollup.purchase_contribution(row), -1)
+		purchase_rollup.accumulate(deltas, purchase_rollup.purchase_contribution(settled), 1)
+		purchase_rollup.accumulate(
+			deltas,
+			purchase_rollup.payment_contribution({**payment, "payment_amount": row.outstanding_amount}, row),
+			1,
+		)
+	purchase_rollup.apply_deltas(deltas)
+	farmer_profile.invalidate({row.farmer for row, _method in lines})
+
+
+def _file_rows(batch_name: str, method: str | None, after: tuple[str, str], limit: int) -> list:
+	conditions = [
+		"pay.payout_batch = %(batch)s",
+		"(pay.mode_of_payment, pay.farmer) > (%(after_method)s, %(after_farmer)s)",
+	]
+	if method:
+		conditions.append("pay.mode_of_payment = %(method)s")
+	return frappe.db.sql(
+		f"""
+		SELECT
+			pay.mode_of_payment AS payment_method, pay.farmer,
+			MIN(farmer.full_name) AS farmer_name,
+			MIN(IFNULL(NULLIF(farmer.telebirr_phone_number, ''), farmer.phone_number)) AS telebirr_phone,
+			MIN(farmer.bank_name) AS bank_name,
+			MIN(farmer.bank_account_number) AS bank_account_number,
+			COUNT(*) AS purchases,
+			SUM(pay.payment_amount) AS amount
+		FROM `tab{PAYMENT}` pay
+		LEFT JOIN `tabFarmers` farmer ON farmer.name = pay.farmer
+		WHERE {" AND ".join(conditions)}
+		GROUP BY pay.mode_of_payment, pay.farmer
+		ORDER BY pay.mode_of_payment, pay.farmer
+		LIMIT %(limit)s
+		""",
+		{
+			"batch": batch_name,
+			"method": method,
+			"after_method": after[0],
+			"after_farmer": after[1],
+			"limit": limit,
+		},
+		as_dict=True,
+	)
+
+
+@frappe.whitelist()
+def download_payout_file(batch, method=None):
+	"""Stream the batch's payout file as CSV: one line per farmer and payment method."""
+	doc = frappe.get_doc(BATCH, batch)
+	doc.check_permission("read")
+	if doc.status != "Completed":
+		frappe.throw(_("Payout Batch {0} has not been paid yet").format(doc.name))
+	if method and method not in METHODS:
+		frappe.throw(_("Unknown payment method {0}").format(method))
+
+	def generate():
+		buffer = io.StringIO()
+		writer = csv.writer(buffer)
+		writer.writerow([label for _field, label in FILE_COLUMNS])
+		after = ("", "")
+		while True:
+			rows = _file_rows(doc.name, method, after, _FILE_CHUNK)
+			for row in rows:
+				row.reference = f"{doc.name}-{row.farmer}"
+				if row.payment_method != "Telebirr":
+					row.telebirr_phone = None
+				if row.payment_method != "Bank":
+					row.bank_name = row.bank_account_number = None
+				writer.writerow([cstr(row.get(field)) for field, _label in FILE_COLUMNS])
+			yield buffer.getvalue()
+			buffer.seek(0)
+			buffer.truncate(0)
+			if len(rows) < _FILE_CHUNK:
+				break
+			after = (rows[-1].payment_method, rows[-1].farmer)
+
+	suffix = f"-{method.lower()}" if method else ""
+	return Response(
+		generate(),
+		mimetype="text/csv",
+		headers={"Content-Disposition": f'attachment; filename="{doc.name}{suffix}.csv"'},
+	)
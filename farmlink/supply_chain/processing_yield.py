@@ -0,0 +1,198 @@
+"""
+Processing yield facts, kept current by the processing stock hooks.
+
+Conversion ratios (cherry -> parchment / dried cherry, parchment / dried cherry
+-> green bean) used to be worked out by hand from ``weight_in_kg`` and the
+output table of every Primary and Secondary Processing in a season. Each
+Completed processing document now keeps one Processing Yield row (input kg,
+output kg, ratio, center, processing type, season) up to date from the same
+``@depends_on`` hook that posts its stock, and any other status removes it.
+
+Rows outside ``EXPECTED_YIELD`` for their conversion are flagged
+``out_of_range``; ``yield_percentiles`` summarizes a center / season from the
+fact table alone.
+"""
+
+from __future__ import annotations
+
+import frappe
+from frappe.utils import cint, flt, get_datetime, getdate, now_datetime
+
+from farmlink.supply_chain.stock_balance import bucket_name
+
+YIELD = "Processing Yield"
+
+# The coffee season runs from the October harvest to the following September.
+SEASON_START_MONTH = 10
+
+# (input form, output form) -> (min, max) output kg per input kg.
+EXPECTED_YIELD = {
+	("Cherry", "Parchment"): (0.16, 0.24),
+	("Cherry", "Dried Cherry"): (0.35, 0.55),
+	("Parchment", "Green Bean"): (0.75, 0.85),
+	("Dried Cherry", "Green Bean"): (0.45, 0.60),
+}
+
+_FIELDS = (
+	"source_doctype",
+	"source_name",
+	"stage",
+	"center",
+	"processing_type",
+	"season",
+	"posting_date",
+	"input_form",
+	"output_form",
+	"input_kg",
+	"output_kg",
+	"yield_ratio",
+	"expected_min",
+	"expected_max",
+	"out_of_range",
+)
+
+
+def season_of(date) -> str:
+	date = getdate(date)
+	start = date.year if date.month >= SEASON_START_MONTH else date.year - 1
+	return f"{start}/{(start + 1) % 100:02d}"
+
+
+def _fact(doc) -> dict | None:
+	from farmlink.supply_chain.stock_ledger import _primary_output_form
+
+	if (doc.status or "").strip() != "Completed":
+		return None
+	if doc.doctype == "Primary Processing":
+		stage, center, processing_type = "Primary", doc.processing_center, doc.processing_type
+		input_form, output_form = "Cherry", _primary_output_form(doc.processing_type)
+		outputs, when = doc.get("processing_output"), doc.get("logged_time")
+	else:
+		stage, center = "Secondary", doc.get("processed_center") or doc.processing_center
+		input_form, output_form = (doc.coffee_type or "").strip(), "Green Bean"
+		processing_type = input_form
+		outputs, when = doc.get("processed_output"), doc.get("log_time")
+
+	input_kg = flt(doc.weight_in_kg)
+	output_kg = sum(flt(row.weightkg) for row in outputs or [])
+	if not center or input_kg <= 0 or output_kg <= 0:
+		return None
+
+	ratio = output_kg / input_kg
+	expected_min, expected_max = EXPECTED_YIELD.get((input_form, output_form), (0.0, 0.0))
+	posting_date = getdate(get_datetime(when) if when else now_datetime())
+	return {
+		"source_doctype": doc.doctype,
+		"source_name": doc.name,
+		"stage": stage,
+		"center": center,
+		"processing_type": processing_type or "",
+		"season": season_of(posting_date),
+		"posting_date": posting_date,
+		"input_form": input_form,
+		"output_form": output_form,
+		"input_kg": input_kg,
+		"output_kg": output_kg,
+		"yield_ratio": ratio,
+		"expected_min": expected_min,
+		"expected_max": expected_max,
+		"out_of_range": cint(bool(expected_max) and not expected_min <= ratio <= expected_max),
+	}
+
+
+def refresh(doc) -> None:
+	"""Upsert (or drop) the yield fact of a Primary / Secondary Processing."""
+	if doc.doctype not in ("Primary Processing", "Secondary Processing"):
+		return
+	fact = _fact(doc)
+	if fact is None:
+		clear(doc)
+		return
+
+	now = now_datetime()
+	user = frappe.session.user
+	columns = ("name", "creation", "modified", "owner", "modified_by", *_FIELDS)
+	values = (bucket_name((doc.doctype, doc.name)), now, now, user, user, *(fact[f] for f in _FIELDS))
+	updates = ", ".join(f"`{field}` = VALUES(`{field}`)" for field in ("modified", *_FIELDS))
+	frappe.db.sql(
+		f"""
+		INSERT INTO `tab{YIELD}` ({", ".join(f"`{c}`" for c in columns)})
+		VALUES ({", ".join(["%s"] * len(columns))})
+		ON DUPLICATE KEY UPDATE {updates}
+		""",
+		values,
+	)
+
+
+def clear(doc) -> None:
+	if doc.doctype in ("Primary Processing", "Secondary Processing"):
+		frappe.db.delete(YIELD, {"name": bucket_name((doc.doctype, doc.name))})
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+	"""Linear-interpolated percentile (same definition as PERCENTILE_CONT)."""
+	if len(sorted_values) == 1:
+		return sorted_values[0]
+	rank = (len(sorted_values) - 1) * pct / 100.0
+	low = int(rank)
+	high = min(low + 1, len(sorted_values) - 1)
+	return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+@frappe.whitelist()
+def yield_percentiles(
+	center=None, season=None, stage=None, processing_type=None, percentiles="5,25,50,75,95"
+):
+	"""Yield distribution per (center, season, stage, processing type) from the fact table."""
+	frappe.has_permission(YIELD, "read", throw=True)
+	filters = {}
+	for field, value in (
+		("center", center),
+		("season", season),
+		("stage", stage),
+		("processing_type", processing_type),
+	):
+		if value:
+			filters[field] = value
+	if isinstance(percentiles, str):
+		percentiles = [flt(p) for p in percentiles.split(",") if p.strip()]
+
+	rows = frappe.get_all(
+		YIELD,
+		filters=filters,
+		fields=[
+			"center",
+			"season",
+			"stage",
+			"processing_type",
+			"yield_ratio",
+			"input_kg",
+			"output_kg",
+			"out_of_range",
+		],
+		order_by="yield_ratio asc",
+	)
+	groups: dict[tuple, list] = {}
+	for row in rows:
+		groups.setdefault((row.center, row.season, row.stage, row.processing_type), []).append(row)
+
+	result = []
+	for (group_center, group_season, group_stage, group_type), members in sorted(groups.items()):
+		ratios = [flt(m.yield_ratio) for m in members]
+		input_kg = sum(flt(m.input_kg) for m in members)
+		result.append(
+			{
+				"center": group_center,
+				"season": group_season,
+				"stage": group_stage,
+				"processing_type": group_type,
+				"batches": len(members),
+				"out_of_range": sum(cint(m.out_of_range) for m in members),
+				# Mass-weighted yield: total output over total input.
+				"weighted_yield": flt(sum(flt(m.output_kg) for m in members) / input_kg, 4)
+				if input_kg
+				else 0,
+				"percentiles": {f"p{p:g}": flt(_percentile(ratios, p), 4) for p in percentiles},
+			}
+		)
+	return result
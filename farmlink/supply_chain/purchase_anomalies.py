@@ -0,0 +1,313 @@
+"""
+Anomaly scoring for Purchases, per center and purchase date.
+
+Price, weight and total are typed in by collectors or read from the Bluetooth
+scale, and nothing used to catch an outlier or a double entry. ``scan`` loads a
+date range of purchases in one query, splits it into (center, purchase_date)
+groups and scores each group with NumPy:
+
+* **Price Outlier** — robust z-score of ``price_rate_of_the_day`` against the
+  group's median, scaled by the median absolute deviation (or the mean
+  absolute deviation when most of the group shares one price, which is the
+  usual case for a center's rate of the day). A plain mean/stdev z-score cannot
+  reach 3 in a group of fewer than 11 purchases, however far off one price is.
+* **Total Mismatch** — ``total_price`` differs from rate x weight by more than
+  ``TOTAL_TOLERANCE`` (relative) and at least 1 birr.
+* **Near Duplicate** — same farmer, same weight within ``WEIGHT_TOLERANCE_KG``,
+  entered within ``DUPLICATE_WINDOW_MINUTES`` of each other.
+
+Findings go to the Purchase Anomaly review queue, named by (purchase, type) so
+a rescan updates rather than repeats them. A rescan also drops open findings
+that no longer hold. Reviewed ones (Confirmed / Dismissed) are left alone.
+
+``run_daily`` rescans yesterday and today. Sync pushes call
+``enqueue_for_purchases`` so the groups a push touched are rescanned in the
+background as soon as it commits.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from itertools import groupby
+
+import frappe
+import numpy as np
+from frappe.utils import add_days, flt, getdate, now_datetime, today
+
+ANOMALY = "Purchase Anomaly"
+
+Z_THRESHOLD = 3.5
+MIN_GROUP_SIZE = 4
+TOTAL_TOLERANCE = 0.005
+WEIGHT_TOLERANCE_KG = 0.01
+DUPLICATE_WINDOW_MINUTES = 10
+
+# Scan this many days per query so a full-season rescan stays bounded in memory.
+_DAYS_PER_QUERY = 7
+
+_UPSERT_FIELDS = (
+	"name",
+	"creation",
+	"modified",
+	"owner",
+	"modified_by",
+	"purchase",
+	"anomaly_type",
+	"score",
+	"details",
+	"related_purchase",
+	"center",
+	"purchase_date",
+	"farmer",
+	"review_status",
+)
+
+
+def anomaly_name(purchase: str, anomaly_type: str) -> str:
+	return hashlib.md5(f"{purchase}\x1f{anomaly_type}".encode()).hexdigest()
+
+
+# ---------- scoring ----------
+
+
+def robust_z(values: np.ndarray) -> np.ndarray:
+	"""Modified z-scores (Iglewicz-Hoaglin); zeros when the group has no spread."""
+	median = np.median(values)
+	deviation = np.abs(values - median)
+	mad = np.median(deviation)
+	if mad > 0:
+		return 0.6745 * (values - median) / mad
+	mean_ad = deviation.mean()
+	if mean_ad > 0:
+		return (values - median) / (1.253314 * mean_ad)
+	return np.zeros_like(values)
+
+
+def score_group(rows: list[dict]) -> list[dict]:
+	"""Score one (center, purchase_date) group; returns anomaly payloads."""
+	names = np.array([row["name"] for row in rows], dtype=object)
+	rate = np.array([flt(row["price_rate_of_the_day"]) for row in rows])
+	weight = np.array([flt(row["weight_in_kg"]) for row in rows])
+	total = np.array([flt(row["total_price"]) for row in rows])
+	created = np.array([row["creation"] for row in rows], dtype="datetime64[s]")
+	found = []
+
+	if len(rows) >= MIN_GROUP_SIZE:
+		priced = rate > 0
+		z = np.zeros_like(rate)
+		if priced.sum() >= MIN_GROUP_SIZE:
+			z[priced] = robust_z(rate[priced])
+		median = np.median(rate[priced]) if priced.any() else 0.0
+		for i in np.flatnonzero(np.abs(z) > Z_THRESHOLD):
+			found.append(
+				_finding(
+					rows[i],
+					"Price Outlier",
+					abs(z[i]),
+					f"Rate {rate[i]:g} vs center median {median:g} (z={z[i]:.1f})",
+				)
+			)
+
+	expected = rate * weight
+	gap = np.abs(total - expected)
+	mismatch = (gap > np.maximum(expected * TOTAL_TOLERANCE, 1.0)) & (expected > 0)
+	for i in np.flatnonzero(mismatch):
+		found.append(
+			_finding(
+				rows[i],
+				"Total Mismatch",
+				gap[i] / expected[i],
+				f"Total {total[i]:g} but rate x weight is {expected[i]:g}",
+			)
+		)
+
+	farmers, farmer_codes = np.unique(np.array([row["farmer"] or "" for row in rows]), return_inverse=True)
+	order = np.lexsort((created, weight, farmer_codes))
+	a, b = order[:-1], order[1:]
+	window = np.timedelta64(DUPLICATE_WINDOW_MINUTES * 60, "s")
+	duplicate = (
+		(farmer_codes[a] == farmer_codes[b])
+		& (farmers[farmer_codes[a]] != "")
+		& (np.abs(weight[a] - weight[b]) <= WEIGHT_TOLERANCE_KG)
+		& (np.abs(created[b] - created[a]) <= window)
+	)
+	for first, second in zip(a[duplicate], b[duplicate], strict=True):
+		minutes = abs((created[second] - created[first]).astype(int)) / 60
+		found.append(
+			_finding(
+				rows[second],
+				"Near Duplicate",
+				1.0,
+				f"Same farmer and {weight[second]:g} kg as {names[first]}, {minutes:.0f} min apart",
+				related=names[first],
+			)
+		)
+	return found
+
+
+def _finding(row, anomaly_type, score, details, related=None) -> dict:
+	return {
+		"purchase": row["name"],
+		"anomaly_type": anomaly_type,
+		"score": flt(score, 3),
+		"details": details,
+		"related_purchase": related,
+		"center": row["collection_center"],
+		"purchase_date": row["purchase_date"],
+		"farmer": row["farmer"],
+	}
+
+
+# ---------- scanning ----------
+
+
+def _load(from_date, to_date, centers=None) -> list[dict]:
+	clauses = ["purchase_date BETWEEN %(from_date)s AND %(to_date)s", "docstatus < 2"]
+	params = {"from_date": from_date, "to_date": to_date}
+	if centers:
+		clauses.append("collection_center IN %(centers)s")
+		params["centers"] = tuple(centers)
+	return frappe.db.sql(
+		f"""
+		SELECT name, collection_center, purchase_date, farmer, creation,
+			price_rate_of_the_day, weight_in_kg, total_price
+		FROM `tabPurchases`
+		WHERE {" AND ".join(clauses)}
+		ORDER BY collection_center, purchase_date, name
+		""",
+		params,
+		as_dict=True,
+	)
+
+
+def scan(from_date=None, to_date=None, centers=None) -> dict:
+	"""Rescan every (center, purchase_date) group in the range; returns counts."""
+	to_date = getdate(to_date or today())
+	from_date = getdate(from_date or to_date)
+	groups = findings = 0
+	start = from_date
+	while start <= to_date:
+		end = min(add_days(start, _DAYS_PER_QUERY - 1), to_date)
+		rows = _load(start, end, centers)
+		for (center, purchase_date), group in groupby(
+			rows, key=lambda row: (row["collection_center"], row["purchase_date"])
+		):
+			findings += _replace_group(center, purchase_date, score_group(list(group)))
+			groups += 1
+		start = add_days(end, 1)
+	return {"groups": groups, "anomalies": findings}
+
+
+def _replace_group(center, purchase_date, found: list[dict]) -> int:
+	"""Upsert a group's findings and drop its open findings that no longer hold."""
+	keep = {anomaly_name(f["purchase"], f["anomaly_type"]) for f in found}
+	stale = frappe.db.sql_list(
+		f"""
+		SELECT name FROM `tab{ANOMALY}`
+		WHERE center <=> %s AND purchase_date = %s AND review_status = 'Open'
+		""",
+		(center, purchase_date),
+	)
+	stale = [name for name in stale if name not in keep]
+	if stale:
+		frappe.db.delete(ANOMALY, {"name": ["in", stale]})
+	if not found:
+		return 0
+
+	now = now_datetime()
+	user = frappe.session.user
+	params = []
+	for f in found:
+		params.extend(
+			[
+				anomaly_name(f["purchase"], f["anomaly_type"]),
+				now,
+				now,
+				user,
+				user,
+				f["purchase"],
+				f["anomaly_type"],
+				f["score"],
+				f["details"],
+				f["related_purchase"],
+				f["center"],
+				f["purchase_date"],
+				f["farmer"],
+				"Open",
+			]
+		)
+	placeholders = "(" + ", ".join(["%s"] * len(_UPSERT_FIELDS)) + ")"
+	frappe.db.sql(
+		f"""
+		INSERT INTO `tab{ANOMALY}` ({", ".join(_UPSERT_FIELDS)})
+		VALUES {", ".join([placeholders] * len(found))}
+		ON DUPLICATE KEY UPDATE
+			score = VALUES(score),
+			details = VALUES(details),
+			related_purchase = VALUES(related_purchase),
+			center = VALUES(center),
+			purchase_date = VALUES(purchase_date),
+			farmer = VALUES(farmer),
+			modified = IF(review_status = 'Open', VALUES(modified), modified)
+		""",
+		params,
+	)
+	return len(found)
+
+
+def run_daily():
+	"""Scheduler: rescan yesterday and today for every center."""
+	scan(add_days(today(), -1), today())
+
+
+def rescan_purchases(purchases: list[str]) -> dict:
+	"""Rescan the (center, date) groups the given purchases belong to, and had findings in."""
+	if not purchases:
+		return {"groups": 0, "anomalies": 0}
+	groups = frappe.db.sql(
+		f"""
+		SELECT collection_center, purchase_date
+		FROM `tabPurchases`
+		WHERE name IN %(purchases)s AND purchase_date IS NOT NULL
+		UNION
+		SELECT center, purchase_date
+		FROM `tab{ANOMALY}`
+		WHERE purchase IN %(purchases)s AND review_status = 'Open'
+		""",
+		{"purchases": tuple(purchases)},
+	)
+	totals = {"groups": 0, "anomalies": 0}
+	for center, purchase_date in groups:
+		result = scan(purchase_date, purchase_date, centers=[center] if center else None)
+		totals["groups"] += result["groups"]
+		totals["anomalies"] += result["anomalies"]
+	return totals
+
+
+def on_purchase_trash(doc, method=None) -> None:
+	"""Purchases on_trash: drop its findings and unlink it from the ones that name it.
+
+	Runs before Frappe's link check, so deleting one half of a Near Duplicate
+	pair is not refused.
+	"""
+	frappe.db.delete(ANOMALY, {"purchase": doc.name})
+	frappe.db.sql(
+		f"""
+		UPDATE `tab{ANOMALY}`
+		SET related_purchase = NULL, modified = %s, modified_by = %s
+		WHERE related_purchase = %s
+		""",
+		(now_datetime(), frappe.session.user, doc.name),
+	)
+
+
+def enqueue_for_purchases(purchases: list[str]) -> None:
+	"""Queue a rescan of the groups these purchases belong to, once the push commits."""
+	if not purchases:
+		return
+	frappe.enqueue(
+		"farmlink.supply_chain.purchase_anomalies.rescan_purchases",
+		queue="short",
+		enqueue_after_commit=True,
+		purchases=sorted(set(purchases)),
+	)
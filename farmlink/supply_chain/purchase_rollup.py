@@ -0,0 +1,280 @@
+"""
+Daily purchase rollup behind the Supply Chain workspace cards and charts.
+
+The six Number Cards and six Dashboard Charts used to aggregate the raw
+Purchases and Payment tables on every workspace load. Purchase Daily Rollup
+holds the same totals per
+
+	(rollup_date, center, maturity, coffee_type, status)
+
+and is kept current from the Purchases and Payment hooks, including the
+outstanding/status moves ``payment_rollup`` makes when a payment lands:
+
+* a purchase counts on its purchase date under its current status, adding
+  purchase_count, weight_kg, total_price, price_rate_total and
+  outstanding_amount;
+* a payment counts on its payment date under its purchase's center, maturity
+  and coffee type with an empty status (payments have none of their own),
+  adding payment_count and payment_amount. When a purchase's center,
+  maturity or coffee type changes, its payments move with it.
+
+Each change is a before/after delta applied with one multi-row upsert, the
+same way ``stock_balance.apply_deltas`` maintains stock buckets. Cards and
+charts query the rollup through ``frappe.get_list``, so the
+``get_for_purchase_daily_rollup`` permission query scopes them to the user's
+center exactly as Purchases lists are scoped.
+
+``rebuild`` recomputes the table with one grouped scan per source table.
+"""
+
+from __future__ import annotations
+
+import hashlib
+
+import frappe
+from frappe.utils import flt, getdate, now_datetime
+
+ROLLUP = "Purchase Daily Rollup"
+
+KEY_FIELDS = ("rollup_date", "center", "maturity", "coffee_type", "status")
+MEASURES = (
+	"purchase_count",
+	"weight_kg",
+	"total_price",
+	"price_rate_total",
+	"outstanding_amount",
+	"payment_count",
+	"payment_amount",
+)
+
+# Purchases columns a purchase's contribution is derived from.
+PURCHASE_FIELDS = (
+	"name",
+	"creation",
+	"purchase_date",
+	"collection_center",
+	"maturity",
+	"coffee_type",
+	"status",
+	"weight_in_kg",
+	"total_price",
+	"price_rate_of_the_day",
+	"outstanding_amount",
+)
+
+# Purchases columns its payments are keyed under.
+PAYMENT_DIMENSIONS = ("collection_center", "maturity", "coffee_type")
+
+_TOLERANCE = 1e-6
+_UPSERT_CHUNK = 500
+
+
+def rollup_name(key: tuple[str, ...]) -> str:
+	return hashlib.md5("\x1f".join(key).encode("utf-8")).hexdigest()
+
+
+def _date_key(value, fallback) -> str:
+	return str(getdate(value or fallback or now_datetime()))
+
+
+def purchase_contribution(row) -> tuple[tuple[str, ...], dict[str, float]] | None:
+	if not row:
+		return None
+	key = (
+		_date_key(row.get("purchase_date"), row.get("creation")),
+		row.get("collection_center") or "",
+		row.get("maturity") or "",
+		row.get("coffee_type") or "",
+		row.get("status") or "",
+	)
+	return key, {
+		"purchase_count": 1,
+		"weight_kg": flt(row.get("weight_in_kg")),
+		"total_price": flt(row.get("total_price")),
+		"price_rate_total": flt(row.get("price_rate_of_the_day")),
+		"outstanding_amount": flt(row.get("outstanding_amount")),
+	}
+
+
+def _payment_key(day: str, purchase) -> tuple[str, ...]:
+	return (day, *(purchase.get(field) or "" for field in PAYMENT_DIMENSIONS), "")
+
+
+def payment_contribution(payment, purchase) -> tuple[tuple[str, ...], dict[str, float]] | None:
+	if not payment or not purchase or payment.get("docstatus") == 2:
+		return None
+	key = _payment_key(_date_key(payment.get("payment_date"), payment.get("creation")), purchase)
+	return key, {"payment_count": 1, "payment_amount": flt(payment.get("payment_amount"))}
+
+
+def accumulate(deltas: dict, contribution, sign: int) -> None:
+	if not contribution:
+		return
+	key, measures = contribution
+	bucket = deltas.setdefault(key, {})
+	for measure, value in measures.items():
+		bucket[measure] = bucket.get(measure, 0.0) + sign * value
+
+
+def apply_deltas(deltas: dict[tuple[str, ...], dict[str, float]]) -> None:
+	"""Add ``{key: {measure: delta}}`` to the rollup with multi-row upserts, in sorted key order."""
+	items = sorted(
+		(key, measures)
+		for key, measures in deltas.items()
+		if any(abs(value) > _TOLERANCE for value in measures.values())
+	)
+	if not items:
+		return
+
+	now = now_datetime()
+	user = frappe.session.user
+	columns = ("name", "creation", "modified", "owner", "modified_by", *KEY_FIELDS, *MEASURES)
+	row_placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+	updates = ",\n\t\t\t\t".join(f"{m} = {m} + VALUES({m})" for m in MEASURES)
+	for start in range(0, len(items), _UPSERT_CHUNK):
+		chunk = items[start : start + _UPSERT_CHUNK]
+		params = []
+		for key, measures in chunk:
+			params.extend([rollup_name(key), now, now, user, user, *key])
+			params.extend(measures.get(measure, 0) for measure in MEASURES)
+		frappe.db.sql(
+			f"""
+			INSERT INTO `tab{ROLLUP}` ({", ".join(columns)})
+			VALUES {", ".join([row_placeholder] * len(chunk))}
+			ON DUPLICATE KEY UPDATE
+				{updates},
+				modified = VALUES(modified),
+				modified_by = VALUES(modified_by)
+			""",
+			params,
+		)
+
+
+def move_purchase(before, after) -> None:
+	"""Take a purchase's old contribution off the rollup and add its new one."""
+	deltas: dict = {}
+	accumulate(deltas, purchase_contribution(before), -1)
+	accumulate(deltas, purchase_contribution(after), 1)
+	apply_deltas(deltas)
+
+
+def move_payment(before, after) -> None:
+	"""Same for a payment; both purchases' dimensions are read in one query."""
+	purchases = {p.get("purchase_invoice") for p in (before, after) if p and p.get("purchase_invoice")}
+	if not purchases:
+		return
+	dims = {
+		row.name: row
+		for row in frappe.get_all(
+			"Purchases",
+			filters={"name": ["in", list(purchases)]},
+			fields=["name", "collection_center", "maturity", "coffee_type"],
+			ignore_permissions=True,
+		)
+	}
+	deltas: dict = {}
+	if before:
+		accumulate(deltas, payment_contribution(before, dims.get(before.get("purchase_invoice"))), -1)
+	if after:
+		accumulate(deltas, payment_contribution(after, dims.get(after.get("purchase_invoice"))), 1)
+	apply_deltas(deltas)
+
+
+def move_purchase_payments(purchase: str, before, after) -> None:
+	"""Re-key a purchase's payments when its center, maturity or coffee type changes.
+
+	One grouped query by payment date; each day's totals come off the old
+	dimensions and go on under the new ones (or only come off, on delete).
+	"""
+	if (
+		before
+		and after
+		and all((before.get(field) or "") == (after.get(field) or "") for field in PAYMENT_DIMENSIONS)
+	):
+		return
+	rows = frappe.db.sql(
+		"""
+		SELECT DATE(IFNULL(payment_date, creation)), COUNT(*), SUM(payment_amount)
+		FROM `tabPayment`
+		WHERE purchase_invoice = %s AND docstatus != 2
+		GROUP BY 1
+		""",
+		purchase,
+	)
+	deltas: dict = {}
+	for day, count, amount in rows:
+		measures = {"payment_count": flt(count), "payment_amount": flt(amount)}
+		for dims, sign in ((before, -1), (after, 1)):
+			if dims:
+				accumulate(deltas, (_payment_key(str(day), dims), measures), sign)
+	apply_deltas(deltas)
+
+
+def on_purchase_change(doc, method=None):
+	"""Purchases on_update / on_trash."""
+	if method == "on_trash":
+		move_purchase(doc, None)
+		move_purchase_payments(doc.name, doc, None)
+	elif doc.flags.in_insert:
+		move_purchase(None, doc)
+	else:
+		before = doc.get_doc_before_save()
+		if before is not None:
+			move_purchase(before, doc)
+			move_purchase_payments(doc.name, before, doc)
+
+
+def rebuild() -> int:
+	"""Replace the rollup with totals recomputed from Purchases and Payment."""
+	deltas: dict = {}
+	purchases = frappe.db.sql(
+		"""
+		SELECT
+			DATE(IFNULL(purchase_date, creation)), IFNULL(collection_center, ''),
+			IFNULL(maturity, ''), IFNULL(coffee_type, ''), IFNULL(status, ''),
+			COUNT(*), SUM(weight_in_kg), SUM(total_price),
+			SUM(price_rate_of_the_day), SUM(outstanding_amount)
+		FROM `tabPurchases`
+		GROUP BY 1, 2, 3, 4, 5
+		"""
+	)
+	for row in purchases:
+		key = (str(row[0]), *row[1:5])
+		accumulate(deltas, (key, dict(zip(MEASURES[:5], map(flt, row[5:]), strict=True))), 1)
+
+	payments = frappe.db.sql(
+		"""
+		SELECT
+			DATE(IFNULL(pay.payment_date, pay.creation)), IFNULL(pur.collection_center, ''),
+			IFNULL(pur.maturity, ''), IFNULL(pur.coffee_type, ''),
+			COUNT(*), SUM(pay.payment_amount)
+		FROM `tabPayment` pay
+		INNER JOIN `tabPurchases` pur ON pur.name = pay.purchase_invoice
+		WHERE pay.docstatus != 2
+		GROUP BY 1, 2, 3, 4
+		"""
+	)
+	for row in payments:
+		key = (str(row[0]), *row[1:4], "")
+		accumulate(deltas, (key, {"payment_count": flt(row[4]), "payment_amount": flt(row[5])}), 1)
+
+	frappe.db.sql(f"DELETE FROM `tab{ROLLUP}`")
+	apply_deltas(deltas)
+	return len(deltas)
+
+
+@frappe.whitelist()
+def average_price_rate(filters=None):
+	"""Custom Number Card: mean price rate of the day over the filtered rollup rows."""
+	filters = frappe.parse_json(filters) if filters else [[ROLLUP, "rollup_date", "Timespan", "last 7 days"]]
+	totals = frappe.get_list(
+		ROLLUP,
+		filters=filters,
+		fields=["sum(price_rate_total) as rate_total", "sum(purchase_count) as purchases"],
+	)
+	total = totals[0] if totals else {}
+	purchases = flt(total.get("purchases"))
+	return {
+		"value": flt(total.get("rate_total")) / purchases if purchases else 0,
+		"fieldtype": "Currency",
+	}
@@ -0,0 +1,115 @@
+"""
+Compaction of cancelled Coffee Stock Ledger rows.
+
+Reversals only flag rows ``is_cancelled=1``, so every save-and-revert used to
+leave a dead row in the ledger for good, and every ledger scan (repost diffs,
+snapshot tails, reconcile) had to step over them. ``compact_cancelled_entries``
+runs daily and moves rows cancelled more than ``RETENTION_DAYS`` ago into the
+Coffee Stock Ledger Archive, one chunk per transaction; the live ledger keeps
+only live rows plus the recent cancellations still inside the window.
+
+The window is a site setting (``farmlink_csl_retention_days`` in
+site_config.json). Archived rows keep their original name and are indexed by
+(reference_doctype, reference_name); ``get_entries_for_reference`` returns a
+document's live and archived rows together for audits.
+"""
+
+from __future__ import annotations
+
+import frappe
+from frappe.utils import add_days, cint, now_datetime
+
+CSL = "Coffee Stock Ledger"
+ARCHIVE = "Coffee Stock Ledger Archive"
+
+RETENTION_DAYS = 30
+_CHUNK_SIZE = 1000
+
+# Columns copied verbatim from the ledger row.
+_COPIED_FIELDS = (
+	"name",
+	"creation",
+	"owner",
+	"reference_doctype",
+	"reference_name",
+	"entry_ref",
+	"entry_type",
+	"posting_time",
+	"center",
+	"from_center",
+	"to_center",
+	"batch_ref",
+	"status",
+	"coffee_form",
+	"coffee_grade",
+	"qty_kg",
+	"remarks",
+)
+
+
+def retention_days() -> int:
+	value = frappe.conf.get("farmlink_csl_retention_days")
+	return RETENTION_DAYS if value is None else max(0, cint(value))
+
+
+def compact_cancelled_entries(retention: int | None = None, chunk_size: int = _CHUNK_SIZE) -> int:
+	"""Move rows cancelled before the retention window into the archive.
+
+	A row's ``modified`` is its cancellation time (cancelling is its last
+	write). Each chunk is copied and deleted in one transaction, so a row is
+	never in both tables or in neither. Returns the number of rows moved.
+	"""
+	cutoff = add_days(now_datetime(), -(retention_days() if retention is None else retention))
+	columns = ", ".join(f"`{field}`" for field in _COPIED_FIELDS)
+	moved = 0
+	while True:
+		names = frappe.db.sql_list(
+			f"""
+			SELECT name FROM `tab{CSL}`
+			WHERE is_cancelled=1 AND modified < %s
+			ORDER BY name
+			LIMIT %s
+			""",
+			(cutoff, chunk_size),
+		)
+		if not names:
+			break
+
+		now = now_datetime()
+		frappe.db.sql(
+			f"""
+			INSERT INTO `tab{ARCHIVE}`
+				({columns}, `cancelled_on`, `archived_on`, `modified`, `modified_by`)
+			SELECT {columns}, `modified`, %s, %s, %s
+			FROM `tab{CSL}`
+			WHERE name IN %s
+			ON DUPLICATE KEY UPDATE archived_on = VALUES(archived_on)
+			""",
+			(now, now, frappe.session.user, tuple(names)),
+		)
+		frappe.db.sql(f"DELETE FROM `tab{CSL}` WHERE name IN %s AND is_cancelled=1", (tuple(names),))
+		frappe.db.commit()
+		moved += len(names)
+		if len(names) < chunk_size:
+			break
+	return moved
+
+
+@frappe.whitelist()
+def get_entries_for_reference(reference_doctype, reference_name):
+	"""Every ledger row a document ever posted: live, cancelled and archived."""
+	frappe.has_permission(CSL, "read", throw=True)
+	filters = {"reference_doctype": reference_doctype, "reference_name": reference_name}
+	fields = [f for f in _COPIED_FIELDS if f not in ("owner", "creation")]
+
+	live = frappe.get_all(CSL, filters=filters, fields=[*fields, "is_cancelled", "modified"])
+	for row in live:
+		row.archived = 0
+		row.cancelled_on = row.pop("modified") if row.is_cancelled else None
+
+	archived = frappe.get_all(ARCHIVE, filters=filters, fields=[*fields, "cancelled_on"])
+	for row in archived:
+		row.is_cancelled = 1
+		row.archived = 1
+
+	return sorted(live + archived, key=lambda row: (row.posting_time or now_datetime(), row.name))
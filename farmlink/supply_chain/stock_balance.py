@@ -0,0 +1,314 @@
+"""
+Materialized Coffee Stock Balance maintained incrementally from the ledger.
+
+``_net_sum_query`` used to answer every ``center_balance`` / ``sum_csl_qty``
+call — including the ``_validate_out_qty`` check on every OUT posting — with a
+``SUM(CASE ...)`` over the whole Coffee Stock Ledger. The Coffee Stock Balance
+DocType holds the net quantity per bucket:
+
+	(center, coffee_form, coffee_grade, batch_ref, status)
+
+Every ledger write path in ``farmlink.utils.csl`` (insert, in-place update,
+cancellation) calls ``apply_deltas`` in the same transaction, so the table
+can never drift from the ledger unless someone edits CSL rows by hand.
+
+Each bucket's ``name`` is a hash of its key: a fully specified lookup is one
+primary-key read; a partial one (center + form, the common case) sums the
+handful of buckets under the (center, coffee_form, coffee_grade) index.
+
+Postings serialize per center on the center's anchor bucket
+``(center, "", "", "", "")`` (see ``lock_centers``), so postings at other
+centers never wait on each other.
+
+``stock_position`` answers the whole form x grade x status matrix for one or
+many centers with one grouped query, cached per center in Redis until the next
+posting touches that center.
+
+``reconcile`` recomputes every bucket with one grouped ledger scan and reports
+(or, with ``repair=True``, fixes) any difference. Run it with:
+
+	bench --site <site> farmlink-reconcile-stock-balance [--repair]
+"""
+
+from __future__ import annotations
+
+import hashlib
+
+import frappe
+from frappe.utils import flt, now_datetime
+
+CSL = "Coffee Stock Ledger"
+BALANCE = "Coffee Stock Balance"
+
+BUCKET_FIELDS = ("center", "coffee_form", "coffee_grade", "batch_ref", "status")
+
+# Balances are sums of Float(21,9) columns; anything below this is rounding.
+_TOLERANCE = 1e-6
+
+_UPSERT_CHUNK = 500
+
+_POSITION_CACHE = "farmlink_stock_position"
+
+
+def bucket_key(row) -> tuple[str, ...]:
+	"""Normalized bucket for a ledger row or payload (None and "" are the same bucket)."""
+	return tuple((row.get(field) or "") for field in BUCKET_FIELDS)
+
+
+def bucket_name(key: tuple[str, ...]) -> str:
+	return hashlib.md5("\x1f".join(key).encode("utf-8")).hexdigest()
+
+
+def signed_qty(row) -> float:
+	qty = flt(row.get("qty_kg"))
+	return qty if (row.get("entry_type") or "").upper() == "IN" else -qty
+
+
+def apply_deltas(deltas: dict[tuple[str, ...], float]) -> None:
+	"""Add ``{bucket_key: delta_kg}`` to the balance table with multi-row upserts.
+
+	Buckets are written in sorted key order so concurrent postings touching the
+	same buckets always lock them in the same order.
+	"""
+	deltas = {key: delta for key, delta in deltas.items() if abs(delta) > _TOLERANCE}
+	if not deltas:
+		return
+
+	lock_centers(key[0] for key in deltas)
+	now = now_datetime()
+	user = frappe.session.user
+	items = sorted(deltas.items())
+	for start in range(0, len(items), _UPSERT_CHUNK):
+		chunk = items[start : start + _UPSERT_CHUNK]
+		params = []
+		for key, delta in chunk:
+			params.extend([bucket_name(key), now, now, user, user, *key, delta])
+		placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+		frappe.db.sql(
+			f"""
+			INSERT INTO `tab{BALANCE}`
+				(name, creation, modified, owner, modified_by,
+				 center, coffee_form, coffee_grade, batch_ref, status, qty_kg)
+			VALUES {placeholders}
+			ON DUPLICATE KEY UPDATE
+				qty_kg = qty_kg + VALUES(qty_kg),
+				modified = VALUES(modified),
+				modified_by = VALUES(modified_by)
+			""",
+			params,
+		)
+
+	invalidate_positions({key[0] for key in deltas})
+
+
+def add_row_delta(deltas: dict, row, sign: int = 1) -> None:
+	"""Accumulate a ledger row's signed quantity into ``deltas`` (sign=-1 to remove it)."""
+	key = bucket_key(row)
+	deltas[key] = deltas.get(key, 0.0) + sign * signed_qty(row)
+
+
+def get_balance(*, center, coffee_form, coffee_grade=None, batch_ref=None, status=None) -> float:
+	"""Net balance for the buckets matching every given dimension (None = any)."""
+	filters = {
+		"center": center,
+		"coffee_form": coffee_form,
+		"coffee_grade": coffee_grade,
+		"batch_ref": batch_ref,
+		"status": status,
+	}
+	if all(value is not None for value in filters.values()):
+		qty = frappe.db.get_value(BALANCE, bucket_name(bucket_key(filters)), "qty_kg")
+		return flt(qty)
+
+	clauses = []
+	params = []
+	for field, value in filters.items():
+		if value is None:
+			continue
+		clauses.append(f"{field}=%s")
+		params.append(value)
+	where = " AND ".join(clauses) or "1=1"
+	rows = frappe.db.sql(
+		f"SELECT COALESCE(SUM(qty_kg), 0) FROM `tab{BALANCE}` WHERE {where}",
+		params,
+	)
+	return flt(rows[0][0] if rows else 0)
+
+
+def lock_centers(centers) -> None:
+	"""Take the stock lock of each center, in sorted order, until the transaction ends.
+
+	The lock is the center's anchor bucket ``(center, "", "", "", "")``, created
+	on first use. An upsert of that primary key holds a record lock on the
+	row, with no gap locks. Every balance write (``apply_deltas``) and OUT check
+	(``lock_balance``) takes it before touching the center's buckets, and
+	``post_entries`` takes it for all of a document's centers up front, so two
+	postings always lock centers in the same order.
+	"""
+	now = now_datetime()
+	user = frappe.session.user
+	for center in sorted({center or "" for center in centers}):
+		key = (center, "", "", "", "")
+		frappe.db.sql(
+			f"""
+			INSERT INTO `tab{BALANCE}`
+				(name, creation, modified, owner, modified_by,
+				 center, coffee_form, coffee_grade, batch_ref, status, qty_kg)
+			VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 0)
+			ON DUPLICATE KEY UPDATE qty_kg = qty_kg
+			""",
+			(bucket_name(key), now, now, user, user, *key),
+		)
+
+
+def lock_balance(*, center, coffee_form, coffee_grade=None, batch_ref=None) -> float:
+	"""Lock the center and return the net balance of its (coffee_form[, coffee_grade]) buckets.
+
+	Used by OUT postings: a second posting against the same center waits on
+	``lock_centers`` until this transaction commits, then reads the balance
+	it left behind. The read is a locking read, so it sees the latest committed
+	rows rather than the transaction's REPEATABLE READ snapshot. Its gap locks
+	stay in this center's part of the (center, coffee_form, coffee_grade)
+	index: every center's anchor bucket sorts first in its part, so other
+	centers never insert into those gaps.
+	"""
+	lock_centers([center])
+	clauses = ["center=%s", "coffee_form=%s"]
+	params = [center, coffee_form]
+	if coffee_grade is not None:
+		clauses.append("coffee_grade=%s")
+		params.append(coffee_grade)
+	rows = frappe.db.sql(
+		f"""
+		SELECT batch_ref, qty_kg
+		FROM `tab{BALANCE}`
+		WHERE {" AND ".join(clauses)}
+		FOR UPDATE
+		""",
+		params,
+	)
+	return sum(flt(qty) for row_batch, qty in rows if batch_ref is None or row_batch == batch_ref)
+
+
+def stock_position(centers) -> dict[str, dict]:
+	"""``{center: {coffee_form: {coffee_grade: {status: qty_kg}}}}`` for ``centers``.
+
+	Cached centers come straight from Redis; the rest are read together with a
+	single grouped query over the balance table. Ungraded stock is under "".
+	"""
+	cache = frappe.cache()
+	positions: dict[str, dict] = {}
+	missing: dict[str, str] = {}
+	for center in centers:
+		cached = cache.hget(_POSITION_CACHE, center)
+		if cached is None:
+			missing[center.casefold()] = center
+		else:
+			positions[center] = cached
+
+	if missing:
+		fresh: dict[str, dict] = {center: {} for center in missing.values()}
+		rows = frappe.db.sql(
+			f"""
+			SELECT center, coffee_form, coffee_grade, status, SUM(qty_kg)
+			FROM `tab{BALANCE}`
+			WHERE center IN %s
+			GROUP BY center, coffee_form, coffee_grade, status
+			""",
+			(tuple(missing.values()),),
+		)
+		for center, coffee_form, coffee_grade, status, qty in rows:
+			if abs(flt(qty)) <= _TOLERANCE:
+				continue
+			matrix = fresh[missing[center.casefold()]]
+			grades = matrix.setdefault(coffee_form or "", {})
+			grades.setdefault(coffee_grade or "", {})[status or ""] = flt(qty, 3)
+		for center, matrix in fresh.items():
+			cache.hset(_POSITION_CACHE, center, matrix)
+		positions.update(fresh)
+	return positions
+
+
+def invalidate_positions(centers) -> None:
+	"""Drop cached positions now and again once the posting transaction ends.
+
+	The second pass covers a reader that cached the pre-commit state in
+	between, and a rollback of deltas that were already visible to this
+	transaction.
+	"""
+	centers = [center for center in centers if center]
+	if not centers:
+		return
+
+	def drop():
+		for center in centers:
+			frappe.cache().hdel(_POSITION_CACHE, center)
+
+	drop()
+	frappe.db.after_commit.add(drop)
+	frappe.db.after_rollback.add(drop)
+
+
+def _ledger_buckets() -> dict[tuple[str, ...], float]:
+	rows = frappe.db.sql(
+		f"""
+		SELECT
+			IFNULL(center, ''), IFNULL(coffee_form, ''), IFNULL(coffee_grade, ''),
+			IFNULL(batch_ref, ''), IFNULL(status, ''),
+			SUM(CASE WHEN entry_type='IN' THEN qty_kg ELSE -qty_kg END)
+		FROM `tab{CSL}`
+		WHERE is_cancelled=0
+		GROUP BY 1, 2, 3, 4, 5
+		"""
+	)
+	return {tuple(row[:5]): flt(row[5]) for row in rows}
+
+
+def _table_buckets() -> dict[tuple[str, ...], float]:
+	rows = frappe.db.sql(
+		f"""
+		SELECT
+			IFNULL(center, ''), IFNULL(coffee_form, ''), IFNULL(coffee_grade, ''),
+			IFNULL(batch_ref, ''), IFNULL(status, ''), qty_kg
+		FROM `tab{BALANCE}`
+		"""
+	)
+	return {tuple(row[:5]): flt(row[5]) for row in rows}
+
+
+def reconcile(repair: bool = False) -> dict:
+	"""Compare the balance table with a full ledger scan.
+
+	Returns ``{"buckets": n, "mismatches": [...], "repaired": bool}``; each
+	mismatch carries the bucket key, the ledger total and the table value.
+	With ``repair`` the table is rebuilt from the ledger in the same call.
+	"""
+	ledger = _ledger_buckets()
+	table = _table_buckets()
+
+	mismatches = []
+	for key in sorted(set(ledger) | set(table)):
+		expected = ledger.get(key, 0.0)
+		actual = table.get(key, 0.0)
+		if abs(expected - actual) > _TOLERANCE:
+			mismatches.append(
+				{
+					**dict(zip(BUCKET_FIELDS, key, strict=True)),
+					"ledger_qty": expected,
+					"balance_qty": actual,
+				}
+			)
+
+	if repair and mismatches:
+		rebuild(ledger)
+
+	return {"buckets": len(ledger), "mismatches": mismatches, "repaired": bool(repair and mismatches)}
+
+
+def rebuild(ledger: dict[tuple[str, ...], float] | None = None) -> int:
+	"""Replace the balance table with totals recomputed from the ledger."""
+	ledger = _ledger_buckets() if ledger is None else ledger
+	frappe.db.sql(f"DELETE FROM `tab{BALANCE}`")
+	apply_deltas(ledger)
+	frappe.cache().delete_value(_POSITION_CACHE)
+	return len(ledger)
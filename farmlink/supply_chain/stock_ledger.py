@@ -1,49 +1,103 @@
 # stock_ledger.py
+import functools
+
 import frappe
 from frappe.utils import flt
 
-from farmlink.utils.csl import record_transfer, reverse_entries
+from farmlink.supply_chain import lineage, processing_yield
+from farmlink.utils.csl import post_entries, reverse_entries
 
+# Each *_on_save builds the complete set of CSL entries its document should
+# have right now and hands it to post_entries, which diffs it against the
+# live rows in one pass. An empty set cancels everything the doc posted.
+# Handlers return post_entries' result so stock_repost can report the diff.
+#
+# Handlers also declare (via @depends_on) the fields and child-table columns
+# their entries are computed from. On an update where none of them differ from
+# doc.get_doc_before_save() — a comment, driver or plate number edit — the
+# posting is skipped entirely. New docs and docs without a before-save
+# snapshot (e.g. loaded with frappe.get_doc and passed in directly) always post.
+# After posting, the document's processing yield fact is refreshed and a lot
+# lineage rebuild is queued for after the commit (_AFTER_POSTING); both are
+# dropped again on trash.
 
-def _cancel_missing_entries(ref_dt, ref_dn, entry_type, keep_refs):
-    """Cancel CSL rows for a doc/entry_type whose entry_ref is not in keep_refs."""
-    existing = frappe.get_all(
-        "Coffee Stock Ledger",
-        filters={
-            "reference_doctype": ref_dt,
-            "reference_name": ref_dn,
-            "entry_type": entry_type,
-            "is_cancelled": 0,
-        },
-        fields=["name", "entry_ref"],
-    )
-    keep_refs = set(keep_refs)
-    to_cancel = [row.name for row in existing if row.entry_ref not in keep_refs]
-    for name in to_cancel:
-        frappe.db.set_value("Coffee Stock Ledger", name, "is_cancelled", 1)
 
+_AFTER_POSTING = (lineage.refresh, processing_yield.refresh)
+_ON_TRASH = (lineage.clear, processing_yield.clear)
 
+
+def _reverse_all(doc):
+    reverse_entries(doc.doctype, doc.name)
+    for clear in _ON_TRASH:
+        clear(doc)
+
+
+def _same(a, b):
+    if isinstance(a, (int, float)) or isinstance(b, (int, float)):
+        return abs(flt(a) - flt(b)) < 1e-9
+    return (a or "") == (b or "")
+
+
+def ledger_inputs_changed(doc, fields, child_fields=None) -> bool:
+    before = doc.get_doc_before_save()
+    if before is None:
+        return True
+    for field in fields:
+        if not _same(doc.get(field), before.get(field)):
+            return True
+    for table, columns in (child_fields or {}).items():
+        rows, old_rows = doc.get(table) or [], before.get(table) or []
+        if len(rows) != len(old_rows):
+            return True
+        # entry_refs are positional, so rows are compared in order.
+        for row, old in zip(rows, old_rows, strict=True):
+            if any(not _same(row.get(col), old.get(col)) for col in columns):
+                return True
+    return False
+
+
+def depends_on(*fields, **child_fields):
+    """Run the decorated *_on_save only when one of ``fields`` or the given
+    child-table columns (``table=("col", ...)``) changed in this save."""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(doc, method=None):
+            if not ledger_inputs_changed(doc, fields, child_fields):
+                return
+            result = handler(doc, method)
+            for refresh in _AFTER_POSTING:
+                refresh(doc)
+            return result
+
+        wrapper.depends_on = (fields, child_fields)
+        return wrapper
+
+    return decorator
+
+
+@depends_on("center", "collected_weight")
 def primary_arrival_on_save(doc, method=None):
     qty = flt(doc.collected_weight)
-    if not doc.center or qty <= 0:
-        reverse_entries(doc.doctype, doc.name)
-        return
+    entries = []
+    if doc.center and qty > 0:
+        entries.append(
+            dict(
+                center=doc.center,
+                status="Primary Arrival",
+                form="Cherry",
+                qty=qty,
+                entry_type="IN",
+                entry_ref="primary_arrival_in",
+                remarks="Primary arrival of cherry",
+            )
+        )
 
-    record_transfer(
-        center=doc.center,
-        status="Primary Arrival",
-        form="Cherry",
-        qty=qty,
-        ref_dt=doc.doctype,
-        ref_dn=doc.name,
-        entry_type="IN",
-        entry_ref="primary_arrival_in",
-        remarks="Primary arrival of cherry",
-    )
+    return post_entries(doc.doctype, doc.name, entries)
 
 
 def primary_arrival_on_trash(doc, method=None):
-    reverse_entries(doc.doctype, doc.name)
+    _reverse_all(doc)
 
 
 def _primary_output_form(processing_type):
@@ -55,93 +109,102 @@ def _primary_output_form(processing_type):
     return mapping.get(processing_type, "Parchment")
 
 
+@depends_on(
+    "processing_center",
+    "status",
+    "weight_in_kg",
+    "processing_type",
+    "logged_time",
+    processing_output=("weightkg", "grade"),
+)
 def primary_processing_on_save(doc, method=None):
     center = doc.processing_center
     status = (doc.status or "").strip()
     qty_in = flt(doc.weight_in_kg)
 
     if not center or status not in ("Processing", "Completed") or qty_in <= 0:
-        reverse_entries(doc.doctype, doc.name)
-        return
+        return post_entries(doc.doctype, doc.name, [])
 
     # Consume cherry into processing
-    record_transfer(
-        center=center,
-        status="In Processing",
-        form="Cherry",
-        qty=qty_in,
-        ref_dt=doc.doctype,
-        ref_dn=doc.name,
-        entry_type="OUT",
-        entry_ref="primary_proc_input",
-        remarks="Primary processing input",
-    )
+    entries = [
+        dict(
+            center=center,
+            status="In Processing",
+            form="Cherry",
+            qty=qty_in,
+            entry_type="OUT",
+            entry_ref="primary_proc_input",
+            remarks="Primary processing input",
+        )
+    ]
 
-    output_refs = []
     if status == "Completed":
         output_form = _primary_output_form(doc.processing_type)
         for idx, row in enumerate(doc.get("processing_output") or [], start=1):
-            out_qty = flt(row.weightkg)
-            entry_ref = f"primary_proc_output_{idx}"
-            if out_qty <= 0:
-                reverse_entries(doc.doctype, doc.name, entry_ref=entry_ref, entry_type="IN")
-                continue
-
-            record_transfer(
-                center=center,
-                status="In Processing",
-                form=output_form,
-                qty=out_qty,
-                ref_dt=doc.doctype,
-                ref_dn=doc.name,
-                entry_type="IN",
-                entry_ref=entry_ref,
-                batch_ref=doc.name,
-                coffee_grade=row.grade or None,
-                remarks="Primary processing output",
+            entries.append(
+                dict(
+                    center=center,
+                    status="In Processing",
+                    form=output_form,
+                    qty=flt(row.weightkg),
+                    entry_type="IN",
+                    entry_ref=f"primary_proc_output_{idx}",
+                    batch_ref=doc.name,
+                    coffee_grade=row.grade or None,
+                    remarks="Primary processing output",
+                )
             )
-            output_refs.append(entry_ref)
 
-    # Cancel any stale output entries if not in current output set
-    _cancel_missing_entries(doc.doctype, doc.name, "IN", output_refs)
+    return post_entries(doc.doctype, doc.name, entries)
 
 
 def primary_processing_on_trash(doc, method=None):
-    reverse_entries(doc.doctype, doc.name)
+    _reverse_all(doc)
 
 
+@depends_on(
+    "status", "weight_in_kg", "coffee_type", "dispatched_from", "destination", "coffee_grade"
+)
 def primary_dispatch_on_save(doc, method=None):
     status = (doc.status or "").strip()
     qty = flt(doc.weight_in_kg)
     coffee_form = (doc.coffee_type or "").strip()
 
-    if status != "Dispatched" or qty <= 0 or not doc.dispatched_from:
-        reverse_entries(doc.doctype, doc.name)
-        return
+    entries = []
+    if status == "Dispatched" and qty > 0 and doc.dispatched_from:
+        entries.append(
+            dict(
+                center=doc.dispatched_from,
+                status="Dispatched",
+                form=coffee_form,
+                qty=qty,
+                entry_type="OUT",
+                entry_ref="primary_dispatch_out",
+                to_center=doc.destination,
+                coffee_grade=getattr(doc, "coffee_grade", None),
+                remarks=f"Dispatched to {doc.destination or ''}",
+            )
+        )
 
-    record_transfer(
-        center=doc.dispatched_from,
-        status="Dispatched",
-        form=coffee_form,
-        qty=qty,
-        ref_dt=doc.doctype,
-        ref_dn=doc.name,
-        entry_type="OUT",
-        entry_ref="primary_dispatch_out",
-        to_center=doc.destination,
-        coffee_grade=getattr(doc, "coffee_grade", None),
-        remarks=f"Dispatched to {doc.destination or ''}",
-    )
+    return post_entries(doc.doctype, doc.name, entries)
 
 
 def primary_dispatch_on_trash(doc, method=None):
-    reverse_entries(doc.doctype, doc.name)
-
-
+    _reverse_all(doc)
+
+
+@depends_on(
+    "arrival_center",
+    "delivery_status",
+    "dispatched_weight_in_kg",
+    "quantity_missing_in_weightkg",
+    "coffee_type",
+    "source_center",
+    "dispatch_log",
+)
 def secondary_arrival_on_save(doc, method=None):
     if not doc.arrival_center:
-        reverse_entries(doc.doctype, doc.name)
-        return
+        return post_entries(doc.doctype, doc.name, [])
 
     delivery_status = (doc.delivery_status or "").strip()
     dispatched_qty = flt(doc.dispatched_weight_in_kg)
@@ -151,8 +214,7 @@ def secondary_arrival_on_save(doc, method=None):
     qty_in = max(dispatched_qty - missing, 0)
 
     if qty_in <= 0:
-        reverse_entries(doc.doctype, doc.name)
-        return
+        return post_entries(doc.doctype, doc.name, [])
 
     coffee_form = (doc.coffee_type or "").strip()
     from_center = getattr(doc, "source_center", None)
@@ -162,25 +224,38 @@ def secondary_arrival_on_save(doc, method=None):
     if getattr(doc, "dispatch_log", None):
         coffee_grade = frappe.db.get_value("Primary Dispatch", doc.dispatch_log, "coffee_grade")
 
-    record_transfer(
-        center=doc.arrival_center,
-        status="Secondary Arrival",
-        form=coffee_form,
-        qty=qty_in,
-        ref_dt=doc.doctype,
-        ref_dn=doc.name,
-        entry_type="IN",
-        entry_ref="secondary_arrival_in",
-        from_center=from_center,
-        coffee_grade=coffee_grade,
-        remarks="Arrived from dispatch",
+    return post_entries(
+        doc.doctype,
+        doc.name,
+        [
+            dict(
+                center=doc.arrival_center,
+                status="Secondary Arrival",
+                form=coffee_form,
+                qty=qty_in,
+                entry_type="IN",
+                entry_ref="secondary_arrival_in",
+                from_center=from_center,
+                coffee_grade=coffee_grade,
+                remarks="Arrived from dispatch",
+            )
+        ],
     )
 
 
 def secondary_arrival_on_trash(doc, method=None):
-    reverse_entries(doc.doctype, doc.name)
-
-
+    _reverse_all(doc)
+
+
+@depends_on(
+    "processing_center",
+    "status",
+    "coffee_type",
+    "weight_in_kg",
+    "processed_center",
+    "log_time",
+    processed_output=("weightkg", "grade"),
+)
 def secondary_processing_on_save(doc, method=None):
     center = doc.processing_center
     status = (doc.status or "").strip()
@@ -188,61 +263,59 @@ def secondary_processing_on_save(doc, method=None):
     qty_in = flt(doc.weight_in_kg)
 
     if not center or status not in ("Processing", "Completed") or qty_in <= 0:
-        reverse_entries(doc.doctype, doc.name)
-        return
+        return post_entries(doc.doctype, doc.name, [])
 
     # Consume input form
-    record_transfer(
-        center=center,
-        status="In Processing",
-        form=input_form,
-        qty=qty_in,
-        ref_dt=doc.doctype,
-        ref_dn=doc.name,
-        entry_type="OUT",
-        entry_ref="secondary_proc_input",
-        remarks="Secondary processing input",
-    )
+    entries = [
+        dict(
+            center=center,
+            status="In Processing",
+            form=input_form,
+            qty=qty_in,
+            entry_type="OUT",
+            entry_ref="secondary_proc_input",
+            remarks="Secondary processing input",
+        )
+    ]
 
-    output_refs = []
     if status == "Completed":
         out_center = getattr(doc, "processed_center", None) or center
         for idx, row in enumerate(doc.get("processed_output") or [], start=1):
-            out_qty = flt(row.weightkg)
-            entry_ref = f"secondary_proc_output_{idx}"
-            if out_qty <= 0:
-                reverse_entries(doc.doctype, doc.name, entry_ref=entry_ref, entry_type="IN")
-                continue
-
-            record_transfer(
-                center=out_center,
-                status="In Processing",
-                form="Green Bean",
-                qty=out_qty,
-                ref_dt=doc.doctype,
-                ref_dn=doc.name,
-                entry_type="IN",
-                entry_ref=entry_ref,
-                coffee_grade=row.grade or None,
-                remarks="Secondary processing output",
+            entries.append(
+                dict(
+                    center=out_center,
+                    status="In Processing",
+                    form="Green Bean",
+                    qty=flt(row.weightkg),
+                    entry_type="IN",
+                    entry_ref=f"secondary_proc_output_{idx}",
+                    coffee_grade=row.grade or None,
+                    remarks="Secondary processing output",
+                )
             )
-            output_refs.append(entry_ref)
 
-    # Drop stale output rows if any
-    _cancel_missing_entries(doc.doctype, doc.name, "IN", output_refs)
+    return post_entries(doc.doctype, doc.name, entries)
 
 
 def secondary_processing_on_trash(doc, method=None):
-    reverse_entries(doc.doctype, doc.name)
+    _reverse_all(doc)
 
 
 # ── Export Arrival Log ──────────────────────────────────────────
 
+@depends_on(
+    "arrival_center",
+    "delivery_status",
+    "weight_in_kg",
+    "quantity_missing_kg",
+    "source_center",
+    "coffee_grade",
+    "secondary_processing_ref",
+)
 def export_arrival_on_save(doc, method=None):
     """Green bean arrives at export warehouse. CSL IN with status 'Main Arrival'."""
     if not doc.arrival_center:
-        reverse_entries(doc.doctype, doc.name)
-        return
+        return post_entries(doc.doctype, doc.name, [])
 
     delivery_status = (doc.delivery_status or "").strip()
     weight = flt(doc.weight_in_kg)
@@ -251,94 +324,94 @@ def export_arrival_on_save(doc, method=None):
         weight = 0
     qty_in = max(weight - missing, 0)
 
-    if qty_in <= 0:
-        reverse_entries(doc.doctype, doc.name)
-        return
-
-    record_transfer(
-        center=doc.arrival_center,
-        status="Main Arrival",
-        form="Green Bean",
-        qty=qty_in,
-        ref_dt=doc.doctype,
-        ref_dn=doc.name,
-        entry_type="IN",
-        entry_ref="export_arrival_in",
-        from_center=getattr(doc, "source_center", None),
-        coffee_grade=doc.coffee_grade or None,
-        remarks="Green bean arrived at export warehouse",
+    return post_entries(
+        doc.doctype,
+        doc.name,
+        [
+            dict(
+                center=doc.arrival_center,
+                status="Main Arrival",
+                form="Green Bean",
+                qty=qty_in,
+                entry_type="IN",
+                entry_ref="export_arrival_in",
+                from_center=getattr(doc, "source_center", None),
+                coffee_grade=doc.coffee_grade or None,
+                remarks="Green bean arrived at export warehouse",
+            )
+        ],
     )
 
 
 def export_arrival_on_trash(doc, method=None):
-    reverse_entries(doc.doctype, doc.name)
+    _reverse_all(doc)
 
 
 # ── Trades (allocation) ────────────────────────────────────────
 
+@depends_on(
+    "status",
+    "export_warehouse",
+    "contract_number",
+    table_ovaz=("quantity", "bag_size", "coffee_grade", "weight_kg", "secondary_processing_ref"),
+)
 def trades_on_save(doc, method=None):
     """When trade is Allocated+, create CSL OUT entries to reserve green bean."""
     status = (doc.status or "").strip()
 
     if status not in ("Allocated", "Ready to Ship", "Shipped", "Delivered"):
-        reverse_entries(doc.doctype, doc.name)
-        return
+        return post_entries(doc.doctype, doc.name, [])
 
     if not doc.export_warehouse:
         return
 
-    output_refs = []
+    entries = []
     for idx, row in enumerate(doc.get("table_ovaz") or [], start=1):
-        qty = flt(row.quantity) * flt(row.bag_size)
-        entry_ref = f"trade_alloc_{idx}"
-        if qty <= 0:
-            continue
-
-        record_transfer(
-            center=doc.export_warehouse,
-            status="Allocated to Trade",
-            form="Green Bean",
-            qty=qty,
-            ref_dt=doc.doctype,
-            ref_dn=doc.name,
-            entry_type="OUT",
-            entry_ref=entry_ref,
-            coffee_grade=row.coffee_grade or None,
-            remarks=f"Allocated to trade {doc.contract_number}",
+        entries.append(
+            dict(
+                center=doc.export_warehouse,
+                status="Allocated to Trade",
+                form="Green Bean",
+                qty=flt(row.quantity) * flt(row.bag_size),
+                entry_type="OUT",
+                entry_ref=f"trade_alloc_{idx}",
+                coffee_grade=row.coffee_grade or None,
+                remarks=f"Allocated to trade {doc.contract_number}",
+            )
         )
-        output_refs.append(entry_ref)
 
-    _cancel_missing_entries(doc.doctype, doc.name, "OUT", output_refs)
+    return post_entries(doc.doctype, doc.name, entries)
 
 
 def trades_on_trash(doc, method=None):
-    reverse_entries(doc.doctype, doc.name)
+    _reverse_all(doc)
 
 
 # ── Export Dispatch ─────────────────────────────────────────────
 
+@depends_on("status", "weight_in_kg", "export_warehouse", "coffee_grade", "trade")
 def export_dispatch_on_save(doc, method=None):
     """Green bean dispatched from export warehouse. CSL OUT with 'Export Dispatched'."""
     status = (doc.status or "").strip()
     qty = flt(doc.weight_in_kg)
 
-    if status != "Dispatched" or qty <= 0 or not doc.export_warehouse:
-        reverse_entries(doc.doctype, doc.name)
-        return
+    entries = []
+    if status == "Dispatched" and qty > 0 and doc.export_warehouse:
+        entries.append(
+            dict(
+                center=doc.export_warehouse,
+                status="Export Dispatched",
+                form="Green Bean",
+                qty=qty,
+                entry_type="OUT",
+                entry_ref="export_dispatch_out",
+                coffee_grade=doc.coffee_grade or None,
+                remarks=f"Export dispatched for trade {doc.trade or ''}",
+            )
+        )
 
-    record_transfer(
-        center=doc.export_warehouse,
-        status="Export Dispatched",
-        form="Green Bean",
-        qty=qty,
-        ref_dt=doc.doctype,
-        ref_dn=doc.name,
-        entry_type="OUT",
-        entry_ref="export_dispatch_out",
-        coffee_grade=doc.coffee_grade or None,
-        remarks=f"Export dispatched for trade {doc.trade or ''}",
-    )
+    return post_entries(doc.doctype, doc.name, entries)
 
 
 def export_dispatch_on_trash(doc, method=None):
-    reverse_entries(doc.doctype, doc.name)
+    _reverse_all(doc)
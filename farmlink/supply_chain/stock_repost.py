@@ -0,0 +1,332 @@
+"""
+Bulk repost of the Coffee Stock Ledger from its source documents.
+
+When the posting rules in ``stock_ledger.py`` change (a new output-form
+mapping in ``_primary_output_form``, a new status in ``trades_on_save``, ...)
+nothing re-derives the rows already posted. ``repost`` replays every source
+document through its ``*_on_save`` handler, bypassing the ``@depends_on``
+change check, so ``post_entries`` diffs the recomputed entries against the
+live rows and only writes what differs.
+
+	bench --site <site> farmlink-repost-stock-ledger \\
+		[--doctype "Primary Processing" ...] [--from-date 2025-10-01] [--to-date ...] \\
+		[--workers 4] [--chunk-size 200] [--dry-run] [--run-id <id>]
+
+- Documents are streamed per doctype in ``name`` order, ``chunk_size`` at a
+  time, and filtered on their event date (``REPOST_SOURCES``).
+- Work is split by center: centers are bin-packed into ``workers`` partitions
+  by document count and each partition runs in its own process with its own
+  database connection, so workers touch different balance buckets.
+- Each chunk is one transaction. The partition checkpoint (doctype + last
+  name) is written in the same transaction, so a crashed or interrupted run
+  resumes exactly where it stopped when started again with its ``--run-id``.
+- OUT stock validation is skipped (``frappe.flags.in_stock_repost``): history
+  is re-derived, not re-lived in its original order.
+- Every changed entry lands in ``diff.csv`` under
+  ``<site>/private/files/stock_repost/<run_id>/``; with ``--dry-run`` each chunk
+  is rolled back, so the report shows what a real run would change.
+"""
+
+from __future__ import annotations
+
+import csv
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import frappe
+from frappe import _
+from frappe.utils import cint, getdate
+
+from farmlink.supply_chain import stock_ledger
+
+# doctype -> (save handler, partition center field, event date field), in posting order.
+REPOST_SOURCES = {
+	"Primary Arrival Log": (stock_ledger.primary_arrival_on_save, "center", "log_time"),
+	"Primary Processing": (stock_ledger.primary_processing_on_save, "processing_center", "logged_time"),
+	"Primary Dispatch": (stock_ledger.primary_dispatch_on_save, "dispatched_from", "dispatched_on"),
+	"Secondary Arrival Log": (stock_ledger.secondary_arrival_on_save, "arrival_center", "arrival_time"),
+	"Secondary Processing": (stock_ledger.secondary_processing_on_save, "processing_center", "log_time"),
+	"Export Arrival Log": (stock_ledger.export_arrival_on_save, "arrival_center", "arrival_time"),
+	"Trades": (stock_ledger.trades_on_save, "export_warehouse", "trade_date"),
+	"Export Dispatch": (stock_ledger.export_dispatch_on_save, "export_warehouse", "dispatched_on"),
+}
+
+REPORT_FIELDS = (
+	"doctype",
+	"document",
+	"action",
+	"entry_type",
+	"entry_ref",
+	"center",
+	"coffee_form",
+	"coffee_grade",
+	"status",
+	"old_qty",
+	"new_qty",
+	"error",
+)
+
+_PLAN_KEY = "farmlink_stock_repost:{run_id}"
+_CHECKPOINT_KEY = "farmlink_stock_repost:{run_id}:{partition}"
+_DEADLOCK_RETRIES = 3
+
+
+# ---------- planning ----------
+
+
+def _source_filters(doctype: str, from_date=None, to_date=None) -> tuple[list[str], list]:
+	_handler, _center_field, date_field = REPOST_SOURCES[doctype]
+	clauses, params = [], []
+	event_date = f"DATE(COALESCE(`{date_field}`, creation))"
+	if from_date:
+		clauses.append(f"{event_date} >= %s")
+		params.append(getdate(from_date))
+	if to_date:
+		clauses.append(f"{event_date} <= %s")
+		params.append(getdate(to_date))
+	return clauses, params
+
+
+def _center_counts(doctypes, from_date=None, to_date=None) -> dict[str, int]:
+	counts: dict[str, int] = {}
+	for doctype in doctypes:
+		_handler, center_field, _date_field = REPOST_SOURCES[doctype]
+		clauses, params = _source_filters(doctype, from_date, to_date)
+		rows = frappe.db.sql(
+			f"""
+			SELECT IFNULL(`{center_field}`, ''), COUNT(*)
+			FROM `tab{doctype}`
+			WHERE {" AND ".join(clauses) or "1=1"}
+			GROUP BY 1
+			""",
+			params,
+		)
+		for center, count in rows:
+			counts[center] = counts.get(center, 0) + cint(count)
+	return counts
+
+
+def plan_partitions(counts: dict[str, int], workers: int) -> list[list[str]]:
+	"""Bin-pack centers into at most ``workers`` partitions of similar document counts."""
+	partitions: list[list[str]] = [[] for _ in range(max(1, min(workers, len(counts))))]
+	loads = [0] * len(partitions)
+	for center, count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+		target = loads.index(min(loads))
+		partitions[target].append(center)
+		loads[target] += count
+	return [sorted(partition) for partition in partitions if partition]
+
+
+def _run_dir(run_id: str) -> str:
+	path = frappe.get_site_path("private", "files", "stock_repost", run_id)
+	os.makedirs(path, exist_ok=True)
+	return path
+
+
+# ---------- one partition ----------
+
+
+def _load_checkpoint(run_id: str, partition: int) -> dict:
+	value = frappe.db.get_global(_CHECKPOINT_KEY.format(run_id=run_id, partition=partition))
+	return json.loads(value) if value else {}
+
+
+def _save_checkpoint(run_id: str, partition: int, checkpoint: dict) -> None:
+	frappe.db.set_global(_CHECKPOINT_KEY.format(run_id=run_id, partition=partition), json.dumps(checkpoint))
+
+
+def _next_chunk(doctype, centers, after, plan) -> list[str]:
+	_handler, center_field, _date_field = REPOST_SOURCES[doctype]
+	clauses, params = _source_filters(doctype, plan.get("from_date"), plan.get("to_date"))
+	clauses.append(f"IFNULL(`{center_field}`, '') IN %s")
+	params.append(tuple(centers))
+	if after:
+		clauses.append("name > %s")
+		params.append(after)
+	rows = frappe.db.sql(
+		f"""
+		SELECT name FROM `tab{doctype}`
+		WHERE {" AND ".join(clauses)}
+		ORDER BY name
+		LIMIT %s
+		""",
+		[*params, cint(plan["chunk_size"])],
+	)
+	return [row[0] for row in rows]
+
+
+def _repost_document(doctype: str, name: str) -> list[dict]:
+	handler = REPOST_SOURCES[doctype][0]
+	doc = frappe.get_doc(doctype, name)
+	# __wrapped__ is the handler without its @depends_on change check.
+	result = handler.__wrapped__(doc)
+	for refresh in stock_ledger._AFTER_POSTING:
+		refresh(doc)
+	return [
+		{"doctype": doctype, "document": name, **change, "error": ""}
+		for change in (result or {}).get("changes", [])
+	]
+
+
+def _repost_chunk(doctype: str, names: list[str]) -> list[dict]:
+	report = []
+	for name in names:
+		frappe.db.savepoint("stock_repost_doc")
+		try:
+			report.extend(_repost_document(doctype, name))
+		except frappe.QueryDeadlockError:
+			raise
+		except Exception as exc:
+			frappe.db.rollback(save_point="stock_repost_doc")
+			report.append({"doctype": doctype, "document": name, "action": "error", "error": str(exc)})
+		frappe.clear_messages()
+	return report
+
+
+def repost_partition(run_id: str, partition: int) -> dict:
+	"""Repost every source document of one center partition, resuming from its checkpoint."""
+	plan = json.loads(frappe.db.get_global(_PLAN_KEY.format(run_id=run_id)))
+	centers = plan["partitions"][partition]
+	checkpoint = _load_checkpoint(run_id, partition)
+	summary = {"partition": partition, "documents": 0, "changes": 0, "errors": 0}
+	if checkpoint.get("done"):
+		return summary
+
+	report_path = os.path.join(_run_dir(run_id), f"partition-{partition}.csv")
+	frappe.flags.in_stock_repost = True
+	try:
+		doctypes = plan["doctypes"]
+		start = doctypes.index(checkpoint["doctype"]) if checkpoint.get("doctype") else 0
+		for doctype in doctypes[start:]:
+			after = checkpoint.get("after") if checkpoint.get("doctype") == doctype else None
+			while True:
+				names = _next_chunk(doctype, centers, after, plan)
+				if not names:
+					break
+				for attempt in range(_DEADLOCK_RETRIES):
+					try:
+						report = _repost_chunk(doctype, names)
+						break
+					except frappe.QueryDeadlockError:
+						frappe.db.rollback()
+						if attempt == _DEADLOCK_RETRIES - 1:
+							raise
+				after = names[-1]
+				checkpoint = {"doctype": doctype, "after": after}
+				if plan["dry_run"]:
+					# Nothing is kept, so there is no checkpoint to resume from either.
+					frappe.db.rollback()
+				else:
+					_save_checkpoint(run_id, partition, checkpoint)
+					frappe.db.commit()
+				_append_report(report_path, report)
+				summary["documents"] += len(names)
+				summary["changes"] += sum(1 for row in report if row["action"] != "error")
+				summary["errors"] += sum(1 for row in report if row["action"] == "error")
+
+		if not plan["dry_run"]:
+			_save_checkpoint(run_id, partition, {"done": True})
+			frappe.db.commit()
+	finally:
+		frappe.flags.in_stock_repost = False
+	return summary
+
+
+def _append_report(path: str, rows: list[dict]) -> None:
+	if not rows:
+		return
+	new_file = not os.path.exists(path)
+	with open(path, "a", newline="") as handle:
+		writer = csv.DictWriter(handle, fieldnames=REPORT_FIELDS, extrasaction="ignore")
+		if new_file:
+			writer.writeheader()
+		writer.writerows(rows)
+
+
+def _partition_worker(site: str, sites_path: str, run_id: str, partition: int) -> dict:
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+	try:
+		frappe.set_user("Administrator")
+		return repost_partition(run_id, partition)
+	finally:
+		frappe.destroy()
+
+
+# ---------- driver ----------
+
+
+def repost(
+	doctypes=None,
+	from_date=None,
+	to_date=None,
+	workers: int = 1,
+	chunk_size: int = 200,
+	dry_run: bool = False,
+	run_id: str | None = None,
+) -> dict:
+	"""Plan (or resume) a repost run and execute its partitions.
+
+	Must be called with a connected site. Returns the run summary, including
+	the path of the merged ``diff.csv``.
+	"""
+	if run_id and frappe.db.get_global(_PLAN_KEY.format(run_id=run_id)):
+		plan = json.loads(frappe.db.get_global(_PLAN_KEY.format(run_id=run_id)))
+	else:
+		unknown = set(doctypes or []) - set(REPOST_SOURCES)
+		if unknown:
+			frappe.throw(_("Cannot repost {0}").format(", ".join(sorted(unknown))))
+		doctypes = [dt for dt in REPOST_SOURCES if not doctypes or dt in doctypes]
+		run_id = run_id or frappe.generate_hash(length=10)
+		plan = {
+			"doctypes": doctypes,
+			"from_date": str(getdate(from_date)) if from_date else None,
+			"to_date": str(getdate(to_date)) if to_date else None,
+			"chunk_size": max(1, cint(chunk_size)),
+			"dry_run": bool(dry_run),
+			"partitions": plan_partitions(_center_counts(doctypes, from_date, to_date), cint(workers)),
+		}
+		frappe.db.set_global(_PLAN_KEY.format(run_id=run_id), json.dumps(plan))
+		frappe.db.commit()
+
+	partitions = range(len(plan["partitions"]))
+	if len(plan["partitions"]) <= 1:
+		summaries = [repost_partition(run_id, partition) for partition in partitions]
+	else:
+		site, sites_path = frappe.local.site, frappe.local.sites_path
+		# spawn, not fork: each worker opens its own connection from scratch.
+		context = multiprocessing.get_context("spawn")
+		with ProcessPoolExecutor(max_workers=len(plan["partitions"]), mp_context=context) as pool:
+			futures = [
+				pool.submit(_partition_worker, site, sites_path, run_id, partition)
+				for partition in partitions
+			]
+			summaries = [future.result() for future in futures]
+
+	report = _merge_reports(run_id, len(plan["partitions"]))
+	return {
+		"run_id": run_id,
+		"dry_run": plan["dry_run"],
+		"partitions": summaries,
+		"documents": sum(s["documents"] for s in summaries),
+		"changes": sum(s["changes"] for s in summaries),
+		"errors": sum(s["errors"] for s in summaries),
+		"report": report,
+	}
+
+
+def _merge_reports(run_id: str, partitions: int) -> str:
+	run_dir = _run_dir(run_id)
+	merged = os.path.join(run_dir, "diff.csv")
+	with open(merged, "w", newline="") as out:
+		writer = csv.DictWriter(out, fieldnames=REPORT_FIELDS)
+		writer.writeheader()
+		for partition in range(partitions):
+			path = os.path.join(run_dir, f"partition-{partition}.csv")
+			if not os.path.exists(path):
+				continue
+			with open(path, newline="") as handle:
+				writer.writerows(csv.DictReader(handle))
+	return merged
@@ -0,0 +1,320 @@
+"""
+Daily closing-balance snapshots of the Coffee Stock Ledger.
+
+Historical questions ("what was at this washing station at season close?")
+used to need a scan of every ledger row up to the date. ``take_daily_snapshots``
+runs from the daily scheduler and writes one Coffee Stock Snapshot row per
+(center, coffee_form, coffee_grade, status) and day, holding that day's IN and
+OUT totals and the closing balance. The closing balances are derived from the
+materialized Coffee Stock Balance minus the ledger tail posted after each day,
+so a run only reads the rows posted since the last snapshot.
+
+``stock_as_of`` starts from the nearest snapshot on or before the date and adds
+only the ledger rows posted after it; ``stock_statement`` answers opening / in /
+out / closing for a period from the same snapshots.
+
+Snapshots follow what the live ledger says about each day. Cancelling or
+re-posting a row posted on an earlier day changes that history, so the ledger
+write paths call ``mark_dirty`` with the affected posting dates; readers ignore
+snapshots from the earliest dirty date onwards and the next run rebuilds them.
+"""
+
+from __future__ import annotations
+
+import datetime
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, flt, getdate, now_datetime
+
+from farmlink.supply_chain.stock_balance import BALANCE, bucket_name
+
+CSL = "Coffee Stock Ledger"
+SNAPSHOT = "Coffee Stock Snapshot"
+
+SNAPSHOT_FIELDS = ("center", "coffee_form", "coffee_grade", "status")
+
+_DIRTY_KEY = "farmlink_stock_snapshot_dirty_from"
+_TOLERANCE = 1e-6
+
+
+def _day_start(day) -> datetime.datetime:
+	return datetime.datetime.combine(getdate(day), datetime.time.min)
+
+
+def _bucket_clauses(filters: dict | None, prefix: str = "") -> tuple[list[str], list]:
+	clauses, params = [], []
+	for field in SNAPSHOT_FIELDS:
+		value = (filters or {}).get(field)
+		if value:
+			clauses.append(f"{prefix}{field}=%s")
+			params.append(value)
+	return clauses, params
+
+
+# ---------- invalidation ----------
+
+
+def mark_dirty(posting_times) -> None:
+	"""Flag snapshots from the earliest of ``posting_times`` onwards as stale.
+
+	Called when ledger rows posted before today are cancelled or rewritten.
+	Stored with ``frappe.db.set_global`` so it commits or rolls back together
+	with the ledger change.
+	"""
+	today = getdate()
+	dates = [getdate(value) for value in posting_times if value]
+	dates = [day for day in dates if day < today]
+	if not dates:
+		return
+	earliest = min(dates)
+	current = frappe.db.get_global(_DIRTY_KEY)
+	if not current or getdate(current) > earliest:
+		frappe.db.set_global(_DIRTY_KEY, str(earliest))
+
+
+def _dirty_from() -> datetime.date | None:
+	value = frappe.db.get_global(_DIRTY_KEY)
+	return getdate(value) if value else None
+
+
+def _clean_snapshot_date(on_or_before) -> datetime.date | None:
+	"""Latest snapshot date <= ``on_or_before`` that no back-dated change invalidated."""
+	limit = getdate(on_or_before)
+	dirty = _dirty_from()
+	if dirty and dirty <= limit:
+		limit = add_days(dirty, -1)
+	value = frappe.db.sql(
+		f"SELECT MAX(snapshot_date) FROM `tab{SNAPSHOT}` WHERE snapshot_date <= %s", (limit,)
+	)[0][0]
+	return getdate(value) if value else None
+
+
+# ---------- ledger reads ----------
+
+
+def _ledger_movements(start=None, end=None, filters=None, by_day=True) -> dict:
+	"""IN/OUT totals of live ledger rows with ``start <= posting date <= end``.
+
+	Returns ``{day: {bucket: [in, out]}}`` (or ``{bucket: [in, out]}`` when
+	``by_day`` is False); either bound may be None for an open range.
+	"""
+	clauses, params = _bucket_clauses(filters)
+	clauses.insert(0, "is_cancelled=0")
+	if start is not None:
+		clauses.append("posting_time >= %s")
+		params.append(_day_start(start))
+	if end is not None:
+		clauses.append("posting_time < %s")
+		params.append(_day_start(add_days(end, 1)))
+
+	day_column = "DATE(posting_time)" if by_day else "NULL"
+	rows = frappe.db.sql(
+		f"""
+		SELECT
+			{day_column},
+			IFNULL(center, ''), IFNULL(coffee_form, ''), IFNULL(coffee_grade, ''), IFNULL(status, ''),
+			SUM(CASE WHEN entry_type='IN' THEN qty_kg ELSE 0 END),
+			SUM(CASE WHEN entry_type='OUT' THEN qty_kg ELSE 0 END)
+		FROM `tab{CSL}`
+		WHERE {" AND ".join(clauses)}
+		GROUP BY 1, 2, 3, 4, 5
+		""",
+		params,
+	)
+	movements: dict = {}
+	for row in rows:
+		target = movements.setdefault(getdate(row[0]), {}) if by_day else movements
+		target[tuple(row[1:5])] = [flt(row[5]), flt(row[6])]
+	return movements
+
+
+def _current_balances() -> dict[tuple[str, ...], float]:
+	rows = frappe.db.sql(
+		f"""
+		SELECT
+			IFNULL(center, ''), IFNULL(coffee_form, ''), IFNULL(coffee_grade, ''), IFNULL(status, ''),
+			SUM(qty_kg)
+		FROM `tab{BALANCE}`
+		GROUP BY 1, 2, 3, 4
+		"""
+	)
+	return {tuple(row[:4]): flt(row[4]) for row in rows}
+
+
+# ---------- snapshot job ----------
+
+
+def take_daily_snapshots(upto=None) -> int:
+	"""Write snapshots for every day after the last clean one, up to yesterday.
+
+	Catches up on missed days and rebuilds days invalidated by ``mark_dirty``.
+	Returns the number of snapshot rows written.
+	"""
+	upto = getdate(upto) if upto else add_days(getdate(), -1)
+	dirty = _dirty_from()
+	last = _clean_snapshot_date(upto)
+	if last:
+		start = add_days(last, 1)
+	else:
+		first = frappe.db.sql(f"SELECT MIN(posting_time) FROM `tab{CSL}` WHERE is_cancelled=0")[0][0]
+		start = getdate(first) if first else None
+
+	if start is None or start > upto:
+		if dirty:
+			frappe.db.set_global(_DIRTY_KEY, "")
+		return 0
+
+	# Walk the current balances back to the close of the day before ``start``...
+	movements = _ledger_movements(start=start)
+	closing = _current_balances()
+	for day_moves in movements.values():
+		for key, (qty_in, qty_out) in day_moves.items():
+			closing[key] = closing.get(key, 0.0) - qty_in + qty_out
+
+	# ...then forward one day at a time, emitting each day's closing rows.
+	now = now_datetime()
+	user = frappe.session.user
+	values = []
+	day = start
+	while day <= upto:
+		day_moves = movements.get(day, {})
+		for key, (qty_in, qty_out) in day_moves.items():
+			closing[key] = closing.get(key, 0.0) + qty_in - qty_out
+		for key in sorted(closing):
+			qty_in, qty_out = day_moves.get(key, (0.0, 0.0))
+			if abs(closing[key]) <= _TOLERANCE and not qty_in and not qty_out:
+				continue
+			values.append(
+				(
+					bucket_name((str(day), *key)),
+					now,
+					now,
+					user,
+					user,
+					day,
+					*key,
+					qty_in,
+					qty_out,
+					closing[key],
+				)
+			)
+		day = add_days(day, 1)
+
+	frappe.db.sql(f"DELETE FROM `tab{SNAPSHOT}` WHERE snapshot_date >= %s", (start,))
+	frappe.db.bulk_insert(
+		SNAPSHOT,
+		fields=[
+			"name",
+			"creation",
+			"modified",
+			"owner",
+			"modified_by",
+			"snapshot_date",
+			*SNAPSHOT_FIELDS,
+			"in_qty",
+			"out_qty",
+			"qty_kg",
+		],
+		values=values,
+	)
+	if dirty and dirty >= start:
+		frappe.db.set_global(_DIRTY_KEY, "")
+	return len(values)
+
+
+# ---------- readers ----------
+
+
+def _closing_totals(day, filters=None) -> dict[tuple[str, ...], float]:
+	"""Closing balance per bucket at the end of ``day``: nearest snapshot + ledger tail."""
+	day = getdate(day)
+	totals: dict[tuple[str, ...], float] = {}
+	snapshot_date = _clean_snapshot_date(day)
+	if snapshot_date:
+		clauses, params = _bucket_clauses(filters)
+		rows = frappe.db.sql(
+			f"""
+			SELECT center, coffee_form, coffee_grade, status, qty_kg
+			FROM `tab{SNAPSHOT}`
+			WHERE {" AND ".join(["snapshot_date=%s", *clauses])}
+			""",
+			[snapshot_date, *params],
+		)
+		for row in rows:
+			totals[tuple((value or "") for value in row[:4])] = flt(row[4])
+		if snapshot_date >= day:
+			return totals
+		tail_start = add_days(snapshot_date, 1)
+	else:
+		tail_start = None
+
+	for key, (qty_in, qty_out) in _ledger_movements(tail_start, day, filters, by_day=False).items():
+		totals[key] = totals.get(key, 0.0) + qty_in - qty_out
+	return totals
+
+
+def _as_rows(keys, **columns) -> list[dict]:
+	rows = []
+	for key in sorted(keys):
+		values = {name: flt(column.get(key, 0.0), 3) for name, column in columns.items()}
+		if all(abs(value) <= _TOLERANCE for value in values.values()):
+			continue
+		rows.append({**dict(zip(SNAPSHOT_FIELDS, key, strict=True)), **values})
+	return rows
+
+
+@frappe.whitelist()
+def stock_as_of(as_of, center=None, coffee_form=None, coffee_grade=None, status=None):
+	"""Closing balance per (center, form, grade, status) at the end of ``as_of``."""
+	frappe.has_permission(CSL, "read", throw=True)
+	filters = {"center": center, "coffee_form": coffee_form, "coffee_grade": coffee_grade, "status": status}
+	totals = _closing_totals(as_of, filters)
+	return _as_rows(totals, qty_kg=totals)
+
+
+@frappe.whitelist()
+def stock_statement(from_date, to_date, center=None, coffee_form=None, coffee_grade=None, status=None):
+	"""Opening, IN, OUT and closing per bucket for ``from_date`` .. ``to_date`` (inclusive)."""
+	frappe.has_permission(CSL, "read", throw=True)
+	from_date, to_date = getdate(from_date), getdate(to_date)
+	if from_date > to_date:
+		frappe.throw(_("From Date must be on or before To Date"))
+	filters = {"center": center, "coffee_form": coffee_form, "coffee_grade": coffee_grade, "status": status}
+
+	opening = _closing_totals(add_days(from_date, -1), filters)
+	qty_in: dict[tuple[str, ...], float] = {}
+	qty_out: dict[tuple[str, ...], float] = {}
+
+	# Days covered by clean snapshots come from their stored totals...
+	covered_until = _clean_snapshot_date(to_date)
+	if covered_until and covered_until >= from_date:
+		clauses, params = _bucket_clauses(filters)
+		rows = frappe.db.sql(
+			f"""
+			SELECT center, coffee_form, coffee_grade, status, SUM(in_qty), SUM(out_qty)
+			FROM `tab{SNAPSHOT}`
+			WHERE {" AND ".join(["snapshot_date BETWEEN %s AND %s", *clauses])}
+			GROUP BY center, coffee_form, coffee_grade, status
+			""",
+			[from_date, covered_until, *params],
+		)
+		for row in rows:
+			key = tuple((value or "") for value in row[:4])
+			qty_in[key] = flt(row[4])
+			qty_out[key] = flt(row[5])
+		tail_start = add_days(covered_until, 1)
+	else:
+		tail_start = from_date
+
+	# ...and only the rest is read from the ledger.
+	if tail_start <= to_date:
+		for key, (moved_in, moved_out) in _ledger_movements(
+			tail_start, to_date, filters, by_day=False
+		).items():
+			qty_in[key] = qty_in.get(key, 0.0) + moved_in
+			qty_out[key] = qty_out.get(key, 0.0) + moved_out
+
+	keys = set(opening) | set(qty_in) | set(qty_out)
+	closing = {key: opening.get(key, 0.0) + qty_in.get(key, 0.0) - qty_out.get(key, 0.0) for key in keys}
+	return _as_rows(keys, opening=opening, in_qty=qty_in, out_qty=qty_out, closing=closing)
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from farmlink.utils.csl import CSL, center_balance, post_entries
+
+THREADS = 16
+STOCK_KG = 100
+OUT_KG = 10
+# How long a worker keeps its posting transaction open before committing, so
+# postings at different centers have a window in which to overlap.
+HOLD_SECONDS = 0.2
+
+
+def _dispatch(center):
+	return [
+		dict(
+			center=center,
+			status="Dispatched",
+			form="Parchment",
+			qty=OUT_KG,
+			entry_type="OUT",
+			entry_ref="stress_out",
+		)
+	]
+
+
+def _worker(site, center, ref_dn, barrier, outcomes, held):
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		frappe.set_user("Administrator")
+		barrier.wait()
+		try:
+			post_entries("Centers", ref_dn, _dispatch(center))
+			posted_at = time.monotonic()
+			time.sleep(HOLD_SECONDS)
+			frappe.db.commit()
+			held.append((center, posted_at, time.monotonic()))
+			outcomes.append((center, "posted"))
+		except frappe.ValidationError:
+			frappe.db.rollback()
+			outcomes.append((center, "rejected"))
+		except Exception as exc:
+			frappe.db.rollback()
+			outcomes.append((center, f"error: {exc!r}"))
+	finally:
+		frappe.destroy()
+
+
+class TestStockLocking(FrappeTestCase):
+	"""Parallel OUT postings against the site's MariaDB, each on its own connection.
+
+	Data has to be committed for the worker connections to see it, so the test
+	cleans up after itself instead of relying on the FrappeTestCase rollback.
+	"""
+
+	centers = ("_Test Lock Center A", "_Test Lock Center B")
+
+	def setUp(self):
+		for center in self.centers:
+			if not frappe.db.exists("Centers", center):
+				frappe.get_doc({"doctype": "Centers", "name1": center}).insert()
+			post_entries(
+				"Centers",
+				center,
+				[
+					dict(
+						center=center,
+						status="Primary Arrival",
+						form="Parchment",
+						qty=STOCK_KG,
+						entry_type="IN",
+						entry_ref="stress_in",
+					)
+				],
+			)
+		frappe.db.commit()
+
+	def tearDown(self):
+		frappe.db.rollback()
+		frappe.db.delete(CSL, {"center": ["in", self.centers]})
+		frappe.db.delete("Coffee Stock Balance", {"center": ["in", self.centers]})
+		frappe.db.delete("Centers", {"name": ["in", self.centers]})
+		frappe.db.commit()
+
+	def test_parallel_out_postings_never_oversell(self):
+		site = frappe.local.site
+		barrier = threading.Barrier(THREADS * len(self.centers))
+		outcomes = []
+		held = []
+		threads = [
+			threading.Thread(
+				target=_worker,
+				args=(site, center, f"{center} dispatch {i}", barrier, outcomes, held),
+			)
+			for center in self.centers
+			for i in range(THREADS)
+		]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join(timeout=120)
+
+		self.assertEqual(len(outcomes), len(threads))
+		self.assertFalse([o for o in outcomes if o[1].startswith("error")], outcomes)
+		for center in self.centers:
+			posted = sum(1 for c, outcome in outcomes if c == center and outcome == "posted")
+			# Exactly as many dispatches as the stock covers, never one more.
+			self.assertEqual(posted, STOCK_KG // OUT_KG)
+			self.assertEqual(center_balance(center=center, form="Parchment"), 0)
+			ledger_qty = frappe.db.sql(
+				f"""
+				SELECT COALESCE(SUM(CASE WHEN entry_type='IN' THEN qty_kg ELSE -qty_kg END), 0)
+				FROM `tab{CSL}` WHERE center=%s AND is_cancelled=0
+				""",
+				center,
+			)[0][0]
+			self.assertEqual(ledger_qty, 0)
+
+		# Postings at different centers share no lock: some posting at A held
+		# its transaction open while one at B had posted and not yet committed.
+		a, b = self.centers
+		self.assertTrue(
+			any(
+				start_a < end_b and start_b < end_a
+				for center_a, start_a, end_a in held
+				if center_a == a
+				for center_b, start_b, end_b in held
+				if center_b == b
+			),
+			held,
+		)
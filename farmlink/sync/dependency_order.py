@@ -7,19 +7,27 @@ The v1 module had two correctness bugs this file fixes:
      The real Frappe DocType is ``Centers``; the mobile table is ``centers``.
   2. ``cupping_orders`` was processed before ``trades`` even though
      ``trades.cupping_order`` links back to it. Trades is now after
-     cupping_orders, and the trade<->cupping_order back-reference is left for
-     a follow-up update push (Frappe accepts null cupping_order on Trades).
+     cupping_orders, and the trade<->cupping_order back-reference is patched
+     in the same push (see ``plan_creates`` below).
 
-PROCESSING_ORDER is the order in which push() processes each mobile table so
-that parent records exist before children reference them.
+PROCESSING_ORDER is the table-level order in which push() processes each
+mobile table so that parent records exist before children reference them.
+Creates are refined per record by ``plan_creates``: it builds a dependency
+graph across the incoming rows from LINK_FIELD_MAPPINGS and orders them
+topologically, using PROCESSING_ORDER only as the tie-break. Cycles (a trade
+and its cupping order created offline together) are broken by inserting one
+side with the link nulled and returning a deferred fix-up that push() applies
+once the other side exists — one round trip instead of two.
 
 LINK_FIELD_MAPPINGS maps {mobile_table: {field: target_mobile_table}} for the
 fields whose values are foreign keys into another *synced* mobile table. These
-get resolved through the per-push id_mappings (client_id -> Frappe name)
-before insert/save. Foreign keys to non-synced doctypes (e.g. User, Bank, Customers)
+get resolved through the per-push id_mappings (client_id -> Frappe name,
+seeded from the device's Sync ID Map rows) before insert/save. Foreign keys to non-synced doctypes (e.g. User, Bank, Customers)
 are NOT listed — the mobile sends the Frappe name directly.
 """
 
+import heapq
+
 # Mobile WatermelonDB table -> Frappe DocType name
 DOCTYPE_MAPPINGS: dict[str, str] = {
 	"territories": "Territory",
@@ -144,3 +152,104 @@ LINK_FIELD_MAPPINGS: dict[str, dict[str, str]] = {
 		"export_warehouse": "centers",
 	},
 }
+
+
+def _client_id_of(raw: dict):
+	return raw.get("client_id") or raw.get("id") or raw.get("name")
+
+
+def plan_creates(incoming: dict) -> tuple[list[tuple[str, dict]], list[tuple[str, dict, str, str]]]:
+	"""Order every incoming create so referenced rows are inserted first.
+
+	Returns ``(ordered, deferred)``:
+
+	* ``ordered`` — ``[(mobile_table, raw), ...]`` in insert order. A row that
+	  depends on nothing in the batch keeps its PROCESSING_ORDER position, so a
+	  batch without intra-batch links is processed exactly as before.
+	* ``deferred`` — ``[(mobile_table, raw, field, target_client_id), ...]``
+	  for links dropped to break a cycle. ``raw[field]`` has been set to None;
+	  the caller patches it once the target row has been created.
+	"""
+	order_idx = {table: i for i, table in enumerate(PROCESSING_ORDER)}
+
+	nodes: list[tuple[str, dict]] = []
+	key_to_node: dict[tuple[str, str], int] = {}
+	for table in PROCESSING_ORDER:
+		table_changes = incoming.get(table)
+		if not isinstance(table_changes, dict):
+			continue
+		for raw in table_changes.get("created") or []:
+			if not isinstance(raw, dict):
+				continue
+			client_id = _client_id_of(raw)
+			if client_id:
+				key_to_node.setdefault((table, client_id), len(nodes))
+			nodes.append((table, raw))
+
+	# deps[n] = {node_index: [fields]} for in-batch rows n links to.
+	deps: list[dict[int, list[str]]] = [{} for _ in nodes]
+	dependents: list[set[int]] = [set() for _ in nodes]
+	for n, (table, raw) in enumerate(nodes):
+		for field, target_table in (LINK_FIELD_MAPPINGS.get(table) or {}).items():
+			value = raw.get(field)
+			if not value or not isinstance(value, str):
+				continue
+			target = key_to_node.get((target_table, value))
+			if target is None or target == n:
+				continue
+			deps[n].setdefault(target, []).append(field)
+			dependents[target].add(n)
+
+	def sort_key(n):
+		return (order_idx[nodes[n][0]], n)
+
+	remaining = [len(d) for d in deps]
+	ready = [sort_key(n) for n in range(len(nodes)) if remaining[n] == 0]
+	heapq.heapify(ready)
+	done = [False] * len(nodes)
+	ordered: list[tuple[str, dict]] = []
+	deferred: list[tuple[str, dict, str, str]] = []
+
+	while len(ordered) < len(nodes):
+		if not ready:
+			n, target = _find_cycle_edge(deps, done, sort_key)
+			table, raw = nodes[n]
+			for field in deps[n].pop(target):
+				deferred.append((table, raw, field, raw.get(field)))
+				raw[field] = None
+			dependents[target].discard(n)
+			remaining[n] -= 1
+			if remaining[n] == 0:
+				heapq.heappush(ready, sort_key(n))
+			continue
+
+		_, n = heapq.heappop(ready)
+		done[n] = True
+		ordered.append(nodes[n])
+		for m in dependents[n]:
+			remaining[m] -= 1
+			if remaining[m] == 0:
+				heapq.heappush(ready, sort_key(m))
+
+	return ordered, deferred
+
+
+def _find_cycle_edge(deps, done, sort_key) -> tuple[int, int]:
+	"""Return ``(node, target)``: the link to drop to break one dependency cycle.
+
+	Walks unfinished dependencies from the earliest pending row until a row
+	repeats; the repeated stretch is a cycle. Within it, the earliest row (by
+	PROCESSING_ORDER) loses its link to the next row, so in the trade <->
+	cupping order case the Cupping Order is inserted first without ``trade``.
+	"""
+	pending = [n for n in range(len(deps)) if not done[n]]
+	current = min(pending, key=sort_key)
+	position: dict[int, int] = {}
+	path: list[int] = []
+	while current not in position:
+		position[current] = len(path)
+		path.append(current)
+		current = min((t for t in deps[current] if not done[t]), key=sort_key)
+	cycle = path[position[current] :]
+	i = min(range(len(cycle)), key=lambda k: sort_key(cycle[k]))
+	return cycle[i], cycle[(i + 1) % len(cycle)]
@@ -0,0 +1,182 @@
+"""
+Persistent client_id -> Frappe name mapping for the v2 push endpoint.
+
+``id_mappings`` inside ``_push_impl`` only lives for one request, so a child
+record (e.g. a Payment whose ``purchase_invoice`` is still a WatermelonDB id)
+could only be pushed after the parent's push response had come back and been
+remapped on the device. Every successful create is now also written to the
+Sync ID Map DocType keyed by (user, device_id, mobile_table, client_id), and
+each push bulk-loads the rows it needs up front — one query for the whole batch —
+into the same ``id_mappings`` dict ``_resolve_links_in_place`` already reads.
+Devices can therefore pipeline dependent pushes without waiting.
+
+The device key is the ``device_id`` the mobile sends with each push. Older
+builds don't send one; for those we fall back to the session user, which is
+still safe because WatermelonDB ids are random per row. The client picks the
+device id, so mappings are also scoped to the session user (``mapped_by``):
+one account can never resolve ids through another account's mappings.
+
+A mapping is only needed until the device has remapped the row, which it
+does on the first push response it receives. ``prune`` runs daily and drops
+mappings older than ``RETENTION_DAYS`` (``farmlink_sync_id_map_retention_days``
+in site_config.json).
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+import frappe
+from frappe.utils import add_days, cint, now_datetime
+
+from farmlink.sync.dependency_order import DOCTYPE_MAPPINGS, LINK_FIELD_MAPPINGS
+
+ID_MAP_DOCTYPE = "Sync ID Map"
+
+_MAX_DEVICE_ID_LENGTH = 140
+
+RETENTION_DAYS = 90
+_CHUNK_SIZE = 10000
+
+
+def resolve_device_id(value=None) -> str:
+	"""Return the device key for this push, falling back to the session user."""
+	if isinstance(value, str) and value.strip():
+		return value.strip()[:_MAX_DEVICE_ID_LENGTH]
+	return frappe.session.user
+
+
+def preload(device_id: str, incoming: dict[str, dict[str, Any]]) -> dict[str, dict[str, str]]:
+	"""Bulk-load every known mapping the incoming batch could reference.
+
+	Collects FK values from creates/updates plus the names of updates/deletes
+	(a pipelined push may update a row by the client id it was created under)
+	and resolves them all in one query. Returns ``{mobile_table: {client_id: name}}``.
+	"""
+	candidates: set[str] = set()
+	for mobile_table, table_changes in incoming.items():
+		if not isinstance(table_changes, dict):
+			continue
+		link_fields = LINK_FIELD_MAPPINGS.get(mobile_table) or {}
+		for raw in (table_changes.get("created") or []) + (table_changes.get("updated") or []):
+			if not isinstance(raw, dict):
+				continue
+			for field in link_fields:
+				value = raw.get(field)
+				if value and isinstance(value, str):
+					candidates.add(value)
+			name = raw.get("name") or raw.get("frappe_id")
+			if name and isinstance(name, str):
+				candidates.add(name)
+		for ref in table_changes.get("deleted") or []:
+			name = ref if isinstance(ref, str) else (ref or {}).get("name")
+			if name and isinstance(name, str):
+				candidates.add(name)
+
+	mappings: dict[str, dict[str, str]] = {}
+	if not candidates:
+		return mappings
+
+	rows = frappe.get_all(
+		ID_MAP_DOCTYPE,
+		filters={
+			"mapped_by": frappe.session.user,
+			"device_id": device_id,
+			"client_id": ["in", list(candidates)],
+		},
+		fields=["mobile_table", "client_id", "ref_name"],
+		ignore_permissions=True,
+	)
+	for row in rows:
+		mappings.setdefault(row.mobile_table, {})[row.client_id] = row.ref_name
+	return mappings
+
+
+def persist(device_id: str, processed: dict[str, dict[str, list]]) -> None:
+	"""Record every create of this push so later pushes can resolve its client id.
+
+	One multi-row INSERT for the whole batch; rows already mapped (e.g. the
+	DuplicateEntry idempotency path) are skipped by the unique index.
+	"""
+	now = now_datetime()
+	user = frappe.session.user
+	values = []
+	for mobile_table, bucket in processed.items():
+		doctype = DOCTYPE_MAPPINGS.get(mobile_table)
+		for entry in bucket.get("created") or []:
+			client_id = entry.get("client_id")
+			name = entry.get("name")
+			if not client_id or not name or client_id == name:
+				continue
+			values.append(
+				(
+					frappe.generate_hash(length=10),
+					now,
+					now,
+					user,
+					user,
+					device_id,
+					mobile_table,
+					client_id,
+					doctype,
+					name,
+					user,
+				)
+			)
+
+	if not values:
+		return
+
+	frappe.db.bulk_insert(
+		ID_MAP_DOCTYPE,
+		fields=[
+			"name",
+			"creation",
+			"modified",
+			"owner",
+			"modified_by",
+			"device_id",
+			"mobile_table",
+			"client_id",
+			"ref_doctype",
+			"ref_name",
+			"mapped_by",
+		],
+		values=values,
+		ignore_duplicates=True,
+	)
+
+
+def retention_days() -> int:
+	value = frappe.conf.get("farmlink_sync_id_map_retention_days")
+	return RETENTION_DAYS if value is None else max(0, cint(value))
+
+
+def prune(retention: int | None = None, chunk_size: int = _CHUNK_SIZE) -> int:
+	"""Delete mappings created before the retention window, one chunk per transaction."""
+	cutoff = add_days(now_datetime(), -(retention_days() if retention is None else retention))
+	deleted = 0
+	while True:
+		names = frappe.db.sql_list(
+			f"""
+			SELECT name FROM `tab{ID_MAP_DOCTYPE}`
+			WHERE creation < %s
+			LIMIT %s
+			""",
+			(cutoff, chunk_size),
+		)
+		if not names:
+			break
+		frappe.db.delete(ID_MAP_DOCTYPE, {"name": ["in", names]})
+		frappe.db.commit()
+		deleted += len(names)
+		if len(names) < chunk_size:
+			break
+	return deleted
+
+
+def resolve_name(name: str | None, mobile_table: str, id_mappings: dict) -> str | None:
+	"""Translate a row name that may still be a client id into its Frappe name."""
+	if not name:
+		return name
+	return id_mappings.get(mobile_table, {}).get(name, name)
@@ -0,0 +1,195 @@
+"""
+Push-scoped Link validation cache for the v2 sync engine.
+
+Every ``doc.insert()`` / ``doc.save()`` makes Frappe validate each Link field
+(territory, collection_center, farmer, supplier, ...) with its own
+``frappe.db.get_value`` — and, for fields with ``fetch_from`` (Purchases.phone,
+Payment.purchase_amount, Secondary Arrival Log.dispatch_log.*), an uncached one.
+A 500-row push against one collection center repeats the same lookups hundreds
+of times.
+
+``LinkCache`` replaces that with one ``IN`` query per target doctype over every
+link value in the batch, fetching the ``fetch_from`` source columns in the same
+query. Sync writes then validate links and apply fetched values from the cache
+and set ``flags.ignore_links`` for Frappe's own ``_validate_links`` pass, so it
+skips its per-field queries. ``restore_link_check`` (a ``before_validate``
+hook on every doctype) puts the flag back right after that pass:
+
+	cache = LinkCache()
+	cache.preload_for_push(incoming, id_mappings)
+	cache.validate(doc)  # raises frappe.LinkValidationError like Frappe would
+	doc.insert()
+	cache.add(doc)       # rows created in this push become valid link targets
+
+A value missing from the preload (e.g. an unchanged link on an updated row)
+falls back to a single query whose result, hit or miss, is cached too — the
+cache never changes *what* is accepted, only how many queries it takes.
+
+None of the synced doctypes are submittable, so Frappe's cancelled-link check
+has no equivalent here.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+import frappe
+from frappe import _
+
+from farmlink.sync.dependency_order import DOCTYPE_MAPPINGS, LINK_FIELD_MAPPINGS
+from farmlink.sync.serializers import list_child_tables
+
+# Large batches go out as several IN queries instead of one giant statement.
+_PRELOAD_CHUNK = 1000
+
+
+class LinkCache:
+	def __init__(self):
+		# {doctype: {casefolded name: row}}; row is None for a known-missing name.
+		self._rows: dict[str, dict[str, frappe._dict | None]] = {}
+		self._fetch_fields: dict[str, set[str]] = {}
+		self.queries = 0
+
+	# ---------- loading ----------
+
+	def preload_for_push(self, incoming: dict[str, dict[str, Any]], id_mappings: dict) -> None:
+		"""Collect every link value in a push payload and load each target doctype once."""
+		wanted: dict[str, set[str]] = {}
+		for mobile_table, table_changes in incoming.items():
+			doctype = DOCTYPE_MAPPINGS.get(mobile_table)
+			if not doctype or not isinstance(table_changes, dict):
+				continue
+			resolvable = LINK_FIELD_MAPPINGS.get(mobile_table) or {}
+			child_fields = dict(list_child_tables(doctype))
+			for raw in (table_changes.get("created") or []) + (table_changes.get("updated") or []):
+				if not isinstance(raw, dict):
+					continue
+				self._collect(doctype, raw, wanted, resolvable, id_mappings)
+				for parent_field, child_doctype in child_fields.items():
+					rows = raw.get(parent_field)
+					if isinstance(rows, list):
+						for row in rows:
+							if isinstance(row, dict):
+								self._collect(child_doctype, row, wanted, {}, id_mappings)
+
+		for target, names in wanted.items():
+			self.preload(target, names)
+
+	def preload(self, doctype: str, names) -> None:
+		"""Load ``names`` of ``doctype`` (plus any fetch_from columns) in chunked IN queries."""
+		known = self._rows.setdefault(doctype, {})
+		pending = sorted({n for n in names if n and n.casefold() not in known})
+		if not pending:
+			return
+		fields = ["name", *sorted(self._fetch_fields.get(doctype, ()))]
+		for start in range(0, len(pending), _PRELOAD_CHUNK):
+			chunk = pending[start : start + _PRELOAD_CHUNK]
+			rows = frappe.get_all(
+				doctype,
+				filters={"name": ["in", chunk]},
+				fields=fields,
+				ignore_permissions=True,
+			)
+			self.queries += 1
+			for row in rows:
+				known[row.name.casefold()] = row
+			for name in chunk:
+				known.setdefault(name.casefold(), None)
+
+	def add(self, doc) -> None:
+		"""Register a row written during this push as a valid link target."""
+		row = frappe._dict(name=doc.name)
+		for fieldname in self._fetch_fields.get(doc.doctype, ()):
+			row[fieldname] = doc.get(fieldname)
+		self._rows.setdefault(doc.doctype, {})[doc.name.casefold()] = row
+
+	def _collect(self, doctype, record, wanted, resolvable, id_mappings) -> None:
+		meta = frappe.get_meta(doctype)
+		for df in meta.get_link_fields():
+			value = record.get(df.fieldname)
+			if not value or not isinstance(value, str):
+				continue
+			target_table = resolvable.get(df.fieldname)
+			if target_table:
+				value = id_mappings.get(target_table, {}).get(value, value)
+			wanted.setdefault(df.options, set()).add(value)
+			for fetch_df in meta.get_fields_to_fetch(df.fieldname):
+				self._fetch_fields.setdefault(df.options, set()).add(fetch_df.fetch_from.split(".")[-1])
+
+	def _lookup(self, doctype: str, name: str) -> frappe._dict | None:
+		known = self._rows.setdefault(doctype, {})
+		key = name.casefold()
+		if key not in known:
+			# Not in the preload: one query, then remember the answer either way.
+			fields = ["name", *sorted(self._fetch_fields.get(doctype, ()))]
+			known[key] = frappe.db.get_value(doctype, name, fields, as_dict=True)
+			self.queries += 1
+		return known[key]
+
+	# ---------- validation ----------
+
+	def validate(self, doc) -> None:
+		"""Validate links of ``doc`` and its child rows from the cache, then skip Frappe's pass."""
+		invalid: list[str] = []
+		self._validate_row(doc, invalid)
+		for child in doc.get_all_children():
+			self._validate_row(child, invalid)
+		if invalid:
+			frappe.throw(_("Could not find {0}").format(", ".join(invalid)), frappe.LinkValidationError)
+		# Skip Frappe's own pass for this write; restore_link_check turns it back on.
+		if "ignore_links_before_cache" not in doc.flags:
+			doc.flags.ignore_links_before_cache = doc.flags.ignore_links
+		doc.flags.ignore_links = True
+
+	def _validate_row(self, row, invalid: list[str]) -> None:
+		meta = row.meta
+		for df in meta.get_link_fields():
+			docname = row.get(df.fieldname)
+			if not docname:
+				continue
+			target = df.options
+			fields_to_fetch = [
+				f
+				for f in meta.get_fields_to_fetch(df.fieldname)
+				if not f.get("fetch_if_empty") or not row.get(f.fieldname)
+			]
+			if fields_to_fetch:
+				fetched = {f.fetch_from.split(".")[-1] for f in fields_to_fetch}
+				missing = fetched - self._fetch_fields.get(target, set())
+				if missing:
+					# A fetch column we didn't preload: widen the set and forget rows
+					# loaded without it so they are re-read with the new columns.
+					self._fetch_fields.setdefault(target, set()).update(missing)
+					self._rows.pop(target, None)
+
+			values = self._lookup(target, str(docname))
+			if not values:
+				invalid.append(f"{_(df.label)}: {docname}")
+				continue
+			# MariaDB matches names case-insensitively; store the canonical casing
+			# exactly as Frappe's own link validation does.
+			row.set(df.fieldname, values.name)
+			for fetch_df in fields_to_fetch:
+				row.set_fetch_from_value(target, fetch_df, values)
+
+		for df in meta.get("fields", {"fieldtype": "Dynamic Link"}):
+			docname = row.get(df.fieldname)
+			target = row.get(df.options)
+			if not docname or not target:
+				continue
+			values = self._lookup(target, str(docname))
+			if not values:
+				invalid.append(f"{_(df.label)}: {docname}")
+				continue
+			row.set(df.fieldname, values.name)
+
+
+def restore_link_check(doc, method=None) -> None:
+	"""before_validate for every doctype: undo the ``ignore_links`` set by ``LinkCache.validate``.
+
+	Frappe's ``_validate_links`` runs just before ``before_validate``, so the
+	flag only covers that pass; controller hooks and later saves of the same
+	doc see the value it had before.
+	"""
+	if "ignore_links_before_cache" in doc.flags:
+		doc.flags.ignore_links = doc.flags.pop("ignore_links_before_cache")
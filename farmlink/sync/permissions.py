@@ -21,7 +21,6 @@ or, where no center field exists, their assigned territory.
 import frappe
 from frappe.utils.nestedset import get_descendants_of
 
-
 BYPASS_ROLES = ("System Manager", "Farmlink Manager")
 
 
@@ -99,6 +98,14 @@ def get_for_purchases(user):
 	return _build_filter(user, "tabPurchases", center_field="collection_center")
 
 
+def get_for_purchase_daily_rollup(user):
+	return _build_filter(user, "tabPurchase Daily Rollup", center_field="center")
+
+
+def get_for_purchase_anomaly(user):
+	return _build_filter(user, "tabPurchase Anomaly", center_field="center")
+
+
 def get_for_payment(user):
 	if not user or user == "Guest":
 		return "1=0"
@@ -0,0 +1,138 @@
+"""
+Idempotent push replay cache for the v2 sync engine.
+
+On flaky rural networks the mobile frequently loses the push *response* after
+the server has already committed the batch, and re-sends the identical batch.
+Without a replay guard the retry is only safe for creates (the DuplicateEntry
+path in ``_handle_creates``); updates and deletes are re-executed and the
+conflict check then fires against the versions the first attempt just wrote.
+
+The mobile tags every push with a client-generated ``request_id`` (a UUID per
+outbound batch, reused verbatim on retries). After a push finishes we store the
+result in Redis under ``(user, request_id)`` with a TTL; a replay inside that
+window returns the stored result as-is and never touches the database.
+Every result is stored, ``failed[]`` entries included: the updates that did
+succeed must not run a second time, and a corrected batch goes out under a
+new request id.
+
+``claim`` puts an in-flight placeholder under the same key (``SET NX``) before
+the push runs, so a retry that arrives while the first attempt is still
+running is refused with ``PushInProgress`` instead of executing twice. The
+placeholder is replaced by the result once the push commits, and dropped
+when it rolls back.
+
+Keys are scoped per user so one account can never read another account's push
+result by guessing its request id. Requests without a ``request_id`` (older
+mobile builds) bypass the cache entirely and behave exactly as before.
+"""
+
+from __future__ import annotations
+
+import pickle
+from typing import Any
+
+import frappe
+from frappe import _
+
+# Long enough to cover a phone that loses signal mid-push and only retries
+# after the field officer is back in range later the same day.
+REPLAY_TTL_SECONDS = 24 * 60 * 60
+# Outlives any push the web worker would let run to completion.
+IN_FLIGHT_TTL_SECONDS = 15 * 60
+
+_MAX_REQUEST_ID_LENGTH = 64
+_CACHE_KEY_PREFIX = "farmlink:sync:push_replay"
+_IN_FLIGHT = "in-flight"
+
+
+class PushInProgress(frappe.ValidationError):
+	http_status_code = 409
+
+
+def normalize_request_id(value) -> str | None:
+	"""Return a usable request id or None. Rejects non-strings and oversized ids."""
+	if not isinstance(value, str):
+		return None
+	value = value.strip()
+	if not value or len(value) > _MAX_REQUEST_ID_LENGTH:
+		return None
+	return value
+
+
+def get_replayed_result(request_id: str | None) -> dict[str, Any] | None:
+	"""Return the stored push result for this user + request id, or None.
+
+	Raises ``PushInProgress`` while another attempt with this id is running.
+	"""
+	if not request_id:
+		return None
+	try:
+		stored = frappe.cache().get_value(_cache_key(request_id), expires=True)
+	except Exception as exc:
+		# A Redis hiccup must not block the push — fall through and re-execute.
+		frappe.logger("farmlink.sync.replay").warning(f"replay lookup failed: {exc}")
+		return None
+	if stored == _IN_FLIGHT:
+		_raise_in_progress()
+	return stored
+
+
+def claim(request_id: str | None) -> bool:
+	"""Mark this request id in flight; False if another attempt holds or finished it.
+
+	Once claimed, the placeholder is replaced by the result on commit and
+	removed on rollback.
+	"""
+	if not request_id:
+		return True
+	cache = frappe.cache()
+	try:
+		claimed = cache.set(
+			cache.make_key(_cache_key(request_id)),
+			pickle.dumps(_IN_FLIGHT),
+			ex=IN_FLIGHT_TTL_SECONDS,
+			nx=True,
+		)
+	except Exception as exc:
+		frappe.logger("farmlink.sync.replay").warning(f"replay claim failed: {exc}")
+		return True
+	if not claimed:
+		return False
+	frappe.db.after_rollback.add(lambda: release(request_id))
+	return True
+
+
+def release(request_id: str | None) -> None:
+	"""Drop the in-flight placeholder so a retry of a rolled-back push runs again."""
+	if not request_id:
+		return
+	try:
+		frappe.cache().delete_value(_cache_key(request_id))
+	except Exception as exc:
+		frappe.logger("farmlink.sync.replay").warning(f"replay release failed: {exc}")
+
+
+def store_result(request_id: str | None, result: dict[str, Any]) -> None:
+	"""Remember a finished push result so a retried request can be answered verbatim."""
+	if not request_id:
+		return
+	try:
+		frappe.cache().set_value(
+			_cache_key(request_id),
+			result,
+			expires_in_sec=REPLAY_TTL_SECONDS,
+		)
+	except Exception as exc:
+		frappe.logger("farmlink.sync.replay").warning(f"replay store failed: {exc}")
+
+
+def _raise_in_progress():
+	frappe.throw(
+		_("This push is still being processed, retry it shortly"),
+		PushInProgress,
+		title=_("Push in progress"),
+	)
+
+
+def _cache_key(request_id: str) -> str:
+	return f"{_CACHE_KEY_PREFIX}:{frappe.session.user}:{request_id}"
@@ -13,6 +13,10 @@ Two responsibilities:
     fields that don't exist on the doctype meta and the mobile-only sentinels
     (custom_sync_status, frappe_id, client_id, sync_version, base_version).
 
+merge_child_rows(doc, field, rows) — apply an update's child rows as a diff
+    (matched by child name or natural key) so unchanged rows are not deleted
+    and re-inserted on every push.
+
 sync_version_of(doc) — the integer ms-timestamp the mobile uses to detect
     conflicts. Reuses ``modified`` so we don't need a schema migration.
 
@@ -31,8 +35,7 @@ import json
 from typing import Any
 
 import frappe
-from frappe.utils import get_datetime
-
+from frappe.utils import cstr, flt, get_datetime
 
 # Mobile-only fields that must never reach Frappe inserts/updates.
 MOBILE_ONLY_FIELDS = frozenset(
@@ -87,6 +90,32 @@ CHILD_TABLE_PARENTS = {
 	"Trades": [("table_ovaz", "Cert No Details")],
 }
 
+# Natural key per child doctype, used to match an incoming row to the stored
+# row it edits when the mobile didn't echo the child ``name`` back. Duplicates
+# (two G1 output rows) pair up in order of appearance.
+CHILD_NATURAL_KEYS = {
+	"Processed Output": ("grade",),
+	"Harvest Data": ("year_in_ec",),
+	"Fertilizer Usage": ("year_in_ec",),
+	"Cert No Details": ("secondary_processing_ref", "coffee_grade", "coffee_type", "origin"),
+}
+
+_NUMERIC_FIELDTYPES = frozenset({"Float", "Currency", "Int", "Percent", "Check"})
+
+# Frappe internals stripped from incoming child rows. ``name`` is only kept when
+# the caller wants to diff against the stored rows.
+_CHILD_INTERNAL_FIELDS = (
+	"parent",
+	"parentfield",
+	"parenttype",
+	"idx",
+	"creation",
+	"modified",
+	"owner",
+	"modified_by",
+	"docstatus",
+)
+
 
 def sync_version_of(doc) -> int:
 	modified = getattr(doc, "modified", None)
@@ -136,13 +165,16 @@ def _serialize_child(child) -> dict[str, Any]:
 	return out
 
 
-def from_payload(data: dict, doctype: str) -> dict[str, Any]:
+def from_payload(data: dict, doctype: str, keep_child_names: bool = False) -> dict[str, Any]:
 	"""Sanitize an incoming payload before insert/save.
 
 	* Drops mobile-only sentinels (custom_sync_status, frappe_id, etc.)
 	* Drops fields not present on the doctype meta
 	* Normalizes child tables into list-of-dicts (accepts JSON-string legacy form)
 	* Drops Frappe-managed timestamps (creation/modified) — server is authoritative
+
+	With ``keep_child_names`` child rows keep their ``name`` (or the mobile's
+	row id) so ``merge_child_rows`` can match them to the stored rows.
 	"""
 	if not isinstance(data, dict):
 		return {}
@@ -164,14 +196,14 @@ def from_payload(data: dict, doctype: str) -> dict[str, Any]:
 			continue
 
 		if key in child_field_set or allowed_fields.get(key) == "Table":
-			result[key] = _normalize_child_rows(value, key, doctype)
+			result[key] = _normalize_child_rows(value, key, doctype, keep_names=keep_child_names)
 		else:
 			result[key] = value
 
 	return result
 
 
-def _normalize_child_rows(value, parent_field: str, doctype: str) -> list[dict]:
+def _normalize_child_rows(value, parent_field: str, doctype: str, keep_names: bool = False) -> list[dict]:
 	"""Accept a list, JSON-encoded string, or null and return a list of clean child dicts."""
 	if not value:
 		return []
@@ -189,16 +221,96 @@ def _normalize_child_rows(value, parent_field: str, doctype: str) -> list[dict]:
 	for row in value:
 		if not isinstance(row, dict):
 			continue
+		row_key = row.get("name") or row.get("client_id") or row.get("id")
 		row = {k: v for k, v in row.items() if k not in MOBILE_ONLY_FIELDS}
 		if parent_field in ("processing_output", "processed_output") and "weight" in row and "weightkg" not in row:
 			row["weightkg"] = row.pop("weight")
 		# Strip Frappe internals the mobile may have echoed back
-		for internal in ("name", "parent", "parentfield", "parenttype", "idx", "creation", "modified", "owner", "modified_by", "docstatus"):
+		for internal in _CHILD_INTERNAL_FIELDS:
 			row.pop(internal, None)
+		row.pop("name", None)
+		row.pop("id", None)
+		if keep_names and row_key:
+			row["name"] = row_key
 		cleaned.append(row)
 	return cleaned
 
 
+def merge_child_rows(doc, parent_field: str, rows: list[dict]) -> None:
+	"""Apply incoming child rows to ``doc`` as a diff instead of a wholesale replace.
+
+	``doc.set(parent_field, rows)`` gives every row a new name, so Frappe
+	deletes and re-inserts the whole table on save. Here each incoming row is
+	matched to a stored row — by ``name`` first (also tried with the mobile's
+	row id), then by the child doctype's natural key — and only differing
+	fields are set on it. Unmatched stored rows are dropped, unmatched incoming
+	rows are appended as new, and ``idx`` follows the incoming order. A table
+	with nothing added, changed, removed or reordered is left as loaded.
+	"""
+	child_doctype = doc.meta.get_field(parent_field).options
+	child_meta = frappe.get_meta(child_doctype)
+	fieldtypes = {f.fieldname: f.fieldtype for f in child_meta.fields}
+	natural_fields = CHILD_NATURAL_KEYS.get(child_doctype)
+
+	existing = list(doc.get(parent_field) or [])
+	by_name = {row.name: row for row in existing if row.name}
+	matched: list = [None] * len(rows)
+	used: set[str] = set()
+
+	for i, row in enumerate(rows):
+		stored = by_name.get(row.get("name"))
+		if stored is not None and stored.name not in used:
+			matched[i] = stored
+			used.add(stored.name)
+
+	if natural_fields:
+		pool: dict[tuple, list] = {}
+		for stored in existing:
+			if stored.name not in used:
+				key = tuple(cstr(stored.get(f)) for f in natural_fields)
+				pool.setdefault(key, []).append(stored)
+		for i, row in enumerate(rows):
+			if matched[i] is not None:
+				continue
+			candidates = pool.get(tuple(cstr(row.get(f)) for f in natural_fields))
+			if candidates:
+				matched[i] = candidates.pop(0)
+				used.add(matched[i].name)
+
+	changed = len(used) != len(existing)
+	result = []
+	for row, stored in zip(rows, matched, strict=True):
+		if stored is None:
+			row = {k: v for k, v in row.items() if k != "name"}
+			result.append(row)
+			changed = True
+			continue
+		for field, value in row.items():
+			if field == "name" or field not in fieldtypes:
+				continue
+			if not _same_value(fieldtypes[field], stored.get(field), value):
+				stored.set(field, value)
+				changed = True
+		result.append(stored)
+
+	if [r.name for r in result if not isinstance(r, dict)] != [r.name for r in existing if r.name in used]:
+		changed = True
+	if not changed:
+		return
+
+	doc.set(parent_field, [])
+	for idx, row in enumerate(result, start=1):
+		if not isinstance(row, dict):
+			row.idx = idx
+		doc.append(parent_field, row)
+
+
+def _same_value(fieldtype: str, current, incoming) -> bool:
+	if fieldtype in _NUMERIC_FIELDTYPES:
+		return flt(current) == flt(incoming)
+	return cstr(current) == cstr(incoming)
+
+
 def list_child_tables(doctype: str) -> list[tuple[str, str]]:
 	"""Return [(parent_field, child_doctype), ...] for batched child fetches."""
 	return list(CHILD_TABLE_PARENTS.get(doctype, []))
@@ -0,0 +1,117 @@
+from contextlib import contextmanager
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from farmlink.sync.link_cache import LinkCache
+
+BATCH_SIZE = 200
+
+
+@contextmanager
+def _count_queries():
+	counter = frappe._dict(count=0)
+	original = frappe.db.sql
+
+	def counting_sql(*args, **kwargs):
+		counter.count += 1
+		return original(*args, **kwargs)
+
+	frappe.db.sql = counting_sql
+	try:
+		yield counter
+	finally:
+		frappe.db.sql = original
+
+
+class TestLinkCache(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.territory = "_Test Link Cache Territory"
+		if not frappe.db.exists("Territory", cls.territory):
+			frappe.get_doc({"doctype": "Territory", "territory_name": cls.territory}).insert()
+		cls.center = "_Test Link Cache Center"
+		if not frappe.db.exists("Centers", cls.center):
+			frappe.get_doc({"doctype": "Centers", "name1": cls.center, "territory": cls.territory}).insert()
+		cls.farmer = (
+			frappe.get_doc(
+				{
+					"doctype": "Farmers",
+					"first_name": "Link",
+					"middle_name": "Cache",
+					"territory": cls.territory,
+					"phone_number": "0911000000",
+				}
+			)
+			.insert()
+			.name
+		)
+		# Warm meta so neither side of the benchmark pays for it.
+		frappe.get_meta("Purchases")
+
+	def _purchases(self):
+		return [
+			frappe.get_doc(
+				{
+					"doctype": "Purchases",
+					"farmer": self.farmer,
+					"collection_center": self.center,
+					"weight_in_kg": 10,
+					"price_rate_of_the_day": 50,
+				}
+			)
+			for _ in range(BATCH_SIZE)
+		]
+
+	def test_preload_cuts_link_queries(self):
+		if hasattr(frappe.db, "value_cache"):
+			frappe.db.value_cache.clear()
+		baseline_docs = self._purchases()
+		with _count_queries() as baseline:
+			for doc in baseline_docs:
+				doc._validate_links()
+
+		cached_docs = self._purchases()
+		cache = LinkCache()
+		with _count_queries() as cached:
+			cache.preload_for_push({"purchases": {"created": [d.as_dict() for d in cached_docs]}}, {})
+			for doc in cached_docs:
+				cache.validate(doc)
+
+		frappe.logger("farmlink.sync.link_cache").info(
+			f"Link validation for {BATCH_SIZE} Purchases: "
+			f"{baseline.count} queries per-field vs {cached.count} with LinkCache"
+		)
+		# One IN query each for Farmers and Centers, regardless of batch size.
+		self.assertLessEqual(cached.count, 2)
+		self.assertGreater(baseline.count, cached.count)
+		for plain, preloaded in zip(baseline_docs, cached_docs, strict=True):
+			self.assertEqual(plain.phone, preloaded.phone)
+		# Frappe's pass is skipped, then before_validate turns the check back on.
+		doc = cached_docs[0]
+		with _count_queries() as skipped:
+			doc._validate_links()
+		self.assertEqual(skipped.count, 0)
+		doc.run_method("before_validate")
+		self.assertFalse(doc.flags.ignore_links)
+		self.assertNotIn("ignore_links_before_cache", doc.flags)
+
+	def test_missing_link_raises(self):
+		doc = frappe.get_doc({"doctype": "Purchases", "collection_center": "_Test Missing Center"})
+		cache = LinkCache()
+		cache.preload_for_push({"purchases": {"created": [doc.as_dict()]}}, {})
+		self.assertRaises(frappe.LinkValidationError, cache.validate, doc)
+
+	def test_rows_added_in_push_are_valid_targets(self):
+		cache = LinkCache()
+		# The parent is still a client id at preload time and only exists once inserted.
+		cache.preload_for_push({"purchases": {"created": [{"farmer": "wm-client-farmer"}]}}, {})
+		farmer = frappe.get_doc(
+			{"doctype": "Farmers", "first_name": "Fresh", "middle_name": "Row", "phone_number": "0911999999"}
+		).insert()
+		cache.add(farmer)
+		doc = frappe.get_doc({"doctype": "Purchases", "farmer": farmer.name})
+		with _count_queries() as counter:
+			cache.validate(doc)
+		self.assertEqual(counter.count, 0)
@@ -0,0 +1,57 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from farmlink.sync import replay
+from farmlink.sync.v2 import push
+from farmlink.tests.utils import make_center, make_farmer, make_purchase, make_territory
+
+
+class TestPushReplay(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.territory = make_territory("_Test Replay Territory")
+		cls.center = make_center("_Test Replay Center", cls.territory)
+		cls.farmer = make_farmer(cls.territory, first_name="Replay").name
+
+	def setUp(self):
+		# The push rate limit keys on the caller; tests have no request IP.
+		frappe.local.request_ip = "127.0.0.1"
+		self.request_id = frappe.generate_hash(length=16)
+		self.addCleanup(replay.release, self.request_id)
+
+	def _push(self, changes):
+		return push(changes=changes, request_id=self.request_id)
+
+	def test_partially_failed_push_is_replayed_verbatim(self):
+		purchase = make_purchase(self.farmer, self.center)
+		changes = {
+			"purchases": {
+				"updated": [
+					{"name": purchase.name, "maturity": "Semi-Matured"},
+					{"name": "no-such-purchase", "maturity": "Semi-Matured"},
+				]
+			}
+		}
+		first = self._push(changes)
+		frappe.db.after_commit.run()
+		self.assertEqual(
+			[entry["name"] for entry in first["processed"]["purchases"]["updated"]], [purchase.name]
+		)
+		self.assertEqual([entry["code"] for entry in first["failed"]], ["NOT_FOUND"])
+		modified = frappe.db.get_value("Purchases", purchase.name, "modified")
+
+		# The response was lost and the phone re-sends the same batch.
+		self.assertEqual(self._push(changes), first)
+		self.assertEqual(frappe.db.get_value("Purchases", purchase.name, "modified"), modified)
+
+	def test_retry_while_first_attempt_runs_is_refused(self):
+		self.assertTrue(replay.claim(self.request_id))
+		self.assertFalse(replay.claim(self.request_id))
+		with self.assertRaises(replay.PushInProgress):
+			self._push({})
+
+		# A rolled-back attempt drops its claim, so the retry runs.
+		replay.release(self.request_id)
+		self.assertIsNone(replay.get_replayed_result(self.request_id))
+		self.assertTrue(replay.claim(self.request_id))
@@ -21,12 +21,19 @@ Key differences from v1, mapped to the bugs they fix:
   a ``conflicts[]`` entry with the server snapshot for the mobile UI to resolve.
 * Cursor-based pagination so a fresh device sync can stream tens of thousands
   of records without OOM/timeout.
+* Client ids resolve across pushes: creates are recorded in Sync ID Map per
+  device, so dependent records can be pushed before the parent's response
+  has been remapped on the phone (see ``id_map.py``).
+* Idempotent push replays: a push tagged with a client ``request_id`` is
+  answered from a short-lived cache when retried, so a lost response never
+  re-applies updates/deletes (see ``replay.py``).
 """
 
 from __future__ import annotations
 
 import base64
 import json
+from itertools import groupby
 from typing import Any
 
 import frappe
@@ -53,16 +60,21 @@ except ImportError:
 			"frappe.rate_limit unavailable — sync endpoints run without rate-limiting"
 		)
 
+from farmlink.supply_chain import purchase_anomalies
+from farmlink.sync import id_map, replay
 from farmlink.sync.audit import record_session, safe_extract_client_meta
 from farmlink.sync.dependency_order import (
 	DOCTYPE_MAPPINGS,
 	LINK_FIELD_MAPPINGS,
 	PROCESSING_ORDER,
 	REVERSE_DOCTYPE_MAPPINGS,
+	plan_creates,
 )
+from farmlink.sync.link_cache import LinkCache
 from farmlink.sync.serializers import (
 	from_payload,
 	list_child_tables,
+	merge_child_rows,
 	sync_version_of,
 	to_payload,
 )
@@ -212,13 +224,32 @@ def _pull_impl(since=None, cursor=None, page_size=None, doctypes=None):
 
 @frappe.whitelist(methods=["POST"])
 @_rate_limit(key="user", limit=_RATE_LIMIT_PER_MIN, seconds=60)
-def push(changes=None):
+def push(changes=None, request_id=None, device_id=None):
 	started = now_datetime()
 	body_for_meta = _request_body() if frappe.request and changes is None else {}
 	client_version, network_type = safe_extract_client_meta(body_for_meta)
+	request_id = replay.normalize_request_id(
+		request_id if request_id is not None else body_for_meta.get("request_id")
+	)
+
+	# A retried batch the server already applied: answer from the replay cache
+	# without re-running creates/updates/deletes or writing a session row. A
+	# retry of a batch that is still running is refused (PushInProgress).
+	replayed = replay.get_replayed_result(request_id)
+	if replayed is None and not replay.claim(request_id):
+		# Another attempt claimed it between the lookup and the claim.
+		replayed = replay.get_replayed_result(request_id)
+	if replayed is not None:
+		frappe.logger("farmlink.sync").info(
+			f"push replay served from cache (user={frappe.session.user}, request_id={request_id})"
+		)
+		return replayed
 
 	try:
-		result = _push_impl(changes=changes)
+		result = _push_impl(changes=changes, device_id=device_id)
+		# Only cache once the batch is durably committed; a rolled-back push
+		# drops its claim and is re-executed on retry, not replayed.
+		frappe.db.after_commit.add(lambda: replay.store_result(request_id, result))
 		processed = result.get("processed") or {}
 		records_pushed = 0
 		for bucket in processed.values():
@@ -250,33 +281,53 @@ def push(changes=None):
 		raise
 
 
-def _push_impl(changes=None):
+def _push_impl(changes=None, device_id=None):
 	if changes is None:
 		body = _request_body() if frappe.request else {}
 		incoming: dict[str, dict[str, Any]] = body.get("changes", {}) or {}
+		if device_id is None:
+			device_id = body.get("device_id")
 	else:
 		incoming = changes or {}
+	device_id = id_map.resolve_device_id(device_id)
 
 	processed: dict[str, dict[str, list]] = {}
 	conflicts: list[dict] = []
 	failed: list[dict] = []
+	# Seed with mappings from this device's earlier pushes so a child can
+	# reference a parent whose push response never made it back to the phone.
 	id_mappings: dict[str, dict[str, str]] = {table: {} for table in PROCESSING_ORDER}
+	for table, mapped in id_map.preload(device_id, incoming).items():
+		id_mappings.setdefault(table, {}).update(mapped)
+	# One IN query per link target doctype instead of one lookup per field per row.
+	link_cache = LinkCache()
+	link_cache.preload_for_push(incoming, id_mappings)
 
 	for mobile_table in PROCESSING_ORDER:
-		table_changes = incoming.get(mobile_table)
-		if not table_changes:
-			continue
-		doctype = DOCTYPE_MAPPINGS[mobile_table]
-		processed[mobile_table] = {"created": [], "updated": [], "deleted": []}
+		if incoming.get(mobile_table):
+			processed[mobile_table] = {"created": [], "updated": [], "deleted": []}
 
+	# Creates go in per-record dependency order across all tables, so a child
+	# row whose parent is in the same batch always finds it already inserted.
+	ordered_creates, deferred_links = plan_creates(incoming)
+	for mobile_table, group in groupby(ordered_creates, key=lambda item: item[0]):
 		_handle_creates(
-			doctype,
+			DOCTYPE_MAPPINGS[mobile_table],
 			mobile_table,
-			table_changes.get("created") or [],
+			[raw for _table, raw in group],
 			processed[mobile_table],
 			failed,
 			id_mappings,
+			link_cache,
 		)
+	_apply_deferred_links(deferred_links, processed, failed, id_mappings)
+
+	for mobile_table in PROCESSING_ORDER:
+		table_changes = incoming.get(mobile_table)
+		if not table_changes:
+			continue
+		doctype = DOCTYPE_MAPPINGS[mobile_table]
+
 		_handle_updates(
 			doctype,
 			mobile_table,
@@ -285,14 +336,30 @@ def _push_impl(changes=None):
 			conflicts,
 			failed,
 			id_mappings,
+			link_cache,
 		)
 		_handle_deletes(
 			doctype,
+			mobile_table,
 			table_changes.get("deleted") or [],
 			processed[mobile_table],
 			failed,
+			id_mappings,
 		)
 
+	id_map.persist(device_id, processed)
+
+	# Rescan the center/day groups the pushed purchases fall in once this commits.
+	pushed_purchases = processed.get("purchases") or {}
+	purchase_anomalies.enqueue_for_purchases(
+		[
+			entry["name"]
+			for bucket in ("created", "updated")
+			for entry in pushed_purchases.get(bucket) or []
+			if entry.get("name")
+		]
+	)
+
 	return {
 		"server_time": now_datetime().isoformat(),
 		"processed": processed,
@@ -555,6 +622,7 @@ def _handle_creates(
 	bucket: dict,
 	failed: list,
 	id_mappings: dict,
+	link_cache: LinkCache,
 ) -> None:
 	for raw in creates:
 		client_id = raw.get("client_id") or raw.get("id") or raw.get("name")
@@ -566,7 +634,9 @@ def _handle_creates(
 			if "name" in payload:
 				doc_dict["__newname"] = payload["name"]
 			doc = frappe.get_doc(doc_dict)
+			link_cache.validate(doc)
 			doc.insert()
+			link_cache.add(doc)
 			frappe_name = doc.name
 			bucket["created"].append(
 				{
@@ -623,6 +693,50 @@ def _handle_creates(
 			)
 
 
+def _apply_deferred_links(
+	deferred: list,
+	processed: dict,
+	failed: list,
+	id_mappings: dict,
+) -> None:
+	"""Patch links that were nulled to break a dependency cycle in this push.
+
+	Runs in the same transaction as the inserts. If either side failed to
+	insert, the link stays empty — the mobile re-sends it on its next update
+	push, which is what happened for every cycle before per-record ordering.
+	"""
+	for mobile_table, raw, field, target_client_id in deferred:
+		doctype = DOCTYPE_MAPPINGS[mobile_table]
+		client_id = raw.get("client_id") or raw.get("id") or raw.get("name")
+		name = id_mappings.get(mobile_table, {}).get(client_id)
+		target_table = (LINK_FIELD_MAPPINGS.get(mobile_table) or {}).get(field)
+		target_name = id_mappings.get(target_table, {}).get(target_client_id)
+		if not name or not target_name:
+			continue
+		try:
+			frappe.db.set_value(doctype, name, field, target_name)
+			# The patch bumped ``modified``; hand the mobile the new version so
+			# its next update isn't flagged as a conflict against ourselves.
+			current = frappe.db.get_value(doctype, name, "modified", as_dict=True)
+			for entry in processed[mobile_table]["created"]:
+				if entry.get("name") == name:
+					entry["sync_version"] = sync_version_of(current)
+		except Exception as exc:
+			frappe.log_error(
+				message=f"v2.push link fix-up {doctype} {name}.{field}: {exc}",
+				title="FarmLink Sync v2",
+			)
+			failed.append(
+				{
+					"doctype": doctype,
+					"client_id": client_id,
+					"name": name,
+					"code": "LINK_FIXUP",
+					"message": str(exc)[:200],
+				}
+			)
+
+
 def _handle_updates(
 	doctype: str,
 	mobile_table: str,
@@ -631,9 +745,10 @@ def _handle_updates(
 	conflicts: list,
 	failed: list,
 	id_mappings: dict,
+	link_cache: LinkCache,
 ) -> None:
 	for raw in updates:
-		name = raw.get("name") or raw.get("frappe_id")
+		name = id_map.resolve_name(raw.get("name") or raw.get("frappe_id"), mobile_table, id_mappings)
 		base_version = raw.get("base_version") or 0
 		if not name:
 			failed.append(
@@ -669,15 +784,22 @@ def _handle_updates(
 				)
 				continue
 			_resolve_links_in_place(raw, mobile_table, id_mappings)
-			payload = from_payload(raw, doctype)
+			payload = from_payload(raw, doctype, keep_child_names=True)
+			child_fields = {fname for fname, _ in list_child_tables(doctype)}
 			for field, value in payload.items():
 				if field in ("name", "doctype"):
 					continue
 				try:
+					if field in child_fields:
+						# Diff against the stored rows so unchanged children keep
+						# their names instead of being deleted and re-inserted.
+						merge_child_rows(doc, field, value)
+						continue
 					doc.set(field, value)
 				except Exception:
 					# Field type mismatch — log and skip rather than aborting the whole push.
 					continue
+			link_cache.validate(doc)
 			doc.save()
 			bucket["updated"].append(
 				{"name": doc.name, "sync_version": sync_version_of(doc)}
@@ -708,12 +830,15 @@ def _handle_updates(
 
 def _handle_deletes(
 	doctype: str,
+	mobile_table: str,
 	deletes: list,
 	bucket: dict,
 	failed: list,
+	id_mappings: dict,
 ) -> None:
 	for ref in deletes:
 		name = ref if isinstance(ref, str) else (ref or {}).get("name")
+		name = id_map.resolve_name(name, mobile_table, id_mappings)
 		if not name:
 			continue
 		try:
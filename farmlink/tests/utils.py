@@ -0,0 +1,58 @@
+# Copyright (c) 2026, vulerotech and Contributors
+# See license.txt
+
+"""Fixture builders shared by the farmlink test cases."""
+
+import frappe
+
+
+def make_territory(name: str) -> str:
+	if not frappe.db.exists("Territory", name):
+		frappe.get_doc({"doctype": "Territory", "territory_name": name}).insert()
+	return name
+
+
+def make_center(name: str, territory: str | None = None) -> str:
+	if not frappe.db.exists("Centers", name):
+		frappe.get_doc({"doctype": "Centers", "name1": name, "territory": territory}).insert()
+	return name
+
+
+def make_farmer(territory: str | None = None, **fields):
+	"""Insert a farmer; the middle name defaults to a random one so names stay unique."""
+	return frappe.get_doc(
+		{
+			"doctype": "Farmers",
+			"first_name": "Test",
+			"middle_name": frappe.generate_hash(length=6),
+			"territory": territory,
+			**fields,
+		}
+	).insert()
+
+
+def make_purchase(farmer: str, center: str | None = None, weight=10, rate=100, total=None, **fields):
+	"""Insert a purchase; the total defaults to rate x weight."""
+	return frappe.get_doc(
+		{
+			"doctype": "Purchases",
+			"farmer": farmer,
+			"collection_center": center,
+			"weight_in_kg": weight,
+			"price_rate_of_the_day": rate,
+			"total_price": weight * rate if total is None else total,
+			**fields,
+		}
+	).insert()
+
+
+def make_payment(purchase: str, amount, **fields):
+	return frappe.get_doc(
+		{
+			"doctype": "Payment",
+			"purchase_invoice": purchase,
+			"payment_amount": amount,
+			"mode_of_payment": "Cash",
+			**fields,
+		}
+	).insert()
@@ -0,0 +1,54 @@
+"""
+Status-tracked batch documents on the long worker.
+
+Payout Batch, Statement Import and Farmer Import each do their work in one
+long job per document. ``enqueue`` moves a Draft or Failed document to Queued
+and queues ``run`` for after the request commits; ``run`` calls the work
+function and records Completed, with the counters it returns, or Failed, with
+the traceback in ``log``.
+"""
+
+import frappe
+from frappe import _
+
+
+def enqueue(doc, work: str, timeout: int) -> dict:
+	"""Queue ``work`` (a dotted path taking the document) for a Draft or Failed ``doc``."""
+	doc.check_permission("write")
+	if doc.status not in ("Draft", "Failed"):
+		frappe.throw(_("{0} {1} is already {2}").format(_(doc.doctype), doc.name, doc.status))
+	doc.db_set({"status": "Queued", "log": None})
+	frappe.enqueue(
+		"farmlink.utils.background_jobs.run",
+		queue="long",
+		timeout=timeout,
+		job_id=f"farmlink-{frappe.scrub(doc.doctype)}-{doc.name}",
+		deduplicate=True,
+		enqueue_after_commit=True,
+		doctype=doc.doctype,
+		docname=doc.name,
+		work=work,
+	)
+	return {"status": "Queued"}
+
+
+def run(doctype: str, docname: str, work: str) -> dict | None:
+	"""Background job: run ``work(doc)`` and record Completed or Failed on the document.
+
+	On an error everything ``work`` has not committed itself is rolled back.
+	"""
+	doc = frappe.get_doc(doctype, docname)
+	try:
+		result = frappe.get_attr(work)(doc)
+	except Exception:
+		frappe.db.rollback()
+		frappe.db.set_value(doctype, docname, {"status": "Failed", "log": frappe.get_traceback()})
+		frappe.db.commit()
+		frappe.log_error(
+			title=f"{doctype} {docname} failed", reference_doctype=doctype, reference_name=docname
+		)
+		return None
+
+	frappe.db.set_value(doctype, docname, {**result, "status": "Completed"})
+	frappe.db.commit()
+	return result
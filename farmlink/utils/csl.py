@@ -1,12 +1,30 @@
 # utils/csl.py
 import frappe
 from frappe import _
+from frappe.model.naming import make_autoname
 from frappe.utils import now_datetime, flt
 
+from farmlink.supply_chain import stock_balance, stock_snapshot
+
 CSL = "Coffee Stock Ledger"
 
+# Columns needed to move a ledger row's quantity in/out of its balance bucket
+# (posting_time tells stock_snapshot which past days the change rewrites).
+_BALANCE_ROW_FIELDS = ["name", "entry_type", "qty_kg", "posting_time", *stock_balance.BUCKET_FIELDS]
+
 
 def _net_sum_query(filters: dict, include_status=False) -> float:
+    # Balance-level questions are answered from the materialized Coffee Stock
+    # Balance; only per-document sums (reference_doctype/name) scan the ledger.
+    if not filters.get("reference_doctype") and not filters.get("reference_name"):
+        return stock_balance.get_balance(
+            center=filters.get("center"),
+            coffee_form=filters.get("coffee_form"),
+            coffee_grade=filters.get("coffee_grade"),
+            batch_ref=filters.get("batch_ref"),
+            status=filters.get("status") if include_status else None,
+        )
+
     clauses = ["is_cancelled=0"]
     params = []
 
@@ -55,6 +73,20 @@ def center_balance(*, center, form, batch_ref=None, coffee_grade=None, status=No
     )
 
 
+@frappe.whitelist()
+def get_stock_position(centers):
+    """Full stock matrix per center: ``{center: {form: {grade: {status: kg}}}}``.
+
+    ``centers`` is one center name or a list (JSON-encoded from the client).
+    """
+    if isinstance(centers, str):
+        centers = frappe.parse_json(centers) if centers.lstrip().startswith("[") else [centers]
+    centers = sorted({center for center in centers or [] if center})
+    if not centers:
+        return {}
+    return stock_balance.stock_position(centers)
+
+
 @frappe.whitelist()
 def sum_csl_qty(
     *, center, status, form, batch_ref=None, ref_dt=None, ref_dn=None, coffee_grade=None
@@ -74,10 +106,13 @@ def sum_csl_qty(
     )
 
 
-def _validate_out_qty(center, form, qty, batch_ref=None, coffee_grade=None):
-    available = center_balance(
-        center=center, form=form, batch_ref=batch_ref, coffee_grade=coffee_grade
-    )
+def _validate_out_qty(center, form, qty, batch_ref=None, coffee_grade=None, own_qty=0):
+    # own_qty: OUT already posted by the same document in this bucket, which the
+    # new posting replaces rather than adds to. The balance is read under a row
+    # lock held until commit, so parallel OUTs on the same stock serialize here.
+    available = stock_balance.lock_balance(
+        center=center, coffee_form=form, coffee_grade=coffee_grade, batch_ref=batch_ref
+    ) + flt(own_qty)
     if qty > available:
         frappe.throw(
             _("Not enough stock at {0} for {1}. Available: {2}, requested: {3}").format(
@@ -149,13 +184,20 @@ def record_transfer(
         "entry_type": entry_type,
     }
 
-    existing = frappe.db.get_value(CSL, filters, "name")
+    deltas = {}
+    stock_balance.add_row_delta(deltas, payload)
+
+    existing = frappe.db.get_value(CSL, filters, _BALANCE_ROW_FIELDS, as_dict=True)
     if existing:
-        frappe.db.set_value(CSL, existing, payload)
-        return existing
+        stock_balance.add_row_delta(deltas, existing, sign=-1)
+        stock_snapshot.mark_dirty([existing.posting_time])
+        frappe.db.set_value(CSL, existing.name, payload)
+        stock_balance.apply_deltas(deltas)
+        return existing.name
 
     doc = frappe.get_doc({"doctype": CSL, **payload})
     doc.insert(ignore_permissions=True)
+    stock_balance.apply_deltas(deltas)
     return doc.name
 
 
@@ -172,10 +214,256 @@ def reverse_entries(ref_dt, ref_dn, entry_ref=None, entry_type=None):
     if entry_type:
         filters["entry_type"] = entry_type.upper()
 
-    names = frappe.get_all(CSL, filters=filters, pluck="name")
-    for name in names:
-        frappe.db.set_value(CSL, name, "is_cancelled", 1)
-    return names
+    rows = frappe.get_all(CSL, filters=filters, fields=_BALANCE_ROW_FIELDS)
+    cancel_rows(rows)
+    return [row.name for row in rows]
+
+
+def cancel_rows(rows):
+    """Flag ledger rows cancelled and take their quantity out of the balance table.
+
+    ``rows`` must carry ``_BALANCE_ROW_FIELDS``.
+    """
+    if not rows:
+        return
+    deltas = {}
+    for row in rows:
+        stock_balance.add_row_delta(deltas, row, sign=-1)
+    frappe.db.set_value(CSL, {"name": ["in", [row.name for row in rows]]}, "is_cancelled", 1)
+    stock_balance.apply_deltas(deltas)
+    stock_snapshot.mark_dirty([row.get("posting_time") for row in rows])
+
+
+# ---------- set-based posting per source document ----------
+
+# Columns a handler controls; a live row whose values all match is left alone.
+_ENTRY_FIELDS = (
+    "center",
+    "from_center",
+    "to_center",
+    "status",
+    "coffee_form",
+    "coffee_grade",
+    "batch_ref",
+    "qty_kg",
+    "remarks",
+)
+_EXISTING_ROW_FIELDS = [*_BALANCE_ROW_FIELDS, "entry_ref", "from_center", "to_center", "remarks"]
+_UPSERT_FIELDS = (
+    "name",
+    "creation",
+    "modified",
+    "owner",
+    "modified_by",
+    "naming_series",
+    "posting_time",
+    "entry_type",
+    "entry_ref",
+    "reference_doctype",
+    "reference_name",
+    "is_cancelled",
+    *_ENTRY_FIELDS,
+)
+# Never overwritten when an upsert hits an existing row.
+_INSERT_ONLY_FIELDS = {"name", "creation", "owner", "naming_series"}
+
+
+def _entry_row(ref_dt, ref_dn, entry):
+    """Normalize a handler entry (``record_transfer`` keyword names) into CSL columns."""
+    entry_type = (entry.get("entry_type") or "").upper()
+    if entry_type not in ("IN", "OUT"):
+        frappe.throw(_("Entry Type must be IN or OUT"))
+    return frappe._dict(
+        entry_type=entry_type,
+        entry_ref=entry.get("entry_ref") or "",
+        reference_doctype=ref_dt,
+        reference_name=ref_dn,
+        center=entry.get("center"),
+        from_center=entry.get("from_center"),
+        to_center=entry.get("to_center"),
+        status=entry.get("status"),
+        coffee_form=entry.get("form"),
+        coffee_grade=entry.get("coffee_grade"),
+        batch_ref=entry.get("batch_ref"),
+        qty_kg=flt(entry.get("qty")),
+        remarks=entry.get("remarks") or "",
+    )
+
+
+def _row_changed(current, desired) -> bool:
+    for field in _ENTRY_FIELDS:
+        if field == "qty_kg":
+            if abs(flt(current.qty_kg) - desired.qty_kg) > 1e-9:
+                return True
+        elif (current.get(field) or "") != (desired.get(field) or ""):
+            return True
+    return False
+
+
+def _validate_out_entries(desired_rows, existing_rows):
+    """Check OUT postings per bucket against the balance, counting this
+    document's current OUT rows as available since they are being replaced."""
+
+    def matches(row, bucket):
+        center, form, batch_ref, coffee_grade = bucket
+        return (
+            row.entry_type == "OUT"
+            and row.center == center
+            and row.coffee_form == form
+            and (batch_ref is None or row.batch_ref == batch_ref)
+            and (coffee_grade is None or row.coffee_grade == coffee_grade)
+        )
+
+    buckets = {
+        (row.center, row.coffee_form, row.batch_ref, row.coffee_grade)
+        for row in desired_rows
+        if row.entry_type == "OUT"
+    }
+    for bucket in sorted(buckets, key=lambda b: tuple(v or "" for v in b)):
+        center, form, batch_ref, coffee_grade = bucket
+        _validate_out_qty(
+            center=center,
+            form=form,
+            qty=sum(row.qty_kg for row in desired_rows if matches(row, bucket)),
+            batch_ref=batch_ref,
+            coffee_grade=coffee_grade,
+            own_qty=sum(flt(row.qty_kg) for row in existing_rows if matches(row, bucket)),
+        )
+
+
+def _upsert_rows(rows):
+    """Insert new rows and rewrite changed ones in a single multi-row statement."""
+    if not rows:
+        return
+    columns = ", ".join(f"`{field}`" for field in _UPSERT_FIELDS)
+    placeholders = "(" + ", ".join(["%s"] * len(_UPSERT_FIELDS)) + ")"
+    updates = ", ".join(
+        f"`{field}` = VALUES(`{field}`)" for field in _UPSERT_FIELDS if field not in _INSERT_ONLY_FIELDS
+    )
+    params = []
+    for row in rows:
+        params.extend(row.get(field) for field in _UPSERT_FIELDS)
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tab{CSL}` ({columns})
+        VALUES {", ".join([placeholders] * len(rows))}
+        ON DUPLICATE KEY UPDATE {updates}
+        """,
+        params,
+    )
+
+
+def _change(action, row, old, new):
+    return {
+        "action": action,
+        "entry_type": row.entry_type,
+        "entry_ref": row.entry_ref or "",
+        "center": row.center,
+        "coffee_form": row.coffee_form,
+        "coffee_grade": row.coffee_grade,
+        "status": row.status,
+        "old_qty": flt(old.qty_kg) if old else 0.0,
+        "new_qty": flt(new.qty_kg) if new else 0.0,
+    }
+
+
+def post_entries(ref_dt, ref_dn, entries):
+    """
+    Make the live CSL rows of one document match ``entries`` exactly.
+    - entries: dicts with ``record_transfer`` keywords (center, status, form,
+      qty, entry_type, entry_ref, ...); rows with qty <= 0 are dropped
+    - existing rows are loaded once and matched on (entry_type, entry_ref);
+      unchanged rows are not touched, changed and new rows go out as one
+      upsert, rows no longer wanted are cancelled in one update
+    - the balance table gets a single set of deltas for the whole document
+    - frappe.flags.in_stock_repost skips the OUT check: a repost re-derives
+      history and documents are not replayed in their original order
+    Returns ``{"inserted": [...], "updated": [...], "cancelled": [...],
+    "changes": [...]}``; each change names the entry and its old/new qty.
+    """
+    desired = {}
+    for entry in entries or []:
+        row = _entry_row(ref_dt, ref_dn, entry)
+        if row.qty_kg > 0:
+            desired[(row.entry_type, row.entry_ref)] = row
+
+    existing_rows = frappe.get_all(
+        CSL,
+        filters={"reference_doctype": ref_dt, "reference_name": ref_dn, "is_cancelled": 0},
+        fields=_EXISTING_ROW_FIELDS,
+        order_by="creation asc",
+    )
+    existing = {}
+    stale = []
+    for row in existing_rows:
+        key = (row.entry_type, row.entry_ref or "")
+        if key in existing:
+            # Duplicate live rows for one ref can only come from older code paths.
+            stale.append(row)
+        else:
+            existing[key] = row
+
+    inserts, updates = [], []
+    for key, row in desired.items():
+        current = existing.pop(key, None)
+        if current is None:
+            inserts.append(row)
+        elif _row_changed(current, row):
+            row.name = current.name
+            updates.append((current, row))
+    stale.extend(existing.values())
+
+    result = {
+        "inserted": [],
+        "updated": [current.name for current, _row in updates],
+        "cancelled": [row.name for row in stale],
+        "changes": [
+            *(_change("inserted", row, None, row) for row in inserts),
+            *(_change("updated", row, current, row) for current, row in updates),
+            *(_change("cancelled", row, row, None) for row in stale),
+        ],
+    }
+    if not inserts and not updates and not stale:
+        return result
+
+    # Every center this document touches, locked in one sorted pass before the
+    # OUT check and the balance write lock them again.
+    stock_balance.lock_centers(
+        row.center
+        for row in [*inserts, *stale, *(r for pair in updates for r in pair)]
+    )
+    needs_out_check = any(row.entry_type == "OUT" for row in inserts) or any(
+        row.entry_type == "OUT" for _current, row in updates
+    )
+    if needs_out_check and not frappe.flags.in_stock_repost:
+        _validate_out_entries(list(desired.values()), existing_rows)
+
+    now = now_datetime()
+    user = frappe.session.user
+    deltas = {}
+    for row in inserts:
+        # Hash names, not a naming series: a Series row would be locked by every
+        # posting at every center until commit and serialize unrelated centers.
+        row.update(name=make_autoname("hash", CSL), creation=now, owner=user)
+        result["inserted"].append(row.name)
+    for current, _row in updates:
+        stock_balance.add_row_delta(deltas, current, sign=-1)
+    written = inserts + [row for _current, row in updates]
+    for row in written:
+        row.update(modified=now, modified_by=user, posting_time=now, is_cancelled=0)
+        stock_balance.add_row_delta(deltas, row)
+    _upsert_rows(written)
+
+    if stale:
+        for row in stale:
+            stock_balance.add_row_delta(deltas, row, sign=-1)
+        frappe.db.set_value(CSL, {"name": ["in", result["cancelled"]]}, "is_cancelled", 1)
+
+    stock_balance.apply_deltas(deltas)
+    stock_snapshot.mark_dirty(
+        [current.posting_time for current, _row in updates] + [row.posting_time for row in stale]
+    )
+    return result
 
 
 # Backwards compatibility wrapper
@@ -0,0 +1,372 @@
+"""
+Duplicate farmer detection and merging.
+
+Offline registration on several phones leaves the same farmer on file more
+than once, with the name spelt a little differently or a second phone
+number. Comparing every farmer with every other is quadratic, so ``scan``
+only compares farmers that share a block:
+
+	(territory, first 5 digits of a normalized phone)
+	(territory, phonetic key of the first two name parts)
+
+Blocks are scored on a process pool. The workers get plain tuples and never
+touch the database. A pair's score is the name similarity
+(``difflib.SequenceMatcher`` over the sorted name parts). When both farmers
+have phones it is blended with phone agreement. Pairs at or above
+``MATCH_THRESHOLD`` are joined into clusters with union-find, and each cluster
+becomes a Farmer Duplicate Cluster for review. The oldest record is proposed
+as the one to keep.
+
+A rescan replaces the Open clusters. A member set that was Dismissed or
+Merged before is not raised again.
+
+``merge_cluster`` re-points every Link and Dynamic Link to Farmers, read
+from meta (Custom Fields included, ``ignore_links_on_delete`` doctypes left
+out), from the duplicates to the kept farmer. It runs one ``UPDATE`` per
+field, refreshes the columns fetched through that link (Purchases.phone) and
+bumps ``modified`` so the mobile apps pull the change. It then deletes the
+duplicates (recording sync tombstones) in the same transaction.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+from itertools import combinations
+from multiprocessing import get_context
+
+import frappe
+from frappe import _
+from frappe.model.rename_doc import get_link_fields
+from frappe.utils import cint, now_datetime
+
+from farmlink.api import farmer_profile
+from farmlink.api.farmer_search import name_tokens, normalize_phone, phonetic
+
+CLUSTER = "Farmer Duplicate Cluster"
+
+MATCH_THRESHOLD = 0.85
+PHONE_BLOCK_DIGITS = 5
+# Blocks bigger than this are usually a shared placeholder phone or a very
+# common name; comparing them all would dominate the run for few real hits.
+MAX_BLOCK_SIZE = 300
+MAX_WORKERS = 4
+
+_LOAD_CHUNK = 10000
+_BLOCKS_PER_TASK = 200
+_PHONE_FIELDS = ("phone_number", "secondary_phone", "telebirr_phone_number")
+
+
+# ---------- scoring (runs in worker processes) ----------
+
+
+def _name_key(full_name) -> str:
+	return " ".join(sorted(name_tokens(full_name)))
+
+
+def pair_score(a, b) -> float:
+	"""Similarity of two ``(name, name_key, phones)`` tuples, 0..1."""
+	names = SequenceMatcher(None, a[1], b[1]).ratio()
+	if not a[2] or not b[2]:
+		return names
+	phones = 1.0 if set(a[2]) & set(b[2]) else 0.0
+	return 0.6 * names + 0.4 * phones
+
+
+def score_blocks(blocks) -> list[tuple[str, str, float]]:
+	"""Worker task: every pair in each block scoring at or above the threshold."""
+	matches = []
+	for block in blocks:
+		for a, b in combinations(block, 2):
+			score = pair_score(a, b)
+			if score >= MATCH_THRESHOLD:
+				matches.append((*sorted((a[0], b[0])), score))
+	return matches
+
+
+# ---------- scan ----------
+
+
+@frappe.whitelist()
+def enqueue_scan(territory=None):
+	"""Queue a duplicate scan (whole register, or one territory) on the long worker."""
+	frappe.has_permission(CLUSTER, "create", throw=True)
+	frappe.enqueue(
+		"farmlink.utils.farmer_dedup.scan",
+		queue="long",
+		timeout=4 * 3600,
+		job_id=f"farmlink-farmer-dedup-{territory or 'all'}",
+		deduplicate=True,
+		enqueue_after_commit=True,
+		territory=territory,
+	)
+	return {"status": "Queued"}
+
+
+def _load_farmers(territory=None) -> list:
+	farmers = []
+	last = ""
+	condition = "AND territory = %(territory)s" if territory else ""
+	while True:
+		rows = frappe.db.sql(
+			f"""
+			SELECT name, full_name, territory, creation, {", ".join(_PHONE_FIELDS)}
+			FROM `tabFarmers`
+			WHERE name > %(last)s {condition}
+			ORDER BY name
+			LIMIT %(limit)s
+			""",
+			{"last": last, "territory": territory, "limit": _LOAD_CHUNK},
+			as_dict=True,
+		)
+		farmers.extend(rows)
+		if len(rows) < _LOAD_CHUNK:
+			return farmers
+		last = rows[-1].name
+
+
+def build_blocks(farmers) -> tuple[list[list[tuple]], int]:
+	"""Group farmers into comparison blocks; returns (blocks, oversized block count)."""
+	blocks: dict[tuple, list[tuple]] = {}
+	for farmer in farmers:
+		phones = tuple(
+			sorted(
+				{
+					phone
+					for phone in (normalize_phone(farmer.get(f)) for f in _PHONE_FIELDS)
+					if len(phone) >= 6
+				}
+			)
+		)
+		name_key = _name_key(farmer.full_name)
+		record = (farmer.name, name_key, phones)
+		territory = farmer.territory or ""
+		keys = {("phone", territory, phone[:PHONE_BLOCK_DIGITS]) for phone in phones}
+		sounds = [code for code in map(phonetic, name_tokens(farmer.full_name)[:2]) if code]
+		if sounds:
+			keys.add(("name", territory, *sounds))
+		for key in keys:
+			blocks.setdefault(key, []).append(record)
+
+	comparable = [block for block in blocks.values() if 1 < len(block) <= MAX_BLOCK_SIZE]
+	oversized = sum(1 for block in blocks.values() if len(block) > MAX_BLOCK_SIZE)
+	return comparable, oversized
+
+
+def _score_all(blocks, workers) -> dict[tuple[str, str], float]:
+	tasks = [blocks[i : i + _BLOCKS_PER_TASK] for i in range(0, len(blocks), _BLOCKS_PER_TASK)]
+	if workers <= 1 or len(tasks) <= 1:
+		results = map(score_blocks, tasks)
+		return _best_pairs(results)
+	# spawn, not fork: the children must not inherit this process's DB connection.
+	with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+		return _best_pairs(pool.map(score_blocks, tasks))
+
+
+def _best_pairs(results) -> dict[tuple[str, str], float]:
+	pairs: dict[tuple[str, str], float] = {}
+	for matches in results:
+		for a, b, score in matches:
+			pairs[(a, b)] = max(score, pairs.get((a, b), 0.0))
+	return pairs
+
+
+def clusters_from_pairs(pairs) -> list[set[str]]:
+	"""Connected components of the match graph (union-find with path halving)."""
+	parent: dict[str, str] = {}
+
+	def find(node):
+		parent.setdefault(node, node)
+		while parent[node] != node:
+			parent[node] = parent[parent[node]]
+			node = parent[node]
+		return node
+
+	for a, b in pairs:
+		root_a, root_b = find(a), find(b)
+		if root_a != root_b:
+			parent[max(root_a, root_b)] = min(root_a, root_b)
+	groups: dict[str, set[str]] = {}
+	for node in parent:
+		groups.setdefault(find(node), set()).add(node)
+	return sorted(groups.values(), key=min)
+
+
+def cluster_key(members) -> str:
+	return hashlib.md5("\x1f".join(sorted(members)).encode()).hexdigest()
+
+
+def scan(territory=None, workers=None) -> dict:
+	"""Find duplicate clusters and replace the Open review queue with them.
+
+	Runs as a background job, whose runner commits once it returns.
+	"""
+	farmers = _load_farmers(territory)
+	by_name = {farmer.name: farmer for farmer in farmers}
+	blocks, oversized = build_blocks(farmers)
+	workers = cint(workers) or min(os.cpu_count() or 1, MAX_WORKERS)
+	pairs = _score_all(blocks, workers)
+	clusters = clusters_from_pairs(pairs)
+
+	open_filters = {"status": "Open"}
+	if territory:
+		open_filters["territory"] = territory
+	stale = frappe.get_all(CLUSTER, filters=open_filters, pluck="name")
+	for start in range(0, len(stale), _LOAD_CHUNK):
+		chunk = stale[start : start + _LOAD_CHUNK]
+		frappe.db.delete("Farmer Duplicate Member", {"parent": ["in", chunk], "parenttype": CLUSTER})
+		frappe.db.delete(CLUSTER, {"name": ["in", chunk]})
+	reviewed = set(frappe.get_all(CLUSTER, filters={"status": ["!=", "Open"]}, pluck="cluster_key"))
+
+	best: dict[str, float] = {}
+	for (a, b), score in pairs.items():
+		best[a] = max(score, best.get(a, 0.0))
+		best[b] = max(score, best.get(b, 0.0))
+
+	created = 0
+	for members in clusters:
+		key = cluster_key(members)
+		if key in reviewed:
+			continue
+		rows = sorted((by_name[name] for name in members), key=lambda farmer: (farmer.creation, farmer.name))
+		frappe.get_doc(
+			{
+				"doctype": CLUSTER,
+				"cluster_key": key,
+				"territory": rows[0].territory,
+				"primary_farmer": rows[0].name,
+				"max_score": max(best[name] for name in members),
+				"member_count": len(rows),
+				"members": [
+					{
+						"farmer": farmer.name,
+						"full_name": farmer.full_name,
+						"phone_number": farmer.phone_number,
+						"territory": farmer.territory,
+						"score": best[farmer.name],
+					}
+					for farmer in rows
+				],
+			}
+		).insert(ignore_permissions=True)
+		created += 1
+
+	return {
+		"farmers": len(farmers),
+		"blocks": len(blocks),
+		"oversized_blocks": oversized,
+		"pairs": len(pairs),
+		"clusters": created,
+	}
+
+
+# ---------- merge ----------
+
+
+def merge_links() -> list[tuple[str, str, str | None]]:
+	"""``(doctype, field, doctype field)`` of every field that can point at a farmer.
+
+	The third item names the type column of a Dynamic Link and is None for a
+	Link. Doctypes in ``ignore_links_on_delete``, singles and virtual doctypes
+	are left out.
+	"""
+	ignored = set(frappe.get_hooks("ignore_links_on_delete"))
+	links = {(row.parent, row.fieldname, None) for row in get_link_fields("Farmers")}
+	for table, parent in (("DocField", "parent"), ("Custom Field", "dt")):
+		links.update(
+			(row[0], row[1], row[2])
+			for row in frappe.get_all(
+				table,
+				filters={"fieldtype": "Dynamic Link"},
+				fields=[parent, "fieldname", "options"],
+				as_list=True,
+			)
+		)
+	result = []
+	for doctype, field, doctype_field in sorted(links, key=lambda link: (link[0], link[1], link[2] or "")):
+		if doctype in ignored or not frappe.db.exists("DocType", doctype):
+			continue
+		meta = frappe.get_meta(doctype)
+		if meta.issingle or meta.is_virtual:
+			continue
+		result.append((doctype, field, doctype_field))
+	return result
+
+
+def _refresh_fetched(doctype: str, field: str, primary: str) -> None:
+	"""Re-read the columns ``doctype`` fetches through ``field`` from the kept farmer."""
+	columns = set(frappe.db.get_table_columns("Farmers"))
+	fetched = [
+		(df.fieldname, df.fetch_from.split(".", 1)[1])
+		for df in frappe.get_meta(doctype).get_fields_to_fetch(field)
+		if df.fetch_from.split(".", 1)[1] in columns
+	]
+	if not fetched:
+		return
+	frappe.db.sql(
+		f"""
+		UPDATE `tab{doctype}` target
+		INNER JOIN `tabFarmers` farmer ON farmer.name = target.`{field}`
+		SET {", ".join(f"target.`{column}` = farmer.`{source}`" for column, source in fetched)}
+		WHERE target.`{field}` = %s
+		""",
+		primary,
+	)
+
+
+def merge_cluster(cluster) -> dict:
+	"""Move every link from the duplicates to the kept farmer, then delete the duplicates."""
+	cluster.check_permission("write")
+	if cluster.status != "Open":
+		frappe.throw(_("Cluster {0} is already {1}").format(cluster.name, cluster.status))
+	primary = cluster.primary_farmer
+	if not primary or not frappe.db.exists("Farmers", primary):
+		frappe.throw(_("Choose the farmer to keep first"))
+	duplicates = sorted({row.farmer for row in cluster.members if row.farmer and row.farmer != primary})
+	if not duplicates:
+		frappe.throw(_("Nothing to merge"))
+	for farmer in duplicates:
+		frappe.has_permission("Farmers", "delete", farmer, throw=True)
+
+	now = now_datetime()
+	params = {"primary": primary, "duplicates": tuple(duplicates), "now": now, "user": frappe.session.user}
+	moved = {}
+	for doctype, field, doctype_field in merge_links():
+		condition = f"`{field}` IN %(duplicates)s"
+		if doctype_field:
+			condition += f" AND `{doctype_field}` = 'Farmers'"
+		count = frappe.db.sql(f"SELECT COUNT(*) FROM `tab{doctype}` WHERE {condition}", params)[0][0]
+		if not count:
+			continue
+		moved[doctype] = moved.get(doctype, 0) + count
+		frappe.db.sql(
+			f"""
+			UPDATE `tab{doctype}`
+			SET `{field}` = %(primary)s, modified = %(now)s, modified_by = %(user)s
+			WHERE {condition}
+			""",
+			params,
+		)
+		if not doctype_field:
+			_refresh_fetched(doctype, field, primary)
+
+	for farmer in duplicates:
+		if frappe.db.exists("Farmers", farmer):
+			frappe.delete_doc("Farmers", farmer, ignore_permissions=True)
+	farmer_profile.invalidate([primary, *duplicates])
+
+	log = "\n".join(
+		[f"{doctype}: {count}" for doctype, count in moved.items()]
+		+ [_("Deleted {0}").format(", ".join(duplicates))]
+	)
+	cluster.db_set(
+		{
+			"status": "Merged",
+			"merged_by": frappe.session.user,
+			"merged_on": now,
+			"merge_log": log,
+		}
+	)
+	return {"primary": primary, "merged": duplicates, "moved": moved}
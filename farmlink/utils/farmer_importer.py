@@ -0,0 +1,515 @@
+"""
+Bulk import of a cooperative's farmer register.
+
+A Farmer Import reads its CSV or XLSX one row at a time. CSV goes through
+``csv.reader`` over the open file, and XLSX through openpyxl's read-only
+``iter_rows``, so the whole register is never held in memory. Each row is
+checked against sets loaded once per run:
+
+* territories, banks and centers for the Farmers link fields;
+* Select options (naming series, gender, payment method, harvest years);
+* number, date and check columns are parsed, not trusted.
+
+Headers may be Farmers field names or labels ("Phone Number", "Series").
+``Harvest <year>`` and ``Fertilizer <year>`` columns fill the two yearly
+tables. ``Farm *`` columns (kebele, altitude, latitude, longitude, territory,
+date recorded) create a farm for the row's farmer. A row with only a
+``Register ID`` and farm columns adds a farm to the farmer already carrying
+that Register ID, whether from earlier in the file or an earlier import.
+
+Valid rows are written every ``CHUNK_SIZE`` rows, with names from one Series
+update per naming series and one ``bulk_insert`` per table. The search index
+gets the same treatment. Rows that fail are stored as Farmer Import Errors
+with the reason and the raw row. Each chunk is committed together with
+``processed_rows``, so a failed or timed-out import restarted from the form
+continues after the last committed row instead of importing twice.
+"""
+
+import csv
+import json
+import os
+import re
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, getdate, now_datetime
+from frappe.utils.file_manager import get_file_path
+
+from farmlink.api import farmer_search
+from farmlink.farmlink.doctype.farmers.farmers import join_name_parts
+from farmlink.utils import background_jobs
+from farmlink.utils.naming import reserve_names
+
+IMPORT = "Farmer Import"
+ERROR = "Farmer Import Error"
+FARM_SERIES = "LOT-.YY.-.####"
+
+CHUNK_SIZE = 1000
+_LOG_LINES = 200
+
+_VALUE_FIELDTYPES = {"Data", "Select", "Link", "Int", "Float", "Check", "Date", "Small Text"}
+_NOT_IMPORTED = {"naming_series", "full_name"}
+_CHECK_TRUE = {"1", "yes", "y", "true", "x"}
+_CHECK_FALSE = {"", "0", "no", "n", "false"}
+
+_HARVEST_RE = re.compile(r"^harvest_(\d{4})(?:_.*)?$")
+_FERTILIZER_RE = re.compile(r"^fertilizer_(\d{4})(?:_.*)?$")
+FARM_COLUMNS = (
+	"farm_territory",
+	"farm_kebele",
+	"farm_altitude",
+	"farm_latitude",
+	"farm_longitude",
+	"farm_date_recorded",
+)
+
+_BASE_FIELDS = ("name", "creation", "modified", "owner", "modified_by")
+_CHILD_FIELDS = (*_BASE_FIELDS, "docstatus", "parent", "parenttype", "parentfield", "idx", "year_in_ec")
+_FARM_FIELDS = (
+	*_BASE_FIELDS,
+	"docstatus",
+	"naming_series",
+	"farmer",
+	"territory",
+	"kebele",
+	"altitude",
+	"date_recorded",
+	"farm_center_point",
+)
+_ERROR_FIELDS = (*_BASE_FIELDS, "farmer_import", "row_no", "error", "row_data")
+
+
+class RowError(ValueError):
+	pass
+
+
+def _column(header) -> str:
+	return re.sub(r"[^a-z0-9]+", "_", str(header or "").strip().lower()).strip("_")
+
+
+def _text(value) -> str:
+	if isinstance(value, float) and value.is_integer():
+		value = int(value)
+	return "" if value is None else str(value).strip()
+
+
+def enqueue_import(doc):
+	"""Queue a Draft or Failed import on the long worker."""
+	return background_jobs.enqueue(doc, "farmlink.utils.farmer_importer.import_register", timeout=6 * 3600)
+
+
+def read_rows(path):
+	"""Yield ``(row_no, {column: value})`` from a CSV or XLSX file, streaming."""
+	if os.path.splitext(path)[1].lower() in (".xlsx", ".xlsm"):
+		from openpyxl import load_workbook
+
+		workbook = load_workbook(filename=path, read_only=True, data_only=True)
+		try:
+			rows = workbook.active.iter_rows(values_only=True)
+			headers = [_column(value) for value in next(rows, ())]
+			for row_no, values in enumerate(rows, start=2):
+				yield row_no, dict(zip(headers, values, strict=False))
+		finally:
+			workbook.close()
+		return
+
+	with open(path, newline="", encoding="utf-8-sig") as handle:
+		reader = csv.reader(handle)
+		headers = [_column(value) for value in next(reader, [])]
+		for row_no, values in enumerate(reader, start=2):
+			yield row_no, dict(zip(headers, values, strict=False))
+
+
+class RegisterSchema:
+	"""Farmers columns and every set a row is checked against, loaded once per run."""
+
+	def __init__(self, default_series):
+		meta = frappe.get_meta("Farmers")
+		self.fields = {
+			field.fieldname: field
+			for field in meta.fields
+			if field.fieldtype in _VALUE_FIELDTYPES and field.fieldname not in _NOT_IMPORTED
+		}
+		self.aliases = {_column(field.label): name for name, field in self.fields.items() if field.label}
+		self.aliases.update({name: name for name in self.fields})
+		self.aliases.update({"series": "naming_series", "naming_series": "naming_series"})
+
+		self.series = self._options(meta.get_field("naming_series").options)
+		if default_series not in self.series.values():
+			frappe.throw(_("{0} is not a Farmers naming series").format(default_series))
+		self.default_series = default_series
+
+		self.links = {}
+		for field in self.fields.values():
+			if field.fieldtype == "Link" and field.options not in self.links:
+				self.links[field.options] = {
+					name.casefold(): name
+					for name in frappe.get_all(field.options, pluck="name", order_by="name")
+				}
+		if "Territory" not in self.links:
+			self.links["Territory"] = {
+				name.casefold(): name for name in frappe.get_all("Territory", pluck="name", order_by="name")
+			}
+		self.selects = {
+			name: self._options(field.options)
+			for name, field in self.fields.items()
+			if field.fieldtype == "Select"
+		}
+		self.harvest_years = self._options(frappe.get_meta("Harvest Data").get_field("year_in_ec").options)
+
+	@staticmethod
+	def _options(options) -> dict:
+		return {
+			option.strip().casefold(): option.strip()
+			for option in (options or "").split("\n")
+			if option.strip()
+		}
+
+	def parse(self, raw: dict) -> frappe._dict:
+		"""Turn one raw row into farmer values, yearly rows and a farm; raises RowError."""
+		farmer = {}
+		harvest = []
+		fertilizer = []
+		farm = {}
+		problems = []
+		for column, value in raw.items():
+			text = _text(value)
+			if not column or not text:
+				continue
+			try:
+				if match := _HARVEST_RE.match(column):
+					year = self.harvest_years.get(match.group(1))
+					if not year:
+						raise RowError(_("no harvest year {0}").format(match.group(1)))
+					harvest.append(
+						{"year_in_ec": year, "harvested_coffee_in_kilograms": self._number(text, column)}
+					)
+				elif match := _FERTILIZER_RE.match(column):
+					fertilizer.append(
+						{
+							"year_in_ec": match.group(1),
+							"amount_of_organic_fertilizercompost_used_per_year_in_kg": self._number(
+								text, column
+							),
+						}
+					)
+				elif column in FARM_COLUMNS:
+					farm[column] = text
+				elif self.aliases.get(column) == "naming_series":
+					farmer["naming_series"] = self._choice(self.series, text, _("naming series"))
+				elif column in self.aliases:
+					fieldname = self.aliases[column]
+					farmer[fieldname] = self._value(self.fields[fieldname], text)
+			except RowError as exc:
+				problems.append(str(exc))
+		if problems:
+			raise RowError("; ".join(problems))
+		return frappe._dict(
+			farmer=farmer,
+			harvest=harvest,
+			fertilizer=fertilizer,
+			farm=self._farm(farm) if farm else None,
+		)
+
+	def _value(self, field, text):
+		if field.fieldtype == "Link":
+			return self._choice(self.links[field.options], text, _(field.label))
+		if field.fieldtype == "Select":
+			return self._choice(self.selects[field.fieldname], text, _(field.label))
+		if field.fieldtype == "Int":
+			return cint(self._number(text, field.label))
+		if field.fieldtype == "Float":
+			return self._number(text, field.label)
+		if field.fieldtype == "Check":
+			flag = text.casefold()
+			if flag not in _CHECK_TRUE | _CHECK_FALSE:
+				raise RowError(_("{0} must be yes or no").format(_(field.label)))
+			return 1 if flag in _CHECK_TRUE else 0
+		if field.fieldtype == "Date":
+			return self._date(text, field.label)
+		return text[: field.length or 140] if field.fieldtype == "Data" else text
+
+	@staticmethod
+	def _choice(options, text, label):
+		value = options.get(text.casefold())
+		if value is None:
+			raise RowError(_("unknown {0} {1}").format(label, text))
+		return value
+
+	@staticmethod
+	def _number(text, label):
+		try:
+			return flt(float(text.replace(",", "")))
+		except ValueError:
+			raise RowError(_("{0} is not a number: {1}").format(label, text)) from None
+
+	@staticmethod
+	def _date(text, label):
+		try:
+			return getdate(text.split(" ")[0])
+		except Exception:
+			raise RowError(_("{0} is not a date: {1}").format(label, text)) from None
+
+	def _farm(self, values):
+		farm = {"kebele": values.get("farm_kebele") or None}
+		if values.get("farm_territory"):
+			farm["territory"] = self._choice(
+				self.links["Territory"], values["farm_territory"], _("farm territory")
+			)
+		if values.get("farm_altitude"):
+			farm["altitude"] = self._number(values["farm_altitude"], _("farm altitude"))
+		if values.get("farm_date_recorded"):
+			farm["date_recorded"] = self._date(values["farm_date_recorded"], _("farm date recorded"))
+		if values.get("farm_latitude") or values.get("farm_longitude"):
+			lat = self._number(values.get("farm_latitude") or "", _("farm latitude"))
+			lng = self._number(values.get("farm_longitude") or "", _("farm longitude"))
+			if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+				raise RowError(_("farm coordinates out of range"))
+			farm["farm_center_point"] = json.dumps(
+				{
+					"type": "FeatureCollection",
+					"features": [
+						{
+							"type": "Feature",
+							"properties": {},
+							"geometry": {"type": "Point", "coordinates": [lng, lat]},
+						}
+					],
+				}
+			)
+		return farm
+
+
+def import_register(doc, commit=None):
+	"""Stream the register file and write it in chunks; resumes after ``processed_rows``.
+
+	``commit`` (``frappe.db.commit`` unless given) runs after each chunk.
+	"""
+	commit = commit or frappe.db.commit
+	schema = RegisterSchema(doc.farmer_series)
+	counts = {
+		"processed_rows": cint(doc.processed_rows),
+		"imported_farmers": cint(doc.imported_farmers),
+		"imported_farms": cint(doc.imported_farms),
+		"error_rows": cint(doc.error_rows),
+	}
+	log = (doc.log or "").splitlines()[:_LOG_LINES]
+	resume_after = counts["processed_rows"]
+	chunk = []
+
+	def flush():
+		if chunk:
+			written = write_chunk(doc.name, schema, chunk)
+			counts["imported_farmers"] += written["farmers"]
+			counts["imported_farms"] += written["farms"]
+			counts["error_rows"] += len(written["errors"])
+			room = max(_LOG_LINES - len(log), 0)
+			log.extend(f"{row_no}: {error}" for row_no, error in written["errors"][:room])
+			counts["processed_rows"] = chunk[-1][0]
+			chunk.clear()
+		frappe.db.set_value(IMPORT, doc.name, {**counts, "log": "\n".join(log) or None})
+		commit()
+
+	for row_no, raw in read_rows(get_file_path(doc.import_file)):
+		if row_no <= resume_after:
+			continue
+		chunk.append((row_no, raw))
+		if len(chunk) >= CHUNK_SIZE:
+			flush()
+	flush()
+	return counts
+
+
+def write_chunk(import_name, schema, rows) -> dict:
+	"""Validate and insert one chunk; returns created counts and ``[(row_no, error)]``."""
+	errors = []
+	parsed = []
+	for row_no, raw in rows:
+		if not any(_text(value) for value in raw.values()):
+			continue
+		try:
+			parsed.append((row_no, raw, schema.parse(raw)))
+		except RowError as exc:
+			errors.append((row_no, str(exc), raw))
+
+	refs = {row.farmer.get("register_id") for _no, _raw, row in parsed if row.farmer.get("register_id")}
+	by_ref = (
+		dict(
+			frappe.db.sql(
+				"SELECT register_id, name FROM `tabFarmers` WHERE register_id IN %s",
+				(tuple(refs),),
+			)
+		)
+		if refs
+		else {}
+	)
+
+	farmers = []
+	farms = []
+	for row_no, raw, row in parsed:
+		values = row.farmer
+		ref = values.get("register_id")
+		is_farmer = any(values.get(field) for field in ("first_name", "middle_name", "last_name"))
+		if not is_farmer:
+			if not (ref and row.farm):
+				errors.append((row_no, _("no farmer name, and no Register ID with farm columns"), raw))
+			elif ref not in by_ref:
+				errors.append((row_no, _("no farmer with Register ID {0}").format(ref), raw))
+			else:
+				farms.append((by_ref[ref], row.farm, None))
+			continue
+		if not values.get("middle_name"):
+			errors.append((row_no, _("Middle Name is required"), raw))
+			continue
+		if ref and ref in by_ref:
+			errors.append((row_no, _("Register ID {0} is already used").format(ref), raw))
+			continue
+		values.setdefault("naming_series", schema.default_series)
+		values["full_name"] = join_name_parts(
+			values.get("first_name"), values.get("middle_name"), values.get("last_name")
+		)
+		farmers.append(row)
+		if ref:
+			# Claimed now so a later row in this chunk can add farms to it.
+			by_ref[ref] = row
+		if row.farm:
+			farms.append((row, row.farm, values.get("territory")))
+
+	_insert_farmers(schema, farmers)
+	# Farms of farmers created in this chunk point at the row until the name is known.
+	resolved = []
+	for owner, farm, territory in farms:
+		if isinstance(owner, dict):
+			owner, territory = owner.farmer["name"], territory or owner.farmer.get("territory")
+		resolved.append((owner, farm, territory))
+	_insert_farms(resolved)
+	_insert_errors(import_name, errors)
+	return {
+		"farmers": len(farmers),
+		"farms": len(farms),
+		"errors": [(no, error) for no, error, _raw in errors],
+	}
+
+
+def _insert_farmers(schema, rows) -> None:
+	if not rows:
+		return
+	by_series = {}
+	for row in rows:
+		by_series.setdefault(row.farmer["naming_series"], []).append(row)
+	for series, group in by_series.items():
+		for name, row in zip(reserve_names(len(group), series), group, strict=True):
+			row.farmer["name"] = name
+
+	now = now_datetime()
+	user = frappe.session.user
+	fields = ["naming_series", "full_name", *sorted(schema.fields)]
+	checks = {name for name, field in schema.fields.items() if field.fieldtype == "Check"}
+	frappe.db.bulk_insert(
+		"Farmers",
+		fields=[*_BASE_FIELDS, "docstatus", *fields],
+		values=[
+			(
+				row.farmer["name"],
+				now,
+				now,
+				user,
+				user,
+				0,
+				*(row.farmer.get(field, 0 if field in checks else None) for field in fields),
+			)
+			for row in rows
+		],
+		chunk_size=CHUNK_SIZE,
+	)
+
+	for parentfield, child, key, measure in (
+		("harvest_data", "Harvest Data", "harvest", "harvested_coffee_in_kilograms"),
+		(
+			"fertilizercompost_usage",
+			"Fertilizer Usage",
+			"fertilizer",
+			"amount_of_organic_fertilizercompost_used_per_year_in_kg",
+		),
+	):
+		values = [
+			(
+				frappe.generate_hash(length=10),
+				now,
+				now,
+				user,
+				user,
+				0,
+				row.farmer["name"],
+				"Farmers",
+				parentfield,
+				idx,
+				entry["year_in_ec"],
+				entry[measure],
+			)
+			for row in rows
+			for idx, entry in enumerate(row[key], start=1)
+		]
+		if values:
+			frappe.db.bulk_insert(
+				child, fields=[*_CHILD_FIELDS, measure], values=values, chunk_size=CHUNK_SIZE
+			)
+
+	farmer_search.index_rows([row.farmer for row in rows])
+
+
+def _insert_farms(farms) -> None:
+	if not farms:
+		return
+	now = now_datetime()
+	user = frappe.session.user
+	names = reserve_names(len(farms), FARM_SERIES)
+	frappe.db.bulk_insert(
+		"Farms",
+		fields=list(_FARM_FIELDS),
+		values=[
+			(
+				name,
+				now,
+				now,
+				user,
+				user,
+				0,
+				FARM_SERIES,
+				farmer,
+				farm.get("territory") or territory,
+				farm.get("kebele"),
+				farm.get("altitude"),
+				farm.get("date_recorded"),
+				farm.get("farm_center_point"),
+			)
+			for name, (farmer, farm, territory) in zip(names, farms, strict=True)
+		],
+		chunk_size=CHUNK_SIZE,
+	)
+
+
+def _insert_errors(import_name, errors) -> None:
+	if not errors:
+		return
+	now = now_datetime()
+	user = frappe.session.user
+	frappe.db.bulk_insert(
+		ERROR,
+		fields=list(_ERROR_FIELDS),
+		values=[
+			(
+				frappe.generate_hash(length=12),
+				now,
+				now,
+				user,
+				user,
+				import_name,
+				row_no,
+				error,
+				json.dumps({key: _text(value) for key, value in raw.items() if key}, ensure_ascii=False),
+			)
+			for row_no, error, raw in errors
+		],
+		chunk_size=CHUNK_SIZE,
+	)
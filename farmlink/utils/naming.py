@@ -0,0 +1,23 @@
+"""Naming helpers for bulk inserts that bypass ``Document.insert``."""
+
+import frappe
+from frappe.model.naming import parse_naming_series
+
+
+def reserve_names(count, series):
+	"""Reserve ``count`` consecutive names of a naming series with one Series update.
+
+	The Series row stays locked until the caller commits, so this is for
+	batch jobs that write many rows of one doctype in a single transaction.
+	"""
+	prefix_part, digits = series.rsplit(".", 1)
+	prefix = parse_naming_series(prefix_part)
+	current = frappe.db.sql("SELECT `current` FROM `tabSeries` WHERE `name`=%s FOR UPDATE", (prefix,))
+	if current and current[0][0] is not None:
+		start = int(current[0][0])
+		frappe.db.sql("UPDATE `tabSeries` SET `current` = `current` + %s WHERE `name`=%s", (count, prefix))
+	else:
+		start = 0
+		frappe.db.sql("INSERT INTO `tabSeries` (`name`, `current`) VALUES (%s, %s)", (prefix, count))
+	width = len(digits)
+	return [f"{prefix}{number:0{width}d}" for number in range(start + 1, start + count + 1)]
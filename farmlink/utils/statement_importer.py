@@ -0,0 +1,225 @@
+"""
+Telebirr / bank settlement statement reconciliation.
+
+A Statement Import streams its CSV line by line (``csv.DictReader`` over the
+open file, never the whole file in memory) and matches each line to a Payment
+through an in-memory index built once per run:
+
+	transaction_number -> [(payment, amount, payment_date), ...]
+
+loaded in keyset chunks from the Payments of the statement's mode of payment.
+A line is
+
+* **Matched** when a payment with its transaction number has the same amount
+  (to the cent) and a payment date within ``date_tolerance_days``;
+* **Duplicate** when the payment it matches was already matched by an
+  earlier line or import (a line that failed to match does not count);
+* **Unmatched** otherwise, with the reason (no such transaction number,
+  amount or date differs, unreadable line).
+
+Every line is stored as a Statement Line. Lines go in with one
+``bulk_insert`` per chunk, and the counters are committed with each chunk. A
+failed run can be restarted and starts over from an empty result.
+"""
+
+import csv
+from datetime import datetime
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, getdate, now_datetime
+from frappe.utils.file_manager import get_file_path
+
+from farmlink.utils import background_jobs
+
+IMPORT = "Statement Import"
+LINE = "Statement Line"
+
+CHUNK_SIZE = 1000
+_INDEX_CHUNK = 10000
+_LOG_LINES = 200
+
+DATE_FORMATS = {
+	"yyyy-mm-dd": "%Y-%m-%d",
+	"dd-mm-yyyy": "%d-%m-%Y",
+	"dd/mm/yyyy": "%d/%m/%Y",
+	"mm/dd/yyyy": "%m/%d/%Y",
+}
+
+_LINE_FIELDS = (
+	"name",
+	"creation",
+	"modified",
+	"owner",
+	"modified_by",
+	"statement_import",
+	"line_no",
+	"transaction_number",
+	"amount",
+	"transaction_date",
+	"status",
+	"payment",
+	"reason",
+)
+
+
+def _norm_txn(value):
+	return (value or "").strip().upper()
+
+
+def _parse_amount(value):
+	text = (value or "").replace(",", "").strip()
+	if not text:
+		raise ValueError("empty amount")
+	return flt(float(text), 2)
+
+
+def _parse_date(value, fmt):
+	text = (value or "").strip().split(" ")[0].split("T")[0]
+	return datetime.strptime(text, DATE_FORMATS.get(fmt) or DATE_FORMATS["yyyy-mm-dd"]).date()
+
+
+def enqueue_import(doc):
+	"""Queue a Draft or Failed import on the long worker."""
+	return background_jobs.enqueue(
+		doc, "farmlink.utils.statement_importer.reconcile_statement", timeout=4 * 3600
+	)
+
+
+class PaymentIndex:
+	"""Hash index over Payments of one mode of payment, keyed by normalized transaction number."""
+
+	def __init__(self, mode_of_payment, exclude_import=None):
+		self.by_txn = {}
+		last = ""
+		while True:
+			rows = frappe.db.sql(
+				"""
+				SELECT name, transaction_number, payment_amount, payment_date
+				FROM `tabPayment`
+				WHERE mode_of_payment = %s AND IFNULL(transaction_number, '') != ''
+					AND docstatus < 2 AND name > %s
+				ORDER BY name
+				LIMIT %s
+				""",
+				(mode_of_payment, last, _INDEX_CHUNK),
+			)
+			for name, txn, amount, payment_date in rows:
+				self.by_txn.setdefault(_norm_txn(txn), []).append(
+					(name, flt(amount, 2), getdate(payment_date) if payment_date else None)
+				)
+			if len(rows) < _INDEX_CHUNK:
+				break
+			last = rows[-1][0]
+
+		# Payments a previous import already matched.
+		self.matched = set(
+			frappe.db.sql_list(
+				"""
+				SELECT DISTINCT payment FROM `tabStatement Line`
+				WHERE status = 'Matched' AND payment IS NOT NULL AND statement_import != %s
+				""",
+				(exclude_import or "",),
+			)
+		)
+
+	def match(self, txn, amount, txn_date, tolerance_days):
+		"""Return (status, payment, reason) for one statement line."""
+		candidates = self.by_txn.get(txn)
+		if not candidates:
+			return "Unmatched", None, _("No payment with this transaction number")
+
+		for name, paid, payment_date in candidates:
+			if abs(paid - amount) >= 0.005:
+				continue
+			if payment_date and txn_date and abs((txn_date - payment_date).days) > tolerance_days:
+				continue
+			if name in self.matched:
+				return "Duplicate", name, _("Payment {0} is already matched").format(name)
+			self.matched.add(name)
+			return "Matched", name, None
+
+		name, paid, payment_date = candidates[0]
+		return (
+			"Unmatched",
+			None,
+			_("Payment {0} has amount {1} on {2}").format(name, paid, payment_date or "-"),
+		)
+
+
+def reconcile_statement(doc, commit=None):
+	"""Stream the statement file and classify every line.
+
+	``commit`` (``frappe.db.commit`` unless given) runs after each chunk.
+	"""
+	commit = commit or frappe.db.commit
+	frappe.db.delete(LINE, {"statement_import": doc.name})
+	index = PaymentIndex(doc.source, exclude_import=doc.name)
+	tolerance = cint(doc.date_tolerance_days)
+	matched_txns = set()
+	counts = {"total_lines": 0, "matched_lines": 0, "unmatched_lines": 0, "duplicate_lines": 0}
+	log = []
+	pending = []
+
+	def flush():
+		if pending:
+			frappe.db.bulk_insert(LINE, fields=list(_LINE_FIELDS), values=pending)
+			pending.clear()
+		frappe.db.set_value(IMPORT, doc.name, {**counts, "log": "\n".join(log) or None})
+		commit()
+
+	path = get_file_path(doc.statement_file)
+	with open(path, newline="", encoding="utf-8-sig") as handle:
+		reader = csv.DictReader(handle)
+		missing = {doc.transaction_column, doc.amount_column, doc.date_column} - set(reader.fieldnames or ())
+		if missing:
+			frappe.throw(_("Statement has no column(s): {0}").format(", ".join(sorted(missing))))
+
+		now = now_datetime()
+		user = frappe.session.user
+		# Header is line 1, so data starts on line 2 as in a spreadsheet.
+		for line_no, row in enumerate(reader, start=2):
+			txn = _norm_txn(row.get(doc.transaction_column))
+			amount = txn_date = payment = None
+			try:
+				amount = _parse_amount(row.get(doc.amount_column))
+				txn_date = _parse_date(row.get(doc.date_column), doc.date_format)
+			except ValueError as exc:
+				status, reason = "Unmatched", _("Unreadable line: {0}").format(exc)
+			else:
+				if not txn:
+					status, reason = "Unmatched", _("No transaction number")
+				else:
+					# Matched first: an earlier line with a wrong amount or date stays
+					# Unmatched and must not turn the correct line into a Duplicate.
+					status, payment, reason = index.match(txn, amount, txn_date, tolerance)
+					if status == "Matched":
+						matched_txns.add(txn)
+					elif status == "Duplicate" and txn in matched_txns:
+						reason = _("Transaction number repeated in this statement")
+
+			counts["total_lines"] += 1
+			counts[f"{status.lower()}_lines"] += 1
+			if reason and status != "Matched" and len(log) < _LOG_LINES:
+				log.append(f"{line_no}: {reason}")
+			pending.append(
+				(
+					frappe.generate_hash(length=12),
+					now,
+					now,
+					user,
+					user,
+					doc.name,
+					line_no,
+					txn[:140],
+					amount,
+					txn_date,
+					status,
+					payment,
+					reason,
+				)
+			)
+			if len(pending) >= CHUNK_SIZE:
+				flush()
+		flush()
+	return counts